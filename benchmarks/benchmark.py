@@ -0,0 +1,311 @@
+#python3.6
+
+"""
+Measures the throughput, latency and memory use of batch decoding (Test),
+the single leg server (Server) and the pivot server (PivotServer).
+
+By default the benchmarks run against fake_moses.py, a local stand-in for
+the moses binary with a configurable per-token delay, so no Moses install
+or trained models are needed. Pass --moses and --working-dirs to benchmark
+a real installation instead. Results are saved as JSON and can be compared
+against an earlier run with --compare.
+
+    python3 benchmarks/benchmark.py --sentences 500 --token-delay 0.0005
+    python3 benchmarks/benchmark.py --compare benchmarks/results/old.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+import psutil
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, "..", "src"))
+
+from Test import Test
+from Server import Server
+from PivotServer import PivotServer
+from TranslationService import ServiceClient
+
+import utilities
+
+class MemorySampler(threading.Thread):
+    """ Polls the resident memory of a process tree and keeps the peak """
+    def __init__(self, pid, interval=0.05):
+        threading.Thread.__init__(self, daemon=True)
+        self.pids = pid if isinstance(pid, list) else [pid]
+        self.interval = interval
+        self.peak = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, self._tree_rss())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        return self.peak
+
+    def _tree_rss(self):
+        total = 0
+        for pid in self.pids:
+            try:
+                root = psutil.Process(pid)
+                procs = root.children(recursive=True)
+                if pid != os.getpid():
+                    procs.append(root)
+                for p in procs:
+                    total += p.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+class Benchmark(object):
+    def __init__(self, path_to_moses, working_dirs, src_file, concurrency=1, verbose=False):
+        self.path_to_moses = path_to_moses
+        self.working_dirs = working_dirs
+        self.src_file = src_file
+        self.concurrency = concurrency
+        self.verbose = verbose
+        self.sentences = [l.strip() for l in open(src_file, 'r')]
+
+    def _print(self, item):
+        if self.verbose:
+            utilities.flush_print(item)
+
+    def run_batch(self):
+        """ Decodes src_file as a batch the way Test does """
+        self._print("Benchmarking batch decoding... ")
+        working_dir = self.working_dirs[0]
+        result = self.src_file + ".translated"
+        debug = "benchmark.translation.out"
+
+        sampler = MemorySampler(os.getpid())
+        sampler.start()
+        start = time.time()
+        Test(self.path_to_moses)._translate_pivot(self.src_file, working_dir,
+            result, working_dir + "/mert-work", debug)
+        elapsed = time.time() - start
+        peak = sampler.stop()
+
+        latencies = self._parse_decode_times(working_dir + "/" + debug)
+        self._print("Done\n")
+        return self._summarize(len(self.sentences), elapsed, latencies, peak)
+
+    def _parse_decode_times(self, logfile):
+        """ Reads per-sentence decode times from the decoder's stderr """
+        latencies = []
+        for line in open(logfile, 'r'):
+            if "Translation took" in line:
+                latencies.append(float(line.split("took")[1].split()[0]))
+        return latencies
+
+    def run_server(self):
+        """ Sends every sentence to a single leg through the translation service """
+        self._print("Benchmarking single leg server... ")
+        working_dir = self.working_dirs[0]
+        return self._run_service(Server(self.path_to_moses), [working_dir],
+            lambda client, text: client.translate(working_dir, text))
+
+    def run_pivot(self):
+        """ Sends every sentence through both legs of the pivot service """
+        self._print("Benchmarking pivot server... ")
+        legs = [self.working_dirs[0], self.working_dirs[-1]]
+        return self._run_service(PivotServer(self.path_to_moses), legs,
+            lambda client, text: client.pivot(legs, text))
+
+    def run_document(self):
+        """
+        Sends the sentences as one document to the pipelined pivot
+        endpoint. Latency here is that of the whole document
+        """
+        self._print("Benchmarking pipelined pivot document... ")
+        legs = [self.working_dirs[0], self.working_dirs[-1]]
+        server = PivotServer(self.path_to_moses)
+        daemon = server._load_server(legs, "benchmark.interactive.out")
+
+        sampler = MemorySampler(daemon.pids())
+        sampler.start()
+        start = time.time()
+        ServiceClient(daemon.port).pivot_document(legs, self.sentences)
+        elapsed = time.time() - start
+        peak = sampler.stop()
+
+        daemon.shutdown(wait=True)
+        self._print("Done\n")
+        return self._summarize(len(self.sentences), elapsed, [elapsed], peak)
+
+    def _run_service(self, server, working_dirs, request):
+        """
+        Starts a private daemon for working_dirs the way the interactive
+        prompt does and drives it with request(client, text)
+        """
+        start = time.time()
+        daemon = server._load_server(working_dirs, "benchmark.interactive.out")
+        startup = time.time() - start
+
+        sampler = MemorySampler(daemon.pids())
+        sampler.start()
+        local = threading.local()
+        def send(text):
+            if not hasattr(local, "client"):
+                local.client = ServiceClient(daemon.port)
+            return request(local.client, text)
+        elapsed, latencies = self._drive(send)
+        peak = sampler.stop()
+        batches = daemon.batch_stats()
+
+        daemon.shutdown(wait=True)
+        self._print("Done\n")
+        stats = self._summarize(len(self.sentences), elapsed, latencies, peak)
+        stats["startup_s"] = round(startup, 4)
+        stats["mean_batch_size"] = max(b["mean_batch_size"]
+            for leg in batches.values() for b in leg.values())
+        return stats
+
+    def _drive(self, request):
+        """
+        Sends the sentences from self.concurrency client threads. Returns
+        elapsed time and request latencies
+        """
+        latencies, lock = [], threading.Lock()
+        shares = [self.sentences[i::self.concurrency] for i in range(self.concurrency)]
+
+        def worker(share):
+            for text in share:
+                t = time.time()
+                request(text)
+                with lock:
+                    latencies.append(time.time() - t)
+
+        threads = [threading.Thread(target=worker, args=(s,)) for s in shares]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.time() - start, latencies
+
+    def _summarize(self, count, elapsed, latencies, peak_rss):
+        return {"sentences": count,
+                "elapsed_s": round(elapsed, 4),
+                "sentences_per_sec": round(count / elapsed, 2) if elapsed else None,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "peak_rss_mb": round(peak_rss / 2**20, 2)}
+
+def percentile(values, p):
+    """ Nearest rank percentile of values, in milliseconds """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, int(math.ceil(p / 100.0 * len(ordered))) - 1)
+    return round(ordered[rank] * 1000, 3)
+
+def make_fake_moses(root):
+    """ Lays out a moses tree whose bin/moses is fake_moses.py """
+    utilities.make_dir(root + "/bin")
+    moses = root + "/bin/moses"
+    with open(moses, 'w') as f:
+        f.write("#!/bin/sh\nexec {} {} \"$@\"\n".format(sys.executable,
+            os.path.join(BENCH_DIR, "fake_moses.py")))
+    os.chmod(moses, 0o755)
+    return root + "/"
+
+def make_fake_working_dir(path):
+    """ Creates a working directory holding a placeholder tuned model """
+    utilities.make_dir(path + "/mert-work")
+    with open(path + "/mert-work/moses.ini", 'w') as f:
+        f.write("# placeholder model for fake_moses.py\n")
+    return path
+
+def make_sentences(filename, count, min_len, max_len, seed):
+    """ Writes count synthetic sentences with lengths in [min_len, max_len] """
+    rand = random.Random(seed)
+    vocab = ["w{}".format(i) for i in range(5000)]
+    with open(filename, 'w') as f:
+        for _ in range(count):
+            length = rand.randint(min_len, max_len)
+            f.write(' '.join(rand.choice(vocab) for _ in range(length)) + "\n")
+    return filename
+
+def compare(old_file, new_results):
+    """ Prints the change in each metric against an earlier run """
+    old = json.load(open(old_file, 'r'))["results"]
+    print("{:<8} {:<18} {:>12} {:>12} {:>9}".format("suite", "metric", "before", "after", "change"))
+    for suite, stats in new_results.items():
+        for metric, value in stats.items():
+            before = old.get(suite, {}).get(metric)
+            if before is None or value is None:
+                continue
+            change = "{:+.1f}%".format(100.0 * (value - before) / before) if before else "n/a"
+            print("{:<8} {:<18} {:>12} {:>12} {:>9}".format(suite, metric, before, value, change))
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--moses", help="path to a real moses install (default: fake)")
+    argparser.add_argument("--working-dirs", nargs="+", help="trained legs, in pivot order")
+    argparser.add_argument("--input", help="sentences to translate (default: synthetic)")
+    argparser.add_argument("--sentences", type=int, default=200)
+    argparser.add_argument("--min-len", type=int, default=5)
+    argparser.add_argument("--max-len", type=int, default=40)
+    argparser.add_argument("--token-delay", type=float, default=0.001)
+    argparser.add_argument("--load-delay", type=float, default=0.0)
+    argparser.add_argument("--model-mb", type=int, default=0)
+    argparser.add_argument("--concurrency", type=int, default=1)
+    argparser.add_argument("--suites", nargs="+", default=["batch", "server", "pivot", "document"])
+    argparser.add_argument("--output", help="where to save results as JSON")
+    argparser.add_argument("--compare", help="earlier results to compare against")
+    args = argparser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="moses-bench-")
+    if args.moses:
+        path_to_moses = args.moses if args.moses.endswith("/") else args.moses + "/"
+        assert args.working_dirs, "BenchmarkError: --working-dirs required with --moses"
+        working_dirs = [os.path.abspath(d) for d in args.working_dirs]
+    else:
+        os.environ["FAKE_MOSES_TOKEN_DELAY"] = str(args.token_delay)
+        os.environ["FAKE_MOSES_LOAD_DELAY"] = str(args.load_delay)
+        os.environ["FAKE_MOSES_MODEL_MB"] = str(args.model_mb)
+        path_to_moses = make_fake_moses(scratch + "/moses")
+        working_dirs = [make_fake_working_dir(scratch + "/src-piv.working"),
+                        make_fake_working_dir(scratch + "/piv-tar.working")]
+
+    src_file = os.path.abspath(args.input) if args.input else \
+        make_sentences(scratch + "/input.txt", args.sentences, args.min_len, args.max_len, 0)
+
+    bench = Benchmark(path_to_moses, working_dirs, src_file, args.concurrency, True)
+    runners = {"batch": bench.run_batch, "server": bench.run_server, "pivot": bench.run_pivot,
+               "document": bench.run_document}
+    results = {suite: runners[suite]() for suite in args.suites}
+
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "config": {"moses": args.moses or "fake", "working_dirs": working_dirs,
+                         "input": args.input or "synthetic", "sentences": len(bench.sentences),
+                         "token_delay": args.token_delay, "load_delay": args.load_delay,
+                         "model_mb": args.model_mb, "concurrency": args.concurrency},
+              "results": results}
+
+    output = args.output or os.path.join(BENCH_DIR, "results",
+        "benchmark-{}.json".format(time.strftime("%Y%m%d-%H%M%S")))
+    utilities.make_dir(os.path.dirname(output))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print("Saved results to {}".format(output))
+
+    if args.compare:
+        compare(args.compare, results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#python3.6
+
+"""
+Stand-in for the moses decoder binary used to benchmark this toolkit
+without a Moses install or trained models.
+
+Understands the moses flags used by Test and Server. In batch mode it reads
+sentences from stdin and writes one translation per line to stdout. With
+--server it serves the XML-RPC translate method on --server-port. A
+translation is the lowercased input, returned after a delay proportional
+to the number of tokens. Behaviour is adjusted with environment variables:
+    FAKE_MOSES_TOKEN_DELAY  seconds spent per input token (default 0.001)
+    FAKE_MOSES_LOAD_DELAY   seconds spent "loading models" (default 0)
+    FAKE_MOSES_MODEL_MB     megabytes allocated to mimic a loaded model
+Files named by path= in the -f config are loaded the way moses would:
+.minphr, .minlexr and binary KenLM files are memory mapped (unless
+-minlexr-memory copies the reordering table), anything else is read onto
+the heap.
+"""
+import os
+import re
+import sys
+import glob
+import mmap
+import time
+import socketserver
+from xmlrpc.server import SimpleXMLRPCServer
+
+TOKEN_DELAY = float(os.environ.get("FAKE_MOSES_TOKEN_DELAY", 0.001))
+LOAD_DELAY = float(os.environ.get("FAKE_MOSES_LOAD_DELAY", 0))
+MODEL_MB = int(os.environ.get("FAKE_MOSES_MODEL_MB", 0))
+
+class ThreadedXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+def parse_args(argv):
+    """ Picks out the moses flags we care about, ignoring everything else """
+    args = {"server": False, "port": 8080, "config": None, "verbosity": 1,
+            "minlexr_memory": False}
+    i = 0
+    while i < len(argv):
+        flag = argv[i]
+        if flag == "--server":
+            args["server"] = True
+        elif flag == "--server-port":
+            args["port"] = int(argv[i+1])
+            i += 1
+        elif flag in ("-f", "-config"):
+            args["config"] = argv[i+1]
+            i += 1
+        elif flag == "-minlexr-memory":
+            args["minlexr_memory"] = True
+        elif flag in ("-v", "-verbose"):
+            args["verbosity"] = int(argv[i+1])
+            i += 1
+        elif flag in ("--server-maxconn-backlog", "-threads", "-s", "-stack",
+            "-cube-pruning-pop-limit", "-distortion-limit", "-dl", "-time-out"):
+            i += 1
+        i += 1
+    return args
+
+def translate_text(text):
+    """ Sleeps for the configured per-token delay and echoes the text """
+    tokens = text.lower().split()
+    time.sleep(TOKEN_DELAY * len(tokens))
+    return ' '.join(tokens)
+
+def load_models(config=None, minlexr_memory=False):
+    """ Mimics the time and memory spent loading the models """
+    time.sleep(LOAD_DELAY)
+    models = [bytearray(MODEL_MB * 1024 * 1024)]
+    if config is None or not os.path.isfile(config):
+        return models
+    for path in re.findall(r"path=(\S+)", open(config).read()):
+        for f in sorted(glob.glob(glob.escape(path) + "*")):
+            if not os.path.isfile(f) or os.path.getsize(f) == 0:
+                continue
+            with open(f, 'rb') as stream:
+                mapped = f.endswith(".minphr") or stream.read(8) == b"mmap lm " or \
+                    (f.endswith(".minlexr") and not minlexr_memory)
+                stream.seek(0)
+                if mapped:
+                    table = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+                    sum(table[i] for i in range(0, len(table), mmap.PAGESIZE))
+                else:
+                    table = bytearray(stream.read())
+            models.append(table)
+    return models
+
+def run_batch(verbosity):
+    """ Translates stdin line by line, reporting timings like moses does """
+    for i, line in enumerate(sys.stdin):
+        start = time.time()
+        sys.stdout.write(translate_text(line) + "\n")
+        sys.stdout.flush()
+        if verbosity > 0:
+            sys.stderr.write("Line {}: Translation took {:.3f} seconds total\n".format(
+                i, time.time() - start))
+
+def run_server(port, verbosity):
+    """ Serves translate over XML-RPC until killed """
+    def translate(params):
+        return {"text": translate_text(params["text"])}
+
+    server = ThreadedXMLRPCServer(("localhost", port), logRequests=False, allow_none=True)
+    server.register_introspection_functions()
+    server.register_multicall_functions()
+    server.register_function(translate, "translate")
+    if verbosity > 0:
+        sys.stderr.write("Listening on port {}\n".format(port))
+        sys.stderr.flush()
+    server.serve_forever()
+
+def main():
+    args = parse_args(sys.argv[1:])
+    model = load_models(args["config"], args["minlexr_memory"])
+    if args["server"]:
+        run_server(args["port"], args["verbosity"])
+    else:
+        run_batch(args["verbosity"])
+
+if __name__ == '__main__':
+    main()
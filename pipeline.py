@@ -8,6 +8,8 @@ from Parser import Parser
 from Train import Train
 from Tune import Tune
 from Test import Test
+from PairFilter import rules_from_config
+from PivotPlan import plan_from_config
 
 from FileDataPair import FileDataPair
 
@@ -29,6 +31,13 @@ def smtp_pipeline(config):
     ngram = config.getint("Environment Settings", "ngram")
     work_dir1 = utilities.safe_string(config.get("Iteration Settings", "working_dir_first_leg"))
     work_dir2 = utilities.safe_string(config.get("Iteration Settings", "working_dir_second_leg"))
+    sampling = config.getboolean("Iteration Settings", "sampling_phrase_tables", fallback=False)
+    encoded = config.getboolean("Iteration Settings", "encoded_corpus", fallback=False)
+    dedup = config.getboolean("Iteration Settings", "dedup_pairs", fallback=False)
+    external = config.getboolean("Iteration Settings", "external_matching", fallback=False)
+    match_full = config.getboolean("Iteration Settings", "match_full_corpora", fallback=False)
+    max_tune = config.getint("Iteration Settings", "max_tune_sentences", fallback=0)
+    tune_strata = config.getint("Iteration Settings", "tune_length_strata", fallback=10)
 
     pair1, pair2 = FileDataPair(srcf, piv1f), FileDataPair(piv2f, tarf)
     raw_files = pair1.get_raw_filenames() + pair2.get_raw_filenames()
@@ -37,13 +46,19 @@ def smtp_pipeline(config):
     pair1_cleansed_src, pair1_cleansed_tar = pair1.get_cleansed_filenames()
     pair2_cleansed_src, pair2_cleansed_tar = pair2.get_cleansed_filenames()
 
-    parser = Parser(path_to_moses, mem_limit, max_len, min_len, False)
+    rules = rules_from_config(config, min_len, max_len)
+    parser = Parser(path_to_moses, mem_limit, max_len, min_len, False, encoded, dedup, rules,
+        external, max_tune, tune_strata)
     parser.tokenize_files(raw_files)
     parser.cleanse(pair1_tokenized_src, pair1_tokenized_tar)
     parser.cleanse(pair2_tokenized_src, pair2_tokenized_tar)
     parser.split_train_tune_test(pair1_cleansed_src, pair1_cleansed_tar, \
         pair2_cleansed_src, pair2_cleansed_tar, train, test)
-    parser.match(pair1_test_src, pair2_test_tar, pair2_test_src, pair2_test_tar)
+    pair1_test_src, pair1_test_tar = pair1.get_test_filenames()
+    pair2_test_src, pair2_test_tar = pair2.get_test_filenames()
+    parser.match(pair1_test_src, pair1_test_tar, pair2_test_src, pair2_test_tar)
+    if match_full:
+        parser.match(pair1_cleansed_src, pair1_cleansed_tar, pair2_cleansed_src, pair2_cleansed_tar)
 
     pair1_target_train_filename = pair1.get_target_train_filename()
     pair2_target_train_filename = pair2.get_target_train_filename()
@@ -53,8 +68,8 @@ def smtp_pipeline(config):
     trainer = Train(path_to_moses, ncpus, ngram, False)
     trainer.build_language_models(pair1_target_train_filename)
     trainer.build_language_models(pair2_target_train_filename)
-    trainer.train(pair1_train_src, pair1_train_tar, work_dir1)
-    trainer.train(pair2_train_src, pair2_train_tar, work_dir2)
+    trainer.train(pair1_train_src, pair1_train_tar, work_dir1, sampling)
+    trainer.train(pair2_train_src, pair2_train_tar, work_dir2, sampling)
 
     pair1_tune_src, pair1_tune_tar = pair1.get_tune_filenames()
     pair2_tune_src, pair2_tune_tar = pair2.get_tune_filenames()
@@ -68,18 +83,76 @@ def smtp_pipeline(config):
     pair1_test_tar = pair1.get_eval_filename()
     pair2_test_tar = pair2.get_eval_filename()
 
-    test = Test(path_to_moses, False)
+    test = Test(path_to_moses, False, ncpus=ncpus)
     test.test_pivoting_quality(pair1_test_tar, work_dir1,
         pair2_test_tar, work_dir2)
 
+def multi_pair_pipeline(config, plan):
+    """
+    Runs the pipeline for every pair in plan, tokenizing, cleansing and
+    splitting each corpus, building each language model and training and
+    tuning each leg once however many pairs share them. Each pair is then
+    matched and scored on its own
+    """
+    path_to_moses = config.get("Environment Settings", "path_to_moses_decoder")
+    mem_limit = config.getint("Environment Settings", "mem_limit")
+    max_len = config.getint("Iteration Settings", "max_sentence_len")
+    min_len = config.getint("Iteration Settings", "min_sentence_len")
+    train = config.getfloat("Iteration Settings", "train_split")
+    test = config.getfloat("Iteration Settings", "test_split")
+    ncpus = config.getint("Environment Settings", "ncpus")
+    ngram = config.getint("Environment Settings", "ngram")
+    sampling = config.getboolean("Iteration Settings", "sampling_phrase_tables", fallback=False)
+    encoded = config.getboolean("Iteration Settings", "encoded_corpus", fallback=False)
+    dedup = config.getboolean("Iteration Settings", "dedup_pairs", fallback=False)
+    external = config.getboolean("Iteration Settings", "external_matching", fallback=False)
+    match_full = config.getboolean("Iteration Settings", "match_full_corpora", fallback=False)
+    max_tune = config.getint("Iteration Settings", "max_tune_sentences", fallback=0)
+    tune_strata = config.getint("Iteration Settings", "tune_length_strata", fallback=10)
+
+    utilities.flush_print(plan.report())
+
+    rules = rules_from_config(config, min_len, max_len)
+    parser = Parser(path_to_moses, mem_limit, max_len, min_len, False, encoded, dedup, rules,
+        external, max_tune, tune_strata)
+    parser.tokenize_files(plan.get_raw_filenames())
+    for corpus in plan.corpora.values():
+        parser.cleanse(*corpus.files.get_tokenized_filenames())
+        parser.split_pair_train_tune_test(*corpus.files.get_cleansed_filenames(), train, test)
+
+    trainer = Train(path_to_moses, ncpus, ngram, False)
+    for datafile in plan.get_language_models():
+        trainer.build_language_models(datafile)
+    for leg in plan.legs.values():
+        trainer.train(*leg.get_train_filenames(), leg.working_dir, sampling)
+
+    tuner = Tune(path_to_moses, ncpus, False)
+    for leg in plan.legs.values():
+        tuner.tune(*leg.get_tune_filenames(), leg.working_dir)
+
+    tester = Test(path_to_moses, False, ncpus=ncpus)
+    for chain in plan.chains:
+        parser.match(*chain.get_test_filenames(), chain.matched_dir)
+        if match_full:
+            parser.match(*chain.get_cleansed_filenames(), chain.matched_dir)
+        src_eval, tar_eval = chain.get_eval_filenames()
+        tester.test_pivoting_quality(src_eval, chain.first.working_dir,
+            tar_eval, chain.second.working_dir, chain.name)
+
 def main():
     # Supply your own source file, pivot one file, pivot two file, and target
     # file and the directory names in which to save the training in config.ini.
     # Modify train and test percentage (1 - train - test = tune percentage)
     # The filenames need to have same beginnings, up until a ".", after which
     # they may be different
+    # To run several pairs through the pivot language instead, list them in
+    # [Multi Pair Settings] with the corpus of each language
     config = utilities.config_file_reader()
-    smtp_pipeline(config)
+    plan = plan_from_config(config)
+    if plan is None:
+        smtp_pipeline(config)
+    else:
+        multi_pair_pipeline(config, plan)
 
 if __name__ == '__main__':
     main()
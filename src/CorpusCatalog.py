@@ -0,0 +1,242 @@
+"""
+Catalog of the corpus files under the data directory. Each file the
+pipeline writes is recorded once, as it is written, with its lineage,
+line count, size, checksum and an index of where each line starts, so
+later stages never have to scan a file to learn these things again
+"""
+import os
+import json
+import hashlib
+from array import array
+
+import numpy
+
+import utilities
+
+RAW, TOK, CLEANSED, SUBSET, TRAIN, TUNE, TEST, MATCHED = \
+    "raw", "tok", "cleansed", "subset", "train", "tune", "test", "matched"
+
+# Directory under the data directory each stage writes to
+STAGE_DIRS = {TOK: "", CLEANSED: "", TRAIN: "train/", TUNE: "tune/", TEST: "test/"}
+
+CATALOG_FILE = "catalog.json"
+INDEX_DIR = "catalog/"
+
+# Line offsets are collected this many at a time before going to disk
+OFFSET_BLOCK = 1 << 16
+
+class CorpusCatalog(object):
+    """
+    Entries are kept in catalog.json under home, keyed on file path. The
+    line offsets of each file are kept beside it, in the catalog/
+    directory, as a numpy array. An entry only counts while the size and
+    modification time of its file are unchanged, so a file rewritten
+    outside the pipeline is scanned again rather than trusted. catalog.json
+    is read again whenever another catalog on the same home has changed it
+    """
+    def __init__(self, home="data/"):
+        self.home = home
+        self.path = os.path.join(home, CATALOG_FILE)
+        self.entries = {}
+        self.loaded = None
+        self._load()
+
+    def _load(self):
+        if not utilities.file_exists(self.path):
+            return
+        mtime = os.stat(self.path).st_mtime
+        if mtime != self.loaded:
+            self.entries, self.loaded = json.load(open(self.path, 'r')), mtime
+
+    def derived_path(self, parent, stage, subdir=""):
+        """
+        The file stage writes from parent: matched files sit beside their
+        parent, every other stage writes into its directory under home.
+        subdir is where a subset is placed, or the directory beside its
+        parent a matched file is placed in
+        """
+        name = utilities.strip_filename_from_path(parent) + "." + stage
+        if stage == MATCHED:
+            if subdir:
+                return os.path.join(os.path.dirname(parent), subdir) + name
+            return parent + "." + stage
+        if stage == SUBSET:
+            return self.home + subdir + name
+        return self.home + STAGE_DIRS[stage] + name
+
+    def writer(self, path, stage, parent=None):
+        """ Opens path for writing, recording its entry when closed """
+        return CorpusWriter(self, path, stage, parent)
+
+    def record(self, path, stage=RAW, parent=None):
+        """
+        Scans a file written outside the catalog, such as tokenizer
+        output or a raw corpus, and records its entry
+        """
+        digest, offsets, position = hashlib.sha1(), OffsetIndex(self._index_path(path)), 0
+        with open(path, 'rb') as stream:
+            for line in stream:
+                offsets.append(position)
+                position += len(line)
+                digest.update(line)
+        return self._add(path, stage, parent, position, digest.hexdigest(), offsets.close())
+
+    def _add(self, path, stage, parent, size, checksum, lines):
+        stat = os.stat(path)
+        self._load()
+        self.entries[path] = {"stage": stage, "parent": parent, "lines": lines,
+                              "bytes": size, "sha1": checksum, "mtime": stat.st_mtime}
+        self._save()
+        return self.entries[path]
+
+    def _save(self):
+        utilities.make_dir(self.home)
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as stream:
+            json.dump(self.entries, stream, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.loaded = os.stat(self.path).st_mtime
+
+    def _index_path(self, path):
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(self.home))
+        if relative.startswith(os.pardir):
+            relative = "external/" + hashlib.sha1(str.encode(os.path.abspath(path))).hexdigest()[:16] + \
+                "." + utilities.strip_filename_from_path(path)
+        return os.path.join(self.home, INDEX_DIR, relative + ".offsets.npy")
+
+    def entry(self, path):
+        """ The entry of path, or None if it is not catalogued or has changed since """
+        self._load()
+        entry = self.entries.get(path)
+        if entry is None or not utilities.file_exists(path) or \
+            not utilities.file_exists(self._index_path(path)):
+            return None
+        stat = os.stat(path)
+        if stat.st_size != entry["bytes"] or stat.st_mtime != entry["mtime"]:
+            return None
+        return entry
+
+    def has(self, path):
+        return self.entry(path) is not None
+
+    def has_all(self, paths):
+        return all(self.has(path) for path in paths)
+
+    def _current(self, path):
+        """ The entry of path, scanning it first if it is not catalogued """
+        entry = self.entry(path)
+        if entry is None:
+            known = self.entries.get(path, {})
+            entry = self.record(path, known.get("stage", RAW), known.get("parent"))
+        return entry
+
+    def lines(self, path):
+        return self._current(path)["lines"]
+
+    def checksum(self, path):
+        return self._current(path)["sha1"]
+
+    def offsets(self, path):
+        """ Byte offset at which each line of path starts, memory mapped """
+        self._current(path)
+        return numpy.load(self._index_path(path), mmap_mode='r')
+
+    def read_lines(self, path, indices):
+        """ Yields the lines of path at indices, in the order given, without their newline """
+        offsets = self.offsets(path)
+        with open(path, 'rb') as stream:
+            for i in indices:
+                stream.seek(int(offsets[i]))
+                yield stream.readline().decode().rstrip("\n")
+
+    def lineage(self, path):
+        """ The files path was derived from, from the raw corpus down to path """
+        self._load()
+        chain = [path]
+        while self.entries.get(chain[0], {}).get("parent"):
+            chain.insert(0, self.entries[chain[0]]["parent"])
+        return chain
+
+class CorpusWriter(object):
+    """
+    Writes a corpus file a line at a time, counting, hashing and indexing
+    the lines on the way, and records the file in the catalog when
+    closed. A file abandoned by an exception is never recorded
+    """
+    def __init__(self, catalog, path, stage, parent=None):
+        self.catalog = catalog
+        self.path = path
+        self.stage = stage
+        self.parent = parent
+        utilities.make_dir(os.path.dirname(path) or ".")
+        self.stream = open(path, 'wb')
+        self.digest = hashlib.sha1()
+        self.offsets = OffsetIndex(catalog._index_path(path))
+        self.position = 0
+
+    def write(self, line):
+        data = str.encode(line + "\n")
+        self.offsets.append(self.position)
+        self.position += len(data)
+        self.digest.update(data)
+        self.stream.write(data)
+
+    def close(self):
+        self.stream.close()
+        return self.catalog._add(self.path, self.stage, self.parent, self.position,
+                                 self.digest.hexdigest(), self.offsets.close())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+        else:
+            self.stream.close()
+            self.offsets.discard()
+
+class OffsetIndex(object):
+    """
+    Builds the .npy line offset index of a file in constant memory. Offsets
+    are spilled a block at a time to a raw file, copied into the index
+    when it is closed
+    """
+    def __init__(self, path):
+        self.path = path
+        utilities.make_dir(os.path.dirname(path))
+        self.raw = open(path + ".tmp", 'wb')
+        self.block = array('Q')
+        self.count = 0
+
+    def append(self, offset):
+        self.block.append(offset)
+        if len(self.block) == OFFSET_BLOCK:
+            self._flush()
+
+    def _flush(self):
+        self.block.tofile(self.raw)
+        self.count += len(self.block)
+        self.block = array('Q')
+
+    def close(self):
+        """ Writes the index, returning the number of lines """
+        self._flush()
+        self.raw.close()
+        if not self.count:
+            numpy.save(self.path, numpy.zeros(0, dtype=numpy.uint64))
+        else:
+            index = numpy.lib.format.open_memmap(self.path, mode='w+', dtype=numpy.uint64,
+                                                  shape=(self.count,))
+            with open(self.raw.name, 'rb') as raw:
+                for start in range(0, self.count, OFFSET_BLOCK):
+                    block = numpy.frombuffer(raw.read(OFFSET_BLOCK * 8), dtype=numpy.uint64)
+                    index[start:start + len(block)] = block
+            index.flush()
+            del index
+        os.remove(self.raw.name)
+        return self.count
+
+    def discard(self):
+        self.raw.close()
+        os.remove(self.raw.name)
@@ -0,0 +1,160 @@
+"""
+Manages a single moses server process
+"""
+import time
+import socket
+import threading
+import subprocess
+import xmlrpc.client
+
+import psutil
+
+import utilities
+
+class TimeoutTransport(xmlrpc.client.Transport):
+    """ XML-RPC transport whose connections give up after timeout seconds """
+    def __init__(self, timeout):
+        xmlrpc.client.Transport.__init__(self)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = xmlrpc.client.Transport.make_connection(self, host)
+        connection.timeout = self.timeout
+        return connection
+
+class Decoder(object):
+    """
+    With tables_in_memory moses copies compact reordering tables onto its
+    heap for speed; without it they stay memory mapped and shared
+    """
+    def __init__(self, path_to_moses, moses_ini, logfile, flags="", tables_in_memory=True,
+        verbose=False):
+        assert utilities.file_exists(moses_ini), "DecoderError: {} not found".format(moses_ini)
+        self.path_to_moses = path_to_moses
+        self.moses_ini = moses_ini
+        self.logfile = logfile
+        self.flags = flags
+        self.tables_in_memory = tables_in_memory
+        self.verbose = verbose
+
+        self.process = None
+        self.port = None
+        self.restarts = 0
+        self.ready = threading.Event()
+        self.local = threading.local()
+
+    def _print(self, item):
+        if self.verbose:
+            utilities.flush_print(item)
+
+    def start(self, timeout=600, attempts=3):
+        """
+        Launches moses on a free port and blocks until it answers an
+        XML-RPC health check. Relaunches on a new port if the process dies
+        before becoming ready, for instance because the port was taken
+        """
+        for attempt in range(attempts):
+            self._launch()
+            if self.wait_ready(timeout):
+                return
+            self._kill()
+        raise RuntimeError("DecoderError: moses failed to start for {}, see {}".format(
+            self.moses_ini, self.logfile))
+
+    def _launch(self):
+        """
+        Starts the moses server process. The port stays bound until just
+        before moses is launched to narrow the window in which another
+        process could take it
+        """
+        self.ready.clear()
+        sock, self.port = self._reserve_port()
+        command = self.path_to_moses + "bin/moses" + \
+            (" -minlexr-memory" if self.tables_in_memory else "") + \
+            " --server --server-port {}".format(self.port) + \
+            " --server-maxconn-backlog 5" + \
+            " -v 0 -f {}".format(self.moses_ini) + \
+            (" " + self.flags if self.flags else "")
+
+        with open(self.logfile, 'a') as err:
+            sock.close()
+            self.process = subprocess.Popen(command.split(), shell=False, stderr=err)
+        self.local = threading.local()
+
+    def _reserve_port(self):
+        """ Binds an ephemeral port and returns the socket and port number """
+        sock = socket.socket()
+        sock.bind(('', 0))
+        return sock, sock.getsockname()[1]
+
+    def wait_ready(self, timeout=600, interval=0.1):
+        """
+        Polls the health check until it passes, the process exits or
+        timeout seconds go by. Returns whether the server became ready
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if not self.is_alive():
+                return False
+            if self.healthy():
+                self.ready.set()
+                return True
+            time.sleep(interval)
+        return False
+
+    def healthy(self, timeout=5):
+        """ True if moses answers an XML-RPC introspection call """
+        proxy = xmlrpc.client.ServerProxy(self.url(), transport=TimeoutTransport(timeout))
+        try:
+            proxy.system.listMethods()
+            return True
+        except (OSError, xmlrpc.client.Error):
+            return False
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def restart(self, timeout=600):
+        """ Kills the current process, if any, and starts a fresh one """
+        self._print("Restarting decoder for {}... ".format(self.moses_ini))
+        self._kill()
+        self.restarts += 1
+        self.start(timeout)
+        self._print("Ready\n")
+
+    def stop(self):
+        self.ready.clear()
+        self._kill()
+
+    def _kill(self):
+        """ Uses the psutil library to shut the translation service down """
+        if self.is_alive():
+            try:
+                psutil.Process(self.process.pid).kill()
+            except psutil.NoSuchProcess:
+                pass
+            self.process.wait()
+
+    def url(self):
+        return "http://localhost:{}/RPC2".format(self.port)
+
+    def proxy(self):
+        """ Returns a server proxy private to the calling thread """
+        if getattr(self.local, "proxy", None) is None:
+            self.local.proxy = xmlrpc.client.ServerProxy(self.url())
+        return self.local.proxy
+
+    def translate(self, text, timeout=600):
+        """
+        Sends the text we want to translate to the moses server, waiting
+        for it to become ready if it is (re)starting
+        """
+        if not self.ready.wait(timeout):
+            raise ConnectionRefusedError("Decoder for {} is not ready".format(self.moses_ini))
+        return self.proxy().translate({"text": text})["text"]
+
+    def status(self):
+        return {"moses_ini": self.moses_ini, "port": self.port,
+                "pid": self.process.pid if self.process else None,
+                "alive": self.is_alive(), "ready": self.ready.is_set(),
+                "restarts": self.restarts}
@@ -0,0 +1,590 @@
+"""
+Long running daemon keeping warm moses servers for each translation leg.
+
+Each leg is served by a ReplicaPool of decoders, grown and shrunk with the
+load. Decoders are started once, health checked before they are marked
+ready and restarted if they crash or stop answering. When a leg is
+retrained or retuned its new model is loaded into fresh replicas in the
+background and traffic moves over once they are healthy. In shared model
+mode the replicas of a leg map one copy of its binarized tables.
+Requests carry deadlines, and a leg refuses new work while its replicas
+hold more than max_queue_per_replica requests each. A leg can be served
+under several decoding profiles, such as fast and accurate, each with its
+own pool of decoders started with the profile's search settings, and
+each request names the profile it wants. Whole files can be
+queued as bulk jobs, which run chunk by chunk behind interactive traffic. Concurrent requests
+to a replica are grouped into micro-batches by a RequestBatcher. Clients
+reach the daemon through its TranslationService, an HTTP/JSON front end,
+so models are not reloaded for every session. The daemon advertises the
+service's port in daemon.json in the directory it was started from.
+"""
+import os
+import json
+import time
+import signal
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import psutil
+
+import utilities
+from Metrics import Registry
+from JobQueue import JobQueue
+from ModelMemory import ModelMemory, memory_report
+from ReplicaPool import ReplicaPool, PoolRetired, Overloaded, DeadlineExceeded
+from RequestBatcher import INTERACTIVE
+from TranslationCache import TranslationCache
+from PivotPipeline import PivotPipeline
+from TranslationService import TranslationService, DAEMON_STATE
+
+DEFAULT_PROFILE = "balanced"
+
+# Moses flags of the built in decoding profiles. balanced leaves the search
+# settings of each leg's moses.ini alone
+PROFILES = {"fast": "-search-algorithm 1 -cube-pruning-pop-limit 200 -s 50",
+            DEFAULT_PROFILE: "",
+            "accurate": "-s 1000"}
+
+class DecoderDaemon(object):
+    def __init__(self, path_to_moses, working_dirs, port=0, check_interval=5,
+        max_failed_checks=3, max_batch=32, max_batch_delay=0.005, pivot_queue_size=8,
+        ncpus=1, min_replicas=1, max_replicas=0, scale_up_latency=2.0,
+        scale_up_queue_depth=4, scale_down_after=60, cache_size=10000,
+        document_parallelism=64, decoder_threads=8, watch_models=True,
+        shared_models=False, prewarm_models=False, request_timeout=30,
+        max_queue_per_replica=64, max_decode_time=0, bulk_chunk_size=32, profiles=None,
+        default_profile=DEFAULT_PROFILE, state_file=DAEMON_STATE, logname="daemon.out", verbose=False):
+        self.path_to_moses = path_to_moses
+        self.working_dirs = [os.path.abspath(d) for d in working_dirs]
+        self.port = port
+        self.check_interval = check_interval
+        self.max_failed_checks = max_failed_checks
+        self.max_batch = max_batch
+        self.max_batch_delay = max_batch_delay
+        self.pivot_queue_size = pivot_queue_size
+        self.ncpus = ncpus
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+        self.scale_up_latency = scale_up_latency
+        self.scale_up_queue_depth = scale_up_queue_depth
+        self.scale_down_after = scale_down_after
+        self.document_parallelism = document_parallelism
+        self.decoder_threads = decoder_threads
+        self.watch_models = watch_models
+        self.shared_models = shared_models
+        self.prewarm_models = prewarm_models
+        self.request_timeout = request_timeout
+        self.max_queue_per_replica = max_queue_per_replica
+        self.max_decode_time = max_decode_time
+        self.bulk_chunk_size = bulk_chunk_size
+        self.profiles = profiles or {default_profile: PROFILES.get(default_profile, "")}
+        self.default_profile = default_profile
+        assert default_profile in self.profiles, \
+            "DecoderDaemonError: default profile {} not served".format(default_profile)
+        self.state_file = state_file
+        self.logname = logname
+        self.verbose = verbose
+
+        self.pools = {}
+        self.cache = TranslationCache(cache_size)
+        self.processes = {}
+        self.failed_versions = {}
+        self.jobs = None
+        self.interactive = 0
+        self.interactive_lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.service = None
+        self.thread = None
+        self._build_metrics()
+
+    def _print(self, item):
+        if self.verbose:
+            utilities.flush_print(item)
+
+    def start(self):
+        """
+        Warms up a pool of decoders for every leg and profile and starts
+        watching them
+        """
+        for working_dir in self.working_dirs:
+            assert utilities.dir_exists(working_dir), "DecoderDaemonError: {} not found".format(working_dir)
+            for profile in self.profiles:
+                self._print("Loading {} decoders at {}... ".format(profile, working_dir))
+                pool = self._start_pool(working_dir, profile)
+                self.pools[(working_dir, profile)] = pool
+                self._print("Ready ({} of at most {} replicas)\n".format(
+                    len(pool.replicas), pool.max_replicas))
+
+        self.jobs = JobQueue(self, self.bulk_chunk_size, verbose=self.verbose)
+        threading.Thread(target=self._monitor, daemon=True).start()
+
+    def _start_pool(self, working_dir, profile):
+        """
+        Starts a pool of replicas serving the current model of working_dir
+        with the search settings of profile. Shared models must be fully
+        memory mappable, and are optionally read into the page cache first
+        """
+        moses_ini = working_dir + "/mert-work/moses.ini"
+        if self.shared_models:
+            model = ModelMemory(moses_ini)
+            model.check()
+            if self.prewarm_models:
+                self._print("pre-warming {} MB... ".format(model.prewarm() // 2**20))
+        logname = self.logname if profile == self.default_profile else profile + "." + self.logname
+        pool = ReplicaPool(self.path_to_moses, moses_ini,
+            working_dir + "/" + logname, self.ncpus, self.min_replicas,
+            self.max_replicas, self.max_batch, self.max_batch_delay,
+            self.scale_up_latency, self.scale_up_queue_depth,
+            self.scale_down_after, self.decoder_threads, self.shared_models,
+            self.max_decode_time, self.profiles[profile], verbose=self.verbose)
+        try:
+            pool.start()
+        except Exception:
+            pool.stop()
+            raise
+        return pool
+
+    def reload(self, working_dir=None, force=True):
+        """
+        Loads the current model of working_dir, or of every leg, into new
+        replicas while the old ones keep serving. Once the new replicas
+        are healthy traffic is switched over, the old replicas drain and
+        cached translations of the old model are dropped. Without force a
+        leg is only reloaded if its model changed. Returns the model
+        version serving each leg
+        """
+        working_dirs = [self._pool_key(working_dir)[0]] if working_dir else self.legs()
+        versions = {}
+        with self.reload_lock:
+            for working_dir in working_dirs:
+                for profile in self.profiles:
+                    old = self.pools[(working_dir, profile)]
+                    if force or utilities.model_fingerprint(old.moses_ini) != old.version:
+                        self._print("Reloading {} decoders at {}... ".format(profile, working_dir))
+                        new = self._start_pool(working_dir, profile)
+                        self.pools[(working_dir, profile)] = new
+                        old.retire()
+                        leg = self._leg_name(working_dir)
+                        self.cache.clear((leg, profile), keep_version=new.version)
+                        self.reloads.inc(leg=leg, profile=profile)
+                        self._print("Ready\n")
+                versions[working_dir] = self.pools[(working_dir, self.default_profile)].version
+        return versions
+
+    def reload_in_background(self, working_dir=None, force=True):
+        """ Reloads from a separate thread, logging rather than raising failures """
+        def run():
+            try:
+                self.reload(working_dir, force)
+            except Exception as e:
+                self._print("Reload of {} failed: {}\n".format(working_dir or "all legs", e))
+        threading.Thread(target=run, daemon=True).start()
+
+    def serve_forever(self):
+        """ Serves the HTTP/JSON front end until shutdown is called """
+        self.service = TranslationService(self, port=self.port,
+            document_parallelism=self.document_parallelism,
+            request_timeout=self.request_timeout, verbose=self.verbose)
+        try:
+            self.service.serve_forever(on_ready=self._write_state)
+        finally:
+            self._stop_decoders()
+
+    def serve_in_background(self, timeout=None):
+        """ Serves from a separate thread, returning once the front end is up """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        while self.service is None and not self.stopping.is_set():
+            self.stopping.wait(0.01)
+        return self.service is not None and self.service.ready.wait(timeout)
+
+    def submit(self, working_dir, text, priority=INTERACTIVE, profile=None):
+        """
+        Queues text for the leg trained in working_dir, returning a Future.
+        profile names the decoding profile, by default default_profile.
+        Translations seen recently are answered from the cache
+        """
+        kind = "interactive" if priority == INTERACTIVE else "bulk"
+        working_dir, profile = self._pool_key(working_dir, profile)
+        leg = self._leg_name(working_dir)
+        self.requests.inc(leg=leg, profile=profile)
+        start = time.time()
+        while True:
+            pool = self.pools[(working_dir, profile)]
+            translation = self.cache.get((leg, profile), pool.version, text)
+            if translation is not None:
+                self.cache_hits.inc(leg=leg)
+                self.latency.observe(time.time() - start, leg=leg, profile=profile, kind=kind)
+                future = Future()
+                future.set_result(translation)
+                return future
+            try:
+                future = pool.submit(text, priority)
+                break
+            except PoolRetired:
+                continue
+
+        self.cache_misses.inc(leg=leg)
+        if priority == INTERACTIVE:
+            with self.interactive_lock:
+                self.interactive += 1
+        version = pool.version
+        future.add_done_callback(lambda f: self._finished(leg, profile, version, text, start, kind, f))
+        return future
+
+    def interactive_in_flight(self):
+        """ Interactive requests sent to the decoders and not yet answered """
+        return self.interactive
+
+    def translate(self, working_dir, text, deadline=None, profile=None):
+        """
+        Translates text with the leg trained in working_dir. Raises
+        DeadlineExceeded, dropping the request if it is still queued, when
+        the time.time() deadline passes first
+        """
+        future = self.submit(working_dir, text, profile=profile)
+        try:
+            return future.result(self.remaining(working_dir, deadline))
+        except FutureTimeout:
+            future.cancel()
+            self.expired(working_dir)
+            raise DeadlineExceeded("deadline passed translating with {}".format(working_dir))
+
+    def pivot(self, working_dirs, text, deadline=None, profile=None):
+        """
+        Translates text through each leg in working_dirs in turn. A leg is
+        not started once the deadline has passed
+        """
+        for working_dir in working_dirs:
+            text = self.translate(working_dir, text, deadline, profile)
+        return text
+
+    def pivot_document(self, working_dirs, sentences, deadline=None, profile=None):
+        """
+        Translates many sentences through the legs in working_dirs with the
+        legs pipelined, returning the translations in input order
+        """
+        stages = [lambda text, d=d: self.translate(d, text, deadline, profile) for d in working_dirs]
+        return list(PivotPipeline(stages, self.pivot_queue_size).run(sentences))
+
+    def remaining(self, working_dir, deadline):
+        """
+        Seconds left before deadline, None without one. Raises
+        DeadlineExceeded once it has passed, so no further leg is started
+        """
+        if deadline is None:
+            return None
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            self.expired(working_dir)
+            raise DeadlineExceeded("deadline passed before translating with {}".format(working_dir))
+        return remaining
+
+    def expired(self, working_dir):
+        """ Counts a request given up on because its deadline passed """
+        self.timeouts.inc(leg=self._leg_name(working_dir))
+
+    def admit(self, working_dirs, profile=None):
+        """
+        Raises Overloaded if any leg in working_dirs is queueing too much
+        under profile
+        """
+        for working_dir in working_dirs:
+            try:
+                self._pool(working_dir, profile).admit(self.max_queue_per_replica)
+            except Overloaded:
+                self.rejected.inc(leg=self._leg_name(working_dir))
+                raise
+
+    def legs(self):
+        return list(self.working_dirs)
+
+    def profile_names(self):
+        return list(self.profiles)
+
+    def _by_leg(self, value):
+        """ value(pool) for every pool, as {working_dir: {profile: value}} """
+        report = {}
+        for (working_dir, profile), pool in self.pools.items():
+            report.setdefault(working_dir, {})[profile] = value(pool)
+        return report
+
+    def status(self):
+        return self._by_leg(lambda pool: pool.status())
+
+    def batch_stats(self):
+        """ Reports the batch size distribution of each leg under each profile """
+        return self._by_leg(lambda pool: pool.batch_stats())
+
+    def memory(self):
+        """
+        Reports for each leg the size of its model files and the shared
+        and private resident memory of each replica
+        """
+        report = {}
+        for working_dir in self.working_dirs:
+            replicas = []
+            for profile in self.profiles:
+                for pid in self.pools[(working_dir, profile)].pids():
+                    try:
+                        replicas.append(dict(memory_report(pid), profile=profile))
+                    except psutil.Error:
+                        continue
+            report[working_dir] = {"shared_models": self.shared_models,
+                "model_bytes": ModelMemory(working_dir + "/mert-work/moses.ini").footprint(),
+                "replicas": replicas,
+                "total_rss": sum(r["rss"] for r in replicas),
+                "total_private": sum(r["private"] for r in replicas)}
+        return report
+
+    def metrics_text(self):
+        """ Renders every metric in the Prometheus text exposition format """
+        return self.metrics.render()
+
+    def pids(self):
+        """ Process ids of every moses server the daemon runs """
+        return [pid for pool in self.pools.values() for pid in pool.pids()]
+
+    def shutdown(self, wait=False):
+        """
+        Stops the front end, which in turn stops the decoders. With wait,
+        blocks until a background front end has finished shutting down
+        """
+        self.stopping.set()
+        if self.service is not None:
+            self.service.stop()
+        if wait and self.thread is not None:
+            self.thread.join()
+
+    def _finished(self, leg, profile, version, text, start, kind, future):
+        """ Records the outcome of a request sent to the decoders """
+        if kind == "interactive":
+            with self.interactive_lock:
+                self.interactive -= 1
+        if future.cancelled():
+            self.cancelled.inc(leg=leg)
+            return
+        error = future.exception()
+        if isinstance(error, TimeoutError):
+            self.timeouts.inc(leg=leg)
+        elif error is not None:
+            self.errors.inc(leg=leg)
+        else:
+            self.cache.put((leg, profile), version, text, future.result())
+            self.latency.observe(time.time() - start, leg=leg, profile=profile, kind=kind)
+
+    def _build_metrics(self):
+        self.metrics = Registry()
+        self.requests = self.metrics.counter("translation_requests_total",
+            "Translation requests received", ["leg", "profile"])
+        self.errors = self.metrics.counter("translation_errors_total",
+            "Translation requests which failed", ["leg"])
+        self.timeouts = self.metrics.counter("translation_timeouts_total",
+            "Translation requests which timed out", ["leg"])
+        self.cancelled = self.metrics.counter("translation_cancelled_total",
+            "Queued translation requests dropped after a timeout or disconnect", ["leg"])
+        self.rejected = self.metrics.counter("translation_rejected_total",
+            "Translation requests turned away because the leg was overloaded", ["leg"])
+        self.latency = self.metrics.histogram("translation_request_duration_seconds",
+            "Time to answer a successful translation request", ["leg", "profile", "kind"])
+        self.cache_hits = self.metrics.counter("translation_cache_hits_total",
+            "Translation requests answered from the cache", ["leg"])
+        self.cache_misses = self.metrics.counter("translation_cache_misses_total",
+            "Translation requests sent to a decoder", ["leg"])
+        self.reloads = self.metrics.counter("decoder_reloads_total",
+            "Times a leg was switched over to newly loaded replicas", ["leg", "profile"])
+        self.metrics.gauge("translation_cache_hit_ratio",
+            "Share of translation requests answered from the cache", ["leg"],
+            collect=self._cache_hit_ratios)
+        self.metrics.gauge("translation_in_flight_requests",
+            "Requests sent to a decoder and not yet answered", ["leg", "profile"],
+            collect=lambda: self._per_leg(lambda pool: pool.queue_depth()))
+        self.metrics.gauge("translation_queue_depth",
+            "Requests waiting to be batched", ["leg", "profile"],
+            collect=lambda: self._per_leg(lambda pool: pool.waiting()))
+        self.metrics.gauge("bulk_jobs", "Bulk jobs in each state", ["state"],
+            collect=lambda: [({"state": state}, count) for state, count in
+                             (self.jobs.counts() if self.jobs else {}).items()])
+        self.metrics.gauge("decoder_replicas", "Decoder replicas serving the leg", ["leg", "profile"],
+            collect=lambda: self._per_leg(lambda pool: len(pool.replicas)))
+        self.metrics.counter("decoder_restarts_total", "Times a replica was restarted",
+            ["leg", "profile", "replica"], collect=lambda: self._per_replica(lambda d, p: d.restarts))
+        self.metrics.gauge("decoder_resident_memory_bytes", "Resident set size of a replica",
+            ["leg", "profile", "replica"], collect=lambda: self._per_replica(lambda d, p: p.memory_info().rss))
+        self.metrics.gauge("decoder_private_memory_bytes",
+            "Memory of a replica not shared with any other process",
+            ["leg", "profile", "replica"], collect=lambda: self._per_replica(lambda d, p: p.memory_full_info().uss))
+        self.metrics.gauge("decoder_shared_memory_bytes",
+            "Resident memory of a replica shared with other processes, such as mapped tables",
+            ["leg", "profile", "replica"], collect=lambda: self._per_replica(
+                lambda d, p: p.memory_info().rss - p.memory_full_info().uss))
+        self.metrics.gauge("decoder_cpu_percent", "CPU use of a replica since the last scrape",
+            ["leg", "profile", "replica"], collect=lambda: self._per_replica(lambda d, p: p.cpu_percent()))
+
+    def _leg_name(self, working_dir):
+        return os.path.basename(os.path.abspath(working_dir))
+
+    def _per_leg(self, value):
+        return [({"leg": self._leg_name(d), "profile": profile}, value(pool))
+                for (d, profile), pool in self.pools.items()]
+
+    def _cache_hit_ratios(self):
+        ratios = []
+        for working_dir in self.working_dirs:
+            leg = self._leg_name(working_dir)
+            hits, misses = self.cache_hits.get(leg=leg), self.cache_misses.get(leg=leg)
+            ratios.append(({"leg": leg}, hits / (hits + misses) if hits + misses else 0.0))
+        return ratios
+
+    def _per_replica(self, value):
+        """
+        Applies value(decoder, process) to every live replica. psutil
+        processes are kept between scrapes so cpu_percent has a baseline
+        """
+        samples = []
+        for (working_dir, profile), pool in self.pools.items():
+            for i, replica in enumerate(list(pool.replicas)):
+                decoder = replica.decoder
+                if decoder.process is None:
+                    continue
+                pid = decoder.process.pid
+                try:
+                    if pid not in self.processes:
+                        self.processes[pid] = psutil.Process(pid)
+                    samples.append(({"leg": self._leg_name(working_dir), "profile": profile,
+                        "replica": str(i)},
+                        value(decoder, self.processes[pid])))
+                except psutil.Error:
+                    self.processes.pop(pid, None)
+        return samples
+
+    def _pool_key(self, working_dir, profile=None):
+        """ The key of the pool serving working_dir under profile, or the default profile """
+        working_dir = os.path.abspath(working_dir)
+        profile = profile or self.default_profile
+        if working_dir not in self.working_dirs:
+            raise KeyError("no decoder for {}".format(working_dir))
+        if profile not in self.profiles:
+            raise KeyError("no decoding profile {}".format(profile))
+        return working_dir, profile
+
+    def _pool(self, working_dir, profile=None):
+        return self.pools[self._pool_key(working_dir, profile)]
+
+    def _monitor(self):
+        """
+        Restarts replicas which have crashed or stopped answering, resizes
+        each pool to its load and reloads legs whose model has changed
+        """
+        while not self.stopping.wait(self.check_interval):
+            for (working_dir, profile), pool in list(self.pools.items()):
+                if self.stopping.is_set():
+                    return
+                pool.check_health(self.max_failed_checks)
+                pool.autoscale()
+                if self.watch_models:
+                    self._check_model(working_dir, pool)
+
+    def _check_model(self, working_dir, pool):
+        """
+        Starts a background reload when the model of working_dir no longer
+        matches the one being served. A version which failed to load is
+        not retried until the model changes again
+        """
+        try:
+            version = utilities.model_fingerprint(pool.moses_ini)
+        except OSError:
+            return
+        if version == pool.version or self.failed_versions.get(working_dir) == version:
+            return
+        if self.reload_lock.locked():
+            return
+
+        def run():
+            try:
+                self.reload(working_dir, force=False)
+            except Exception as e:
+                self.failed_versions[working_dir] = version
+                self._print("Reload of {} failed: {}\n".format(working_dir, e))
+        threading.Thread(target=run, daemon=True).start()
+
+    def _stop_decoders(self):
+        self.stopping.set()
+        if self.jobs is not None:
+            self.jobs.stop()
+        for pool in self.pools.values():
+            pool.stop()
+        if self.state_file and utilities.file_exists(self.state_file):
+            os.remove(self.state_file)
+
+    def _write_state(self):
+        """ Advertises the service port so clients can attach """
+        self.port = self.service.port
+        if self.state_file:
+            with open(self.state_file, 'w') as f:
+                json.dump({"pid": os.getpid(), "port": self.port, "legs": self.legs(),
+                           "profiles": self.profile_names()}, f)
+
+def profiles_from_config(config):
+    """
+    The decoding profiles named by decoding_profiles in [Server Settings],
+    mapped to their moses flags, and the default profile. Flags are read
+    from [Decoding Profiles], falling back on the built in PROFILES
+    """
+    names = config.get("Server Settings", "decoding_profiles", fallback=DEFAULT_PROFILE).split()
+    default_profile = config.get("Server Settings", "default_profile", fallback=DEFAULT_PROFILE)
+    profiles = {}
+    for name in names:
+        flags = config.get("Decoding Profiles", name, fallback=PROFILES.get(name))
+        assert flags is not None, "DecoderDaemonError: no flags given for profile {}".format(name)
+        profiles[name] = flags
+    return profiles, default_profile
+
+def main():
+    config = utilities.config_file_reader()
+    path_to_moses = utilities.safe_string(config.get("Environment Settings", "path_to_moses_decoder"))
+    work_dir1 = utilities.safe_string(config.get("Iteration Settings", "working_dir_first_leg"))
+    work_dir2 = utilities.safe_string(config.get("Iteration Settings", "working_dir_second_leg"))
+    port = config.getint("Server Settings", "port", fallback=0)
+    max_batch = config.getint("Server Settings", "max_batch", fallback=32)
+    max_batch_delay = config.getfloat("Server Settings", "max_batch_delay", fallback=0.005)
+    pivot_queue_size = config.getint("Server Settings", "pivot_queue_size", fallback=8)
+    ncpus = config.getint("Environment Settings", "ncpus", fallback=1)
+    min_replicas = config.getint("Server Settings", "min_replicas", fallback=1)
+    max_replicas = config.getint("Server Settings", "max_replicas", fallback=0)
+    scale_up_latency = config.getfloat("Server Settings", "scale_up_latency", fallback=2.0)
+    scale_up_queue_depth = config.getint("Server Settings", "scale_up_queue_depth", fallback=4)
+    scale_down_after = config.getfloat("Server Settings", "scale_down_after", fallback=60)
+    cache_size = config.getint("Server Settings", "translation_cache_size", fallback=10000)
+    document_parallelism = config.getint("Server Settings", "document_parallelism", fallback=64)
+    decoder_threads = config.getint("Server Settings", "decoder_threads", fallback=8)
+    watch_models = config.getboolean("Server Settings", "watch_models", fallback=True)
+    shared_models = config.getboolean("Server Settings", "shared_models", fallback=False)
+    prewarm_models = config.getboolean("Server Settings", "prewarm_models", fallback=False)
+    request_timeout = config.getfloat("Server Settings", "request_timeout", fallback=30)
+    max_queue_per_replica = config.getint("Server Settings", "max_queue_per_replica", fallback=64)
+    max_decode_time = config.getint("Server Settings", "max_decode_time", fallback=0)
+    bulk_chunk_size = config.getint("Server Settings", "bulk_chunk_size", fallback=32)
+    profiles, default_profile = profiles_from_config(config)
+
+    daemon = DecoderDaemon(path_to_moses, [work_dir1, work_dir2], port=port,
+        max_batch=max_batch, max_batch_delay=max_batch_delay,
+        pivot_queue_size=pivot_queue_size, ncpus=ncpus, min_replicas=min_replicas,
+        max_replicas=max_replicas, scale_up_latency=scale_up_latency,
+        scale_up_queue_depth=scale_up_queue_depth, scale_down_after=scale_down_after,
+        cache_size=cache_size, document_parallelism=document_parallelism,
+        decoder_threads=decoder_threads, watch_models=watch_models,
+        shared_models=shared_models, prewarm_models=prewarm_models,
+        request_timeout=request_timeout, max_queue_per_replica=max_queue_per_replica,
+        max_decode_time=max_decode_time, bulk_chunk_size=bulk_chunk_size, profiles=profiles,
+        default_profile=default_profile, verbose=True)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.shutdown())
+    daemon.start()
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
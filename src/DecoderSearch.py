@@ -0,0 +1,280 @@
+"""
+Searches decoder settings for a tuned leg. Stack size, cube pruning pop
+limit, distortion limit and thread count trade decoding speed against
+quality. Each candidate setting decodes a sample of the leg's tune set
+through the same filtering, decoding and BLEU scoring Test uses, and is
+measured in sentences per second and BLEU. The settings on the Pareto
+frontier of the two are reported, and the chosen one can be written
+back into the leg's mert-work/moses.ini
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import itertools
+
+import utilities
+from Test import Test
+from MosesConfig import MosesConfig
+from FileDataPair import FileDataPair
+
+SEARCH_DIR = "decoder-search/"
+PARAMETERS = ["stack", "pop_limit", "distortion_limit", "threads"]
+
+class DecoderSearch(object):
+    """
+    Candidate settings are dicts over PARAMETERS. A pop_limit of 0 keeps
+    Moses' normal stack search, any other value switches to cube pruning
+    with that pop limit
+    """
+    def __init__(self, path_to_moses, working_dir, ncpus=1, verbose=False):
+        self.path_to_moses = path_to_moses
+        self.working_dir = working_dir
+        self.search_dir = working_dir + "/" + SEARCH_DIR
+        self.tester = Test(path_to_moses, verbose, ncpus=ncpus)
+        self.verbose = verbose
+        utilities.make_dir(self.search_dir)
+
+    def _print(self, item):
+        if self.verbose:
+            utilities.flush_print(item)
+
+    def sample(self, src_tune, tar_tune, size, seed=0):
+        """
+        Writes size random lines of the tune set, in a random order so
+        that any prefix of the sample is itself a random sample. Returns
+        the absolute paths of the source and reference samples
+        """
+        pairs = list(zip(open(src_tune, 'r'), open(tar_tune, 'r')))
+        random.Random(seed).shuffle(pairs)
+        src_sample = os.path.abspath(self.search_dir + "sample.src")
+        ref_sample = os.path.abspath(self.search_dir + "sample.ref")
+        with open(src_sample, 'w') as src, open(ref_sample, 'w') as ref:
+            for src_line, tar_line in pairs[:size]:
+                src.write(src_line)
+                ref.write(tar_line)
+        return src_sample, ref_sample
+
+    def flags(self, settings):
+        """ The moses flags for settings """
+        flags = ["-s {}".format(settings["stack"]),
+                 "-distortion-limit {}".format(settings["distortion_limit"]),
+                 "-threads {}".format(settings["threads"])]
+        if settings["pop_limit"]:
+            flags += ["-search-algorithm 1", "-cube-pruning-pop-limit {}".format(settings["pop_limit"])]
+        return " ".join(flags)
+
+    def _name(self, settings, lines):
+        return "s{stack}.p{pop_limit}.d{distortion_limit}.t{threads}".format(**settings) + \
+            ".n{}".format(lines)
+
+    def evaluate(self, settings, src_sample, ref_sample, lines):
+        """
+        Decodes the first lines of the sample with settings, returning
+        their throughput, decode latencies and BLEU
+        """
+        name = self._name(settings, lines)
+        src, ref = self.search_dir + name + ".src", self.search_dir + name + ".ref"
+        for sample, part in [(src_sample, src), (ref_sample, ref)]:
+            with open(part, 'w') as stream:
+                stream.writelines(itertools.islice(open(sample, 'r'), lines))
+
+        # filtered once for the whole sample, then reused for every prefix of it
+        filt_dir = self.tester._get_filtered_model(src_sample, self.working_dir, "search.binarizer.out")
+        result, debug = src + ".translated", SEARCH_DIR + name + ".out"
+        start = time.time()
+        self.tester._translate_pivot(src, self.working_dir, result, filt_dir, debug, self.flags(settings))
+        elapsed = time.time() - start
+        bleu_file = self.search_dir + name + ".bleu"
+        self.tester._get_bleu_score(result, ref, self.working_dir, bleu_file)
+
+        latencies = sorted(decode_times(self.working_dir + "/" + debug))
+        measured = dict(settings)
+        measured.update({"sentences": lines, "seconds": round(elapsed, 3),
+                         "sentences_per_sec": round(lines / elapsed, 3) if elapsed else None,
+                         "p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95),
+                         "bleu": read_bleu(bleu_file)})
+        self._print("\t{} {} sent/s BLEU {}\n".format(name, measured["sentences_per_sec"], measured["bleu"]))
+        return measured
+
+    def grid(self, candidates, src_sample, ref_sample, lines):
+        """ Evaluates every candidate on the first lines of the sample """
+        return [self.evaluate(settings, src_sample, ref_sample, lines) for settings in candidates]
+
+    def successive_halving(self, candidates, src_sample, ref_sample, lines, rate=3, min_lines=50):
+        """
+        Evaluates every candidate on a small prefix of the sample, keeps
+        the best 1/rate of them by Pareto rank, but never fewer than the
+        whole frontier, and evaluates those on a prefix rate times as
+        long, until the whole sample is reached or a single candidate is
+        left. Returns the results of the last round
+        """
+        rounds = max(0, int(math.ceil(math.log(max(len(candidates), 1), rate))))
+        size = max(min(lines, min_lines), lines // rate ** rounds)
+        while True:
+            self._print("Evaluating {} settings on {} sentences\n".format(len(candidates), size))
+            results = self.grid(candidates, src_sample, ref_sample, size)
+            if size >= lines or len(candidates) == 1:
+                return results
+            keep = max(int(math.ceil(len(candidates) / rate)), len(pareto_frontier(results)))
+            candidates = [{p: r[p] for p in PARAMETERS} for r in pareto_order(results)[:keep]]
+            size = min(lines, size * rate)
+
+    def choose(self, results, max_bleu_loss=0.5, min_speed=0.0):
+        """
+        Of the frontier, the fastest setting within max_bleu_loss BLEU of
+        the best one, or the best scoring setting reaching min_speed
+        sentences per second if that is given
+        """
+        frontier = pareto_frontier(results)
+        if min_speed:
+            fast = [r for r in frontier if (r["sentences_per_sec"] or 0) >= min_speed]
+            if fast:
+                return max(fast, key=lambda r: r["bleu"])
+        best = max(r["bleu"] for r in frontier)
+        good = [r for r in frontier if r["bleu"] >= best - max_bleu_loss]
+        return max(good, key=lambda r: r["sentences_per_sec"] or 0)
+
+    def write_back(self, settings):
+        """
+        Writes settings into the leg's mert-work/moses.ini, keeping a copy
+        of the file as it was beside it
+        """
+        moses_ini = self.working_dir + "/mert-work/moses.ini"
+        backup = moses_ini + ".before-search"
+        if not utilities.file_exists(backup):
+            with open(backup, 'w') as stream:
+                stream.write(open(moses_ini, 'r').read())
+        config = MosesConfig(moses_ini)
+        config.set("stack", [settings["stack"]])
+        config.set("distortion-limit", [settings["distortion_limit"]])
+        config.set("threads", [settings["threads"]])
+        if settings["pop_limit"]:
+            config.set("search-algorithm", [1])
+            config.set("cube-pruning-pop-limit", [settings["pop_limit"]])
+        else:
+            config.remove("search-algorithm")
+            config.remove("cube-pruning-pop-limit")
+        config.write()
+
+    def search(self, src_tune, tar_tune, space, sample_size=500, method="halving", rate=3,
+        max_bleu_loss=0.5, min_speed=0.0, write=False):
+        """
+        Runs the search over space, a dict mapping each of PARAMETERS to
+        the values to try, and saves a report of every result, the
+        frontier and the chosen setting as decoder_search.json in the
+        search directory. Returns the report
+        """
+        self._print("Searching decoder settings for {}...\n".format(self.working_dir))
+        src_sample, ref_sample = self.sample(src_tune, tar_tune, sample_size)
+        lines = sum(1 for _ in open(src_sample, 'r'))
+        candidates = [dict(zip(PARAMETERS, values))
+                      for values in itertools.product(*[space[p] for p in PARAMETERS])]
+        if method == "grid":
+            results = self.grid(candidates, src_sample, ref_sample, lines)
+        else:
+            results = self.successive_halving(candidates, src_sample, ref_sample, lines, rate)
+
+        chosen = self.choose(results, max_bleu_loss, min_speed)
+        report = {"working_dir": self.working_dir, "method": method, "sample": lines,
+                  "space": space, "results": results, "frontier": pareto_frontier(results),
+                  "chosen": chosen, "written": write}
+        with open(self.search_dir + "decoder_search.json", 'w') as stream:
+            json.dump(report, stream, indent=2)
+        self._report(report)
+        if write:
+            self.write_back(chosen)
+        return report
+
+    def _report(self, report):
+        print("Pareto frontier for {} ({} sentences)".format(report["working_dir"], report["sample"]))
+        print("\t{:>6} {:>9} {:>11} {:>8} {:>10} {:>7}".format(
+            "stack", "pop_limit", "distortion", "threads", "sent/s", "BLEU"))
+        for r in report["frontier"]:
+            mark = " *" if r is report["chosen"] else ""
+            print("\t{:>6} {:>9} {:>11} {:>8} {:>10} {:>7}{}".format(r["stack"], r["pop_limit"],
+                r["distortion_limit"], r["threads"], r["sentences_per_sec"], r["bleu"], mark))
+
+def decode_times(logfile):
+    """ Per sentence decode times, in seconds, from the decoder's stderr """
+    times = []
+    for line in open(logfile, 'r'):
+        if "Translation took" in line:
+            times.append(float(line.split("took")[1].split()[0]))
+    return times
+
+def percentile(ordered, p):
+    """ Nearest rank percentile of sorted values, in milliseconds """
+    if not ordered:
+        return None
+    rank = max(0, int(math.ceil(p / 100.0 * len(ordered))) - 1)
+    return round(ordered[rank] * 1000, 3)
+
+def read_bleu(bleu_file):
+    """ The score from a multi-bleu.perl result such as 'BLEU = 23.45, ...', or 0 """
+    if not utilities.file_exists(bleu_file):
+        return 0.0
+    line = open(bleu_file, 'r').readline()
+    if "BLEU = " not in line:
+        return 0.0
+    return float(line.split("BLEU = ")[1].split(",")[0])
+
+def dominates(a, b):
+    """ True if a is at least as fast and as good as b, and better in one """
+    speed_a, speed_b = a["sentences_per_sec"] or 0, b["sentences_per_sec"] or 0
+    return speed_a >= speed_b and a["bleu"] >= b["bleu"] and \
+        (speed_a > speed_b or a["bleu"] > b["bleu"])
+
+def pareto_frontier(results):
+    """ The results no other result dominates, fastest first """
+    frontier = [r for r in results if not any(dominates(other, r) for other in results)]
+    return sorted(frontier, key=lambda r: -(r["sentences_per_sec"] or 0))
+
+def pareto_order(results):
+    """ results sorted front by front, best BLEU first within a front """
+    ordered, left = [], list(results)
+    while left:
+        front = [r for r in left if not any(dominates(other, r) for other in left)]
+        ordered += sorted(front, key=lambda r: -r["bleu"])
+        left = [r for r in left if r not in front]
+    return ordered
+
+def space_from_config(config):
+    """ The values to try for each parameter, from [Decoder Search] in config.ini """
+    section = "Decoder Search"
+    keys = {"stack": "stack_sizes", "pop_limit": "pop_limits",
+            "distortion_limit": "distortion_limits", "threads": "threads"}
+    defaults = {"stack": "50 100 200", "pop_limit": "0 500 1000",
+                "distortion_limit": "6", "threads": "1"}
+    return {p: [int(v) for v in config.get(section, keys[p], fallback=defaults[p]).split()]
+            for p in PARAMETERS}
+
+def main():
+    # Searches the legs named on the command line, or both legs in config.ini,
+    # using the tune sets the pipeline split for them
+    config = utilities.config_file_reader()
+    path_to_moses = utilities.safe_string(config.get("Environment Settings", "path_to_moses_decoder"))
+    ncpus = config.getint("Environment Settings", "ncpus")
+    section = "Decoder Search"
+
+    legs = {config.get("Iteration Settings", "working_dir_first_leg"):
+                FileDataPair(config.get("Iteration Settings", "src_lang_data"),
+                             config.get("Iteration Settings", "src_piv_lang_data")),
+            config.get("Iteration Settings", "working_dir_second_leg"):
+                FileDataPair(config.get("Iteration Settings", "piv_tar_lang_data"),
+                             config.get("Iteration Settings", "tar_lang_data"))}
+    for working_dir in sys.argv[1:] or list(legs):
+        src_tune, tar_tune = legs[working_dir].get_tune_filenames()
+        DecoderSearch(path_to_moses, working_dir, ncpus, True).search(src_tune, tar_tune,
+            space_from_config(config),
+            config.getint(section, "sample_size", fallback=500),
+            config.get(section, "method", fallback="halving"),
+            config.getint(section, "halving_rate", fallback=3),
+            config.getfloat(section, "max_bleu_loss", fallback=0.5),
+            config.getfloat(section, "min_sentences_per_sec", fallback=0.0),
+            config.getboolean(section, "write_back", fallback=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+Integer encoded corpora. A corpus is stored as uint32 token ids into a
+vocabulary shared by every corpus under the data directory, alongside an
+array of where each sentence starts. Whole corpus operations, such as
+length filtering, splitting and matching, then run as numpy operations
+over memory mapped arrays instead of line by line over strings. The text
+files Moses reads are regenerated from the arrays on demand
+"""
+import os
+import json
+
+import numpy
+
+import utilities
+
+ENCODED_DIR = "encoded/"
+VOCAB_FILE = "vocab.txt"
+TOKEN_TYPE = numpy.uint32
+
+# Tokens written or gathered per block, bounding the memory of bulk operations
+BLOCK_TOKENS = 1 << 22
+
+# Sentence hashes weight each token by a multiplier drawn for its position
+# from a fixed seed, so equal sentences hash equal in every corpus
+HASH_SEED = 8090
+HASH_POSITIONS = 4096
+LENGTH_MIX = numpy.uint64(0x9E3779B97F4A7C15)
+
+class Vocabulary(object):
+    """
+    Token ids are given out in order of first appearance and never
+    change, so corpora encoded at different times stay comparable
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tokens = []
+        if utilities.file_exists(path):
+            self.tokens = open(path, 'r', newline="\n").read().split("\n")[:-1]
+        self.ids = {token: i for i, token in enumerate(self.tokens)}
+        self.saved = len(self.tokens)
+        self.table = None
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def encode(self, tokens):
+        """ Ids of tokens, adding any token not yet in the vocabulary """
+        ids = []
+        for token in tokens:
+            i = self.ids.get(token)
+            if i is None:
+                i = self.ids[token] = len(self.tokens)
+                self.tokens.append(token)
+            ids.append(i)
+        return ids
+
+    def decode(self, ids):
+        """ Array of the tokens with ids """
+        if self.table is None or len(self.table) != len(self.tokens):
+            self.table = numpy.array(self.tokens, dtype=object)
+        return self.table[ids]
+
+    def save(self):
+        """ Appends the tokens added since the vocabulary was last saved """
+        with open(self.path, 'a', newline="\n") as stream:
+            for token in self.tokens[self.saved:]:
+                stream.write(token + "\n")
+        self.saved = len(self.tokens)
+
+class EncodedCorpus(object):
+    """ One encoded corpus, read through memory maps """
+    def __init__(self, prefix, vocab):
+        self.prefix = prefix
+        self.vocab = vocab
+        self.meta = json.load(open(prefix + ".json", 'r'))
+        self.starts = numpy.load(prefix + ".starts.npy", mmap_mode='r')
+        if self.meta["tokens"]:
+            self.ids = numpy.memmap(prefix + ".ids", dtype=TOKEN_TYPE, mode='r')
+        else:
+            self.ids = numpy.zeros(0, dtype=TOKEN_TYPE)
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def lengths(self):
+        """ Number of tokens in each sentence """
+        return numpy.diff(self.starts).astype(numpy.int64)
+
+    def _blocks(self, indices):
+        """
+        Splits the sentences at indices into blocks of about BLOCK_TOKENS
+        tokens, yielding the token ids of each block and their lengths
+        """
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        lengths = self.lengths()[indices]
+        ends = numpy.cumsum(lengths)
+        cuts = numpy.searchsorted(ends, numpy.arange(BLOCK_TOKENS, ends[-1] if len(ends) else 0,
+                                                     BLOCK_TOKENS), side='right')
+        for first, last in zip(numpy.concatenate([[0], cuts]), numpy.concatenate([cuts, [len(indices)]])):
+            block, block_lengths = indices[first:last], lengths[first:last]
+            offsets = numpy.cumsum(block_lengths) - block_lengths
+            positions = numpy.repeat(self.starts[block].astype(numpy.int64) - offsets, block_lengths) + \
+                numpy.arange(block_lengths.sum())
+            yield self.ids[positions], block_lengths
+
+    def hashes(self):
+        """ A 64 bit hash of each sentence's tokens """
+        multipliers = numpy.random.RandomState(HASH_SEED).randint(
+            0, 2 ** 62, HASH_POSITIONS, dtype=numpy.uint64) * numpy.uint64(2) + numpy.uint64(1)
+        hashes = []
+        for ids, lengths in self._blocks(numpy.arange(len(self))):
+            starts = numpy.cumsum(lengths) - lengths
+            positions = numpy.arange(len(ids)) - numpy.repeat(starts, lengths)
+            weighted = (ids.astype(numpy.uint64) + numpy.uint64(1)) * multipliers[positions % HASH_POSITIONS]
+            sums = numpy.concatenate([numpy.zeros(1, dtype=numpy.uint64), numpy.cumsum(weighted, dtype=numpy.uint64)])
+            hashes.append((sums[starts + lengths] - sums[starts]) ^ (lengths.astype(numpy.uint64) * LENGTH_MIX))
+        return numpy.concatenate(hashes) if hashes else numpy.zeros(0, dtype=numpy.uint64)
+
+    def lines(self, indices=None):
+        """ Yields the text of the sentences at indices, or of every sentence """
+        if indices is None:
+            indices = numpy.arange(len(self))
+        for ids, lengths in self._blocks(indices):
+            tokens = self.vocab.decode(ids)
+            position = 0
+            for length in lengths.tolist():
+                yield " ".join(tokens[position:position + length])
+                position += length
+
+    def stats(self):
+        """ Sizes and sentence length statistics of the corpus """
+        lengths = self.lengths()
+        counts = numpy.bincount(self.ids, minlength=len(self.vocab)) if len(self.ids) else numpy.zeros(0)
+        return {"sentences": len(self), "tokens": int(lengths.sum()),
+                "types": int(numpy.count_nonzero(counts)),
+                "mean_length": round(float(lengths.mean()), 2) if len(lengths) else 0.0,
+                "max_length": int(lengths.max()) if len(lengths) else 0,
+                "encoded_bytes": os.path.getsize(self.prefix + ".ids") +
+                                 os.path.getsize(self.prefix + ".starts.npy")}
+
+class EncodedCorpora(object):
+    """
+    The encoded corpora under home, each named after the text file it
+    holds and stamped with that file's checksum, so an encoding is only
+    used while it matches its text
+    """
+    def __init__(self, home="data/"):
+        self.dir = home + ENCODED_DIR
+        utilities.make_dir(self.dir)
+        self.vocab = Vocabulary(self.dir + VOCAB_FILE)
+
+    def prefix(self, text_file):
+        return self.dir + utilities.strip_filename_from_path(text_file)
+
+    def load(self, text_file, checksum):
+        """ The encoding of text_file, or None if it is missing or stale """
+        prefix = self.prefix(text_file)
+        if not utilities.files_exist([prefix + ".json", prefix + ".starts.npy"]):
+            return None
+        corpus = EncodedCorpus(prefix, self.vocab)
+        return corpus if corpus.meta["sha1"] == checksum else None
+
+    def encode(self, text_file, checksum):
+        """ Encodes text_file, lowercased and split on whitespace """
+        prefix = self.prefix(text_file)
+        starts, block, written = [0], [], 0
+        with open(prefix + ".ids", 'wb') as stream:
+            for line in open(text_file, 'r'):
+                block += self.vocab.encode(line.lower().split())
+                starts.append(written + len(block))
+                if len(block) >= BLOCK_TOKENS:
+                    numpy.array(block, dtype=TOKEN_TYPE).tofile(stream)
+                    written, block = written + len(block), []
+            numpy.array(block, dtype=TOKEN_TYPE).tofile(stream)
+        self.vocab.save()
+        return self._finish(prefix, numpy.array(starts, dtype=numpy.uint64), text_file, checksum)
+
+    def take(self, corpus, indices, text_file, checksum):
+        """ Encodes the sentences of corpus at indices as the encoding of text_file """
+        prefix = self.prefix(text_file)
+        lengths = corpus.lengths()[numpy.asarray(indices, dtype=numpy.int64)]
+        with open(prefix + ".ids", 'wb') as stream:
+            for ids, _ in corpus._blocks(indices):
+                numpy.asarray(ids, dtype=TOKEN_TYPE).tofile(stream)
+        starts = numpy.concatenate([[0], numpy.cumsum(lengths)]).astype(numpy.uint64)
+        return self._finish(prefix, starts, text_file, checksum)
+
+    def _finish(self, prefix, starts, text_file, checksum):
+        numpy.save(prefix + ".starts.npy", starts)
+        with open(prefix + ".json", 'w') as stream:
+            json.dump({"text": text_file, "sha1": checksum, "sentences": len(starts) - 1,
+                       "tokens": int(starts[-1])}, stream)
+        return EncodedCorpus(prefix, self.vocab)
+
+def match_indices(first, second):
+    """
+    Pairs the sentences two corpora share. Returns, in order of the
+    first corpus, the index in each corpus of the last occurrence of
+    every shared sentence
+    """
+    first_hashes, first_last = _last_occurrences(first.hashes())
+    second_hashes, second_last = _last_occurrences(second.hashes())
+    _, a, b = numpy.intersect1d(first_hashes, second_hashes, assume_unique=True, return_indices=True)
+    order = numpy.argsort(first_last[a])
+    return first_last[a][order], second_last[b][order]
+
+def _last_occurrences(hashes):
+    unique, first_reversed = numpy.unique(hashes[::-1], return_index=True)
+    return unique, len(hashes) - 1 - first_reversed
+
+def first_pair_occurrences(first, second, indices):
+    """ The indices, in order, whose sentence pair has not appeared earlier among them """
+    pairs = numpy.stack([first.hashes()[indices], second.hashes()[indices]], axis=1)
+    _, keep = numpy.unique(pairs, axis=0, return_index=True)
+    return indices[numpy.sort(keep)]
@@ -0,0 +1,91 @@
+"""
+Sorting records too many to hold in memory. Records are gathered into
+runs that fit in memory, each run is sorted and spilled to disk, and the
+runs are merged back in order with a heap, a chunk of each at a time
+"""
+import os
+import heapq
+import shutil
+import tempfile
+
+import numpy
+
+class ExternalSorter(object):
+    """
+    Sorts fixed size records of a numpy structured dtype on all their
+    fields, in field order, holding at most about mem_limit bytes of
+    records at a time. Runs are spilled to a temporary directory under
+    tmpdir, removed by cleanup
+    """
+    def __init__(self, dtype, mem_limit, tmpdir=None):
+        self.dtype = numpy.dtype(dtype)
+        # sorting a run takes about three times its size
+        self.run_records = max(1, mem_limit // (3 * self.dtype.itemsize))
+        self.buffer = []
+        self.buffered = 0
+        self.runs = []
+        self.records = 0
+        self.dir = tempfile.mkdtemp(prefix="sort.", dir=tmpdir)
+
+    def add(self, records):
+        """ Adds an array of records """
+        self.buffer.append(numpy.asarray(records, dtype=self.dtype))
+        self.buffered += len(records)
+        self.records += len(records)
+        if self.buffered >= self.run_records:
+            self._spill()
+
+    def _spill(self):
+        if not self.buffered:
+            return
+        records = numpy.concatenate(self.buffer).astype(self.dtype, copy=False)
+        records = records[numpy.lexsort([records[name] for name in reversed(self.dtype.names)])]
+        path = os.path.join(self.dir, "run{}".format(len(self.runs)))
+        records.tofile(path)
+        self.runs.append(path)
+        self.buffer, self.buffered = [], 0
+
+    def merged(self):
+        """ Yields every record added, in order, as a tuple """
+        self._spill()
+        chunk = max(1, self.run_records // max(len(self.runs), 1))
+        return heapq.merge(*[self._read_run(path, chunk) for path in self.runs])
+
+    def _read_run(self, path, chunk):
+        with open(path, 'rb') as stream:
+            while True:
+                data = stream.read(chunk * self.dtype.itemsize)
+                if not data:
+                    return
+                yield from numpy.frombuffer(data, dtype=self.dtype).tolist()
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+def last_of_each_key(records, width):
+    """
+    Of sorted records whose first width fields form a key, yields the
+    last record with each key
+    """
+    previous = None
+    for record in records:
+        if previous is not None and record[:width] != previous[:width]:
+            yield previous
+        previous = record
+    if previous is not None:
+        yield previous
+
+def merge_join(first, second, width):
+    """
+    Joins two sorted streams of records with unique keys of width fields,
+    yielding the pairs of records that share a key
+    """
+    a, b = next(first, None), next(second, None)
+    while a is not None and b is not None:
+        if a[:width] == b[:width]:
+            yield a, b
+            a, b = next(first, None), next(second, None)
+        elif a[:width] < b[:width]:
+            a = next(first, None)
+        else:
+            b = next(second, None)
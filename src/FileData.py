@@ -1,4 +1,5 @@
 import utilities
+from CorpusCatalog import CorpusCatalog, TOK, CLEANSED, TRAIN, TUNE, TEST, MATCHED
 
 class FileData(object):
     def __init__(self, file_uri, home="data/"):
@@ -6,9 +7,7 @@ class FileData(object):
 
         self.raw_file = file_uri
         self.dir = home
-        self.train_dir = "train/"
-        self.tune_dir = "tune/"
-        self.test_dir = "test/"
+        self.catalog = CorpusCatalog(home)
 
         self._init_filename()
         self._init_filename_tokenized()
@@ -26,53 +25,45 @@ class FileData(object):
         return self.base_name
 
     def _init_filename_tokenized(self):
-        self.name_tok = self.base_name + ".tok"
+        self.name_tok = self.catalog.derived_path(self.raw_file, TOK)
 
     def get_filename_tokenized(self):
         return self.name_tok
 
     def _init_filename_cleansed(self):
-        self.name_cleansed = self.name_tok + ".cleansed"
+        self.name_cleansed = self.catalog.derived_path(self.name_tok, CLEANSED)
 
     def get_filenames_cleansed(self):
         return self.name_cleansed
 
     def _init_filename_for_train_set(self):
-        self.train = self._make_set_filename(self.name_cleansed, self.train_dir)
+        self.train = self.catalog.derived_path(self.name_cleansed, TRAIN)
 
     def get_filename_train(self):
         return self.train
 
     def _init_filename_for_tune_set(self):
-        self.tune = self._make_set_filename(self.name_cleansed, self.tune_dir)
+        self.tune = self.catalog.derived_path(self.name_cleansed, TUNE)
 
     def get_filename_tune(self):
         return self.tune
 
     def _init_filename_for_test_set(self):
-        self.test = self._make_set_filename(self.name_cleansed, self.test_dir)
+        self.test = self.catalog.derived_path(self.name_cleansed, TEST)
 
     def get_filename_test(self):
         return self.test
 
-    def _make_set_filename(self, filename, _set):
-        ext = "." + self._chop_last_char(_set)
-        return self._insert_path_into_name_after_symbol(filename, "/", _set) + ext
-
-    def _insert_path_into_name_after_symbol(self, name, symbol, path):
-        index = name.find(symbol) + 1
-        return name[:index] + path + name[index:]
-
-    def _chop_last_char(self, string):
-        str_limit = len(string) - 1
-        return string[:str_limit]
-
     def _init_filename_for_pivot_evaluation(self):
-        self.eval = self.test + ".matched"
+        self.eval = self.catalog.derived_path(self.test, MATCHED)
 
     def get_filename_for_pivot_evaluation(self):
         return self.eval
 
+    def lineage(self, filename):
+        """ The files filename was derived from, back to the raw corpus """
+        return self.catalog.lineage(filename)
+
 def main():
     fd = FileData("data/src/europarl-v7.es-en.es")
     print(fd.get_filename())
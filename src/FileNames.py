@@ -1,4 +1,5 @@
 import utilities
+from CorpusCatalog import CorpusCatalog, TOK, CLEANSED, TRAIN, TUNE, TEST, MATCHED
 
 class FileNames(object):
     def __init__(self, src, piv1, piv2, tar, destdir):
@@ -7,6 +8,7 @@ class FileNames(object):
         self.piv2_path = piv2
         self.tar_path = tar
         self.dir = destdir
+        self.catalog = CorpusCatalog(destdir)
 
         self._init_filenames()
         self._init_filenames_tokenized()
@@ -30,73 +32,54 @@ class FileNames(object):
         return self.src_fname, self.piv1_fname, self.piv2_fname, self.tar_fname
 
     def _init_filenames_tokenized(self):
-        self.src_tok = self.src_fname + ".tok"
-        self.piv1_tok = self.piv1_fname + ".tok"
-        self.piv2_tok = self.piv2_fname + ".tok"
-        self.tar_tok = self.tar_fname + ".tok"
+        self.src_tok = self.catalog.derived_path(self.src_path, TOK)
+        self.piv1_tok = self.catalog.derived_path(self.piv1_path, TOK)
+        self.piv2_tok = self.catalog.derived_path(self.piv2_path, TOK)
+        self.tar_tok = self.catalog.derived_path(self.tar_path, TOK)
 
     def get_filenames_tokenized(self):
         return self.src_tok, self.piv1_tok, self.piv2_tok, self.tar_tok
 
     def _init_filenames_cleansed(self):
-        self.src_cleansed = self.src_tok + ".cleansed"
-        self.piv1_cleansed = self.piv1_tok + ".cleansed"
-        self.piv2_cleansed = self.piv2_tok + ".cleansed"
-        self.tar_cleansed = self.tar_tok + ".cleansed"
+        self.src_cleansed = self.catalog.derived_path(self.src_tok, CLEANSED)
+        self.piv1_cleansed = self.catalog.derived_path(self.piv1_tok, CLEANSED)
+        self.piv2_cleansed = self.catalog.derived_path(self.piv2_tok, CLEANSED)
+        self.tar_cleansed = self.catalog.derived_path(self.tar_tok, CLEANSED)
 
     def get_filenames_cleansed(self):
         return self.src_cleansed, self.piv1_cleansed, self.piv2_cleansed, \
             self.tar_cleansed
 
     def _init_filenames_for_test_set(self):
-        self.src_test = self._create_test_file_name(self.src_cleansed)
-        self.piv1_test = self._create_test_file_name(self.piv1_cleansed)
-        self.piv2_test = self._create_test_file_name(self.piv2_cleansed)
-        self.tar_test = self._create_test_file_name(self.tar_cleansed)
-
-    def _create_test_file_name(self, fname):
-        return self._insert_path_into_name_after_symbol(fname, "/", "test/") + \
-            ".test"
-
-    def _insert_path_into_name_after_symbol(self, name, symbol, path):
-        index = name.find(symbol) + 1
-        return name[:index] + path + name[index:]
+        self.src_test = self.catalog.derived_path(self.src_cleansed, TEST)
+        self.piv1_test = self.catalog.derived_path(self.piv1_cleansed, TEST)
+        self.piv2_test = self.catalog.derived_path(self.piv2_cleansed, TEST)
+        self.tar_test = self.catalog.derived_path(self.tar_cleansed, TEST)
 
     def get_filenames_for_test_set(self):
         return self.src_test, self.piv1_test, self.piv2_test, self.tar_test
 
     def _init_filenames_for_train_set(self):
-        self.src_train = self._create_train_file_name(self.src_cleansed)
-        self.piv1_train = self._create_train_file_name(self.piv1_cleansed)
-        self.piv2_train = self._create_train_file_name(self.piv2_cleansed)
-        self.tar_train = self._create_train_file_name(self.tar_cleansed)
-
-    def _create_train_file_name(self, fname):
-        return self._insert_path_into_name_after_symbol(fname, "/", "train/") + \
-            ".train"
+        self.src_train = self.catalog.derived_path(self.src_cleansed, TRAIN)
+        self.piv1_train = self.catalog.derived_path(self.piv1_cleansed, TRAIN)
+        self.piv2_train = self.catalog.derived_path(self.piv2_cleansed, TRAIN)
+        self.tar_train = self.catalog.derived_path(self.tar_cleansed, TRAIN)
 
     def get_filenames_for_train_set(self):
         return self.src_train, self.piv1_train, self.piv2_train, self.tar_train
 
     def _init_filenames_for_tune_set(self):
-        self.src_tune = self._create_tune_file_name(self.src_cleansed)
-        self.piv1_tune = self._create_tune_file_name(self.piv1_cleansed)
-        self.piv2_tune = self._create_tune_file_name(self.piv2_cleansed)
-        self.tar_tune = self._create_tune_file_name(self.tar_cleansed)
-
-    def _create_tune_file_name(self, fname):
-        return self._insert_path_into_name_after_symbol(fname, "/", "tune/") + \
-            ".tune"
+        self.src_tune = self.catalog.derived_path(self.src_cleansed, TUNE)
+        self.piv1_tune = self.catalog.derived_path(self.piv1_cleansed, TUNE)
+        self.piv2_tune = self.catalog.derived_path(self.piv2_cleansed, TUNE)
+        self.tar_tune = self.catalog.derived_path(self.tar_cleansed, TUNE)
 
     def get_filenames_for_tune_set(self):
         return self.src_tune, self.piv1_tune, self.piv2_tune, self.tar_tune
 
     def _init_filenames_for_evaluation(self):
-        self.src_eval = self._create_eval_file_name(self.src_test)
-        self.tar_eval = self._create_eval_file_name(self.tar_test)
-
-    def _create_eval_file_name(self, fname):
-        return fname + ".matched"
+        self.src_eval = self.catalog.derived_path(self.src_test, MATCHED)
+        self.tar_eval = self.catalog.derived_path(self.tar_test, MATCHED)
 
     def get_filenames_for_pivot_evaluation(self):
         return self.src_eval, self.tar_eval
@@ -0,0 +1,117 @@
+"""
+Content-addressed cache of filtered, binarized models.
+
+Filtered models are keyed by a hash of the source n-grams of the input they
+were filtered for and a fingerprint of the model they were filtered from.
+A filtered model can be reused for any later input whose n-grams are a
+subset of the ones it was built for. Least recently used entries are
+evicted once more than max_entries are kept on disk.
+"""
+import os
+import json
+import time
+import pickle
+import shutil
+import hashlib
+
+import utilities
+
+class FilterCache(object):
+    def __init__(self, working_dir, max_entries=4, max_phrase_len=7, verbose=False):
+        self.working_dir = working_dir
+        self.cache_dir = working_dir + "/filtered-models/"
+        self.index_file = self.cache_dir + "index.json"
+        self.max_entries = max_entries
+        self.max_phrase_len = max_phrase_len
+        self.verbose = verbose
+        utilities.make_dir(self.cache_dir)
+
+    def _print(self, item):
+        if self.verbose:
+            utilities.flush_print(item)
+
+    def fetch(self, src_file, moses_ini, build):
+        """
+        Returns the directory of a filtered model able to translate src_file.
+        Reuses a cached model when one covers every n-gram in src_file,
+        otherwise calls build with a fresh directory and caches the result.
+        build is expected to leave a moses.ini inside the directory it is given
+        """
+        ngrams = utilities.source_ngrams(src_file, self.max_phrase_len)
+        model = utilities.model_fingerprint(moses_ini)
+        index = self._read_index()
+
+        key = self._make_key(ngrams, model)
+        if key not in index:
+            key = self._find_covering_entry(index, ngrams, model)
+
+        if key is not None:
+            self._print("Reusing filtered model {}\n".format(key))
+            index[key]["last_used"] = time.time()
+            self._write_index(index)
+            return self._entry_dir(key)
+
+        key = self._make_key(ngrams, model)
+        filt_dir = self._entry_dir(key)
+        if utilities.dir_exists(filt_dir):
+            shutil.rmtree(filt_dir)
+        build(filt_dir)
+        if not utilities.file_exists(filt_dir + "moses.ini"):
+            return filt_dir
+
+        with open(self._ngram_file(key), 'wb') as f:
+            pickle.dump(ngrams, f)
+        index[key] = {"model": model, "input": src_file,
+                      "ngram_count": len(ngrams), "last_used": time.time()}
+        self._evict(index)
+        self._write_index(index)
+        return filt_dir
+
+    def _make_key(self, ngrams, model):
+        """ Content addresses a filtered model """
+        digest = hashlib.sha1(str.encode(model))
+        for ngram in sorted(ngrams):
+            digest.update(str.encode(ngram + "\n"))
+        return digest.hexdigest()
+
+    def _find_covering_entry(self, index, ngrams, model):
+        """
+        Returns the key of the smallest cached model for the same model
+        whose n-grams are a superset of ngrams, or None
+        """
+        candidates = [k for k, v in index.items() if v["model"] == model and \
+            v["ngram_count"] >= len(ngrams) and \
+            utilities.file_exists(self._entry_dir(k) + "moses.ini")]
+        for key in sorted(candidates, key=lambda k: index[k]["ngram_count"]):
+            with open(self._ngram_file(key), 'rb') as f:
+                if ngrams <= pickle.load(f):
+                    return key
+        return None
+
+    def _evict(self, index):
+        """ Removes least recently used entries beyond max_entries """
+        by_age = sorted(index, key=lambda k: index[k]["last_used"])
+        while len(by_age) > self.max_entries:
+            key = by_age.pop(0)
+            self._print("Evicting filtered model {}\n".format(key))
+            if utilities.dir_exists(self._entry_dir(key)):
+                shutil.rmtree(self._entry_dir(key))
+            if utilities.file_exists(self._ngram_file(key)):
+                os.remove(self._ngram_file(key))
+            del index[key]
+
+    def _entry_dir(self, key):
+        return self.cache_dir + key + "/"
+
+    def _ngram_file(self, key):
+        return self.cache_dir + key + ".ngrams"
+
+    def _read_index(self):
+        if not utilities.file_exists(self.index_file):
+            return {}
+        index = json.load(open(self.index_file, 'r'))
+        return {k: v for k, v in index.items() if utilities.dir_exists(self._entry_dir(k))}
+
+    def _write_index(self, index):
+        with open(self.index_file, 'w') as f:
+            json.dump(index, f, indent=2)
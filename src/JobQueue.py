@@ -0,0 +1,217 @@
+"""
+Bulk translation jobs run on the daemon's decoders behind interactive traffic
+"""
+import os
+import time
+import itertools
+import threading
+from concurrent.futures import Future
+
+import utilities
+from RequestBatcher import BULK
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+class Job(object):
+    """
+    A file translated through legs, chunk_size sentences at a time, with
+    the decoding profile named, or the daemon's default one
+    """
+    def __init__(self, job_id, legs, src_file, out_file, chunk_size, priority, profile=None):
+        self.id = job_id
+        self.legs = legs
+        self.src_file = src_file
+        self.out_file = out_file
+        self.chunk_size = chunk_size
+        self.priority = priority
+        self.profile = profile
+        self.state = QUEUED
+        self.error = None
+        self.total = sum(1 for _ in open(src_file, 'r'))
+        self.done = 0
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.busy_time = 0.0
+        self.cancel_requested = False
+        self.lines = None
+        self.output = None
+
+    def next_chunk(self):
+        """ Reads the next chunk_size lines of the source file """
+        return [line.strip() for line in itertools.islice(self.lines, self.chunk_size)]
+
+    def status(self):
+        """
+        Reports progress. The ETA extrapolates from the time spent on the
+        job's own chunks, so time it spent preempted is not counted
+        """
+        eta = None
+        if self.state == RUNNING and self.done:
+            eta = round(self.busy_time / self.done * (self.total - self.done), 2)
+        return {"id": self.id, "state": self.state, "legs": self.legs,
+                "file": self.src_file, "output": self.out_file, "priority": self.priority,
+                "profile": self.profile, "sentences": self.total, "done": self.done,
+                "progress": round(self.done / self.total, 4) if self.total else 1.0,
+                "eta_s": eta, "error": self.error}
+
+class JobQueue(object):
+    """
+    Runs bulk jobs one chunk at a time. Before each chunk it waits while
+    interactive requests are in flight, for at most max_yield seconds so
+    bulk work is never starved outright, and then picks the queued or
+    running job with the lowest priority number. A more urgent job, or
+    interactive traffic, therefore preempts a running job at its next
+    chunk boundary. Bulk sentences are queued at BULK priority, behind
+    interactive requests waiting for the same batchers
+    """
+    def __init__(self, daemon, chunk_size=32, max_yield=5, verbose=False):
+        self.daemon = daemon
+        self.chunk_size = chunk_size
+        self.max_yield = max_yield
+        self.verbose = verbose
+
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _print(self, item):
+        if self.verbose:
+            utilities.flush_print(item)
+
+    def submit(self, legs, src_file, out_file=None, chunk_size=None, priority=0, profile=None):
+        """
+        Queues src_file, one sentence per line, for translation through
+        legs. Translations are written in order to out_file, by default
+        src_file with the '.translated' extension. Returns the job id
+        """
+        assert utilities.file_exists(src_file), "JobQueueError: {} not found".format(src_file)
+        for leg in legs:
+            self.daemon._pool_key(leg, profile)
+        with self.lock:
+            job = Job(next(self.ids), [os.path.abspath(l) for l in legs], src_file,
+                out_file or src_file + ".translated", chunk_size or self.chunk_size, priority,
+                profile)
+            self.jobs[job.id] = job
+        self.wakeup.set()
+        return job.id
+
+    def cancel(self, job_id):
+        """ Stops a job at its next chunk boundary """
+        job = self._job(job_id)
+        job.cancel_requested = True
+        if job.state == QUEUED:
+            self._close(job, CANCELLED)
+        return job.status()
+
+    def status(self, job_id=None):
+        if job_id is not None:
+            return self._job(job_id).status()
+        with self.lock:
+            return [job.status() for job in self.jobs.values()]
+
+    def counts(self):
+        """ Number of jobs in each state """
+        with self.lock:
+            states = [job.state for job in self.jobs.values()]
+        return {state: states.count(state) for state in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        self.thread.join()
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            if job.output is not None:
+                job.output.close()
+
+    def _job(self, job_id):
+        with self.lock:
+            if job_id not in self.jobs:
+                raise KeyError("no job {}".format(job_id))
+            return self.jobs[job_id]
+
+    def _next_job(self):
+        """ The most urgent unfinished job, oldest first among equals """
+        with self.lock:
+            pending = [j for j in self.jobs.values() if j.state in (QUEUED, RUNNING)]
+        return min(pending, key=lambda j: (j.priority, j.id)) if pending else None
+
+    def _run(self):
+        while not self.stopping.is_set():
+            job = self._next_job()
+            if job is None:
+                self.wakeup.wait(1)
+                self.wakeup.clear()
+                continue
+            self._yield_to_interactive()
+            try:
+                self._run_chunk(job)
+            except Exception as e:
+                job.error = str(e)
+                self._close(job, FAILED)
+                self._print("Job {} failed: {}\n".format(job.id, e))
+
+    def _yield_to_interactive(self):
+        """ Waits while interactive requests are in flight, up to max_yield seconds """
+        give_up = time.time() + self.max_yield
+        while self.daemon.interactive_in_flight() > 0 and time.time() < give_up and \
+            not self.stopping.is_set():
+            time.sleep(0.01)
+
+    def _run_chunk(self, job):
+        """ Translates and writes the next chunk of job """
+        if job.cancel_requested:
+            self._close(job, CANCELLED)
+            return
+        if job.state == QUEUED:
+            job.lines = open(job.src_file, 'r')
+            job.output = open(job.out_file, 'w')
+            job.state, job.started = RUNNING, time.time()
+            self._print("Starting job {} on {}\n".format(job.id, job.src_file))
+
+        chunk = job.next_chunk()
+        if not chunk:
+            self._close(job, DONE)
+            self._print("Job {} done\n".format(job.id))
+            return
+        start = time.time()
+        futures = [self._chain(job.legs, sentence, job.profile) for sentence in chunk]
+        for future in futures:
+            job.output.write("{}\n".format(future.result()))
+        job.output.flush()
+        job.done += len(chunk)
+        job.busy_time += time.time() - start
+
+    def _chain(self, legs, text, profile=None):
+        """ Sends text through legs in turn, returning a Future for the result """
+        result = Future()
+
+        def step(index, text):
+            if index == len(legs):
+                result.set_result(text)
+                return
+            future = self.daemon.submit(legs[index], text, BULK, profile)
+            future.add_done_callback(lambda f: advance(index, f))
+
+        def advance(index, future):
+            if future.cancelled():
+                result.cancel()
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                step(index + 1, future.result())
+
+        step(0, text)
+        return result
+
+    def _close(self, job, state):
+        job.state, job.finished = state, time.time()
+        for stream in (job.lines, job.output):
+            if stream is not None:
+                stream.close()
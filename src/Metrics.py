@@ -0,0 +1,123 @@
+"""
+Counters, gauges and histograms rendered in the Prometheus text
+exposition format
+"""
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for k, v in pairs]
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in escaped) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric(object):
+    """
+    A named family of samples, one per combination of label values. When
+    collect is given it is called at every scrape instead, and returns a
+    list of (labels dict, value) pairs read from elsewhere
+    """
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        """ Yields (suffix, label values, extra labels, value) """
+        if self.collect is not None:
+            for labels, value in self.collect():
+                yield "", self._key(labels), (), value
+            return
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in sorted(items):
+            yield "", key, (), value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} {}".format(self.name, self.kind)]
+        for suffix, key, extra, value in self.samples():
+            lines.append("{}{}{} {}".format(self.name, suffix,
+                _format_labels(self.labels, key, extra), _format_value(value)))
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self.values.items()]
+        for key, (counts, total) in sorted(items):
+            for bound, count in zip(self.buckets, counts):
+                yield "_bucket", key, (("le", _format_value(bound)),), count
+            yield "_sum", key, (), total
+            yield "_count", key, (), counts[-1]
+
+class Registry(object):
+    """ The set of metrics served together on one endpoint """
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=(), collect=None):
+        return self.register(Counter(name, documentation, labels, collect))
+
+    def gauge(self, name, documentation, labels=(), collect=None):
+        return self.register(Gauge(name, documentation, labels, collect))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
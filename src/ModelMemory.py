@@ -0,0 +1,107 @@
+"""
+Checks and measures how a model's tables are held in memory by moses
+"""
+import os
+import glob
+
+import psutil
+
+import utilities
+from MosesConfig import MosesConfig, REORDERING_TABLE
+
+# Phrase tables moses reads through mmap rather than loading onto its heap
+MAPPABLE_PHRASE_TABLES = {"PhraseDictionaryCompact", "PhraseDictionaryOnDisk", "ProbingPT", "Mmsapt"}
+
+KENLM_BINARY_MAGIC = b"mmap lm "
+
+class ModelMemory(object):
+    """
+    Memory-mapped tables live in the page cache, so every moses process
+    serving the same model shares one copy of them. Tables moses parses
+    onto its heap are copied into each process instead
+    """
+    def __init__(self, moses_ini):
+        self.moses_ini = moses_ini
+        self.config = MosesConfig(moses_ini)
+
+    def model_files(self):
+        """ Every file behind the tables and language models of the model """
+        files = []
+        for feature in self.config.features():
+            path = feature["args"].get("path")
+            if path:
+                files += [f for f in sorted(glob.glob(glob.escape(self.config.resolve_path(path)) + "*"))
+                          if utilities.file_exists(f)]
+        return files
+
+    def footprint(self):
+        """ Bytes on disk of every table and language model the model loads """
+        return sum(os.path.getsize(f) for f in self.model_files())
+
+    def unmappable_features(self):
+        """
+        Returns (feature, reason) for each table or language model which
+        moses would copy into every process rather than map
+        """
+        problems = []
+        for feature in self.config.features():
+            kind, path = feature["type"], feature["args"].get("path")
+            name = feature["args"].get("name", kind)
+            if path is None:
+                continue
+            path = self.config.resolve_path(path)
+            if kind.startswith("PhraseDictionary") or kind in MAPPABLE_PHRASE_TABLES:
+                if kind not in MAPPABLE_PHRASE_TABLES:
+                    problems.append((name, "{} is loaded into memory, binarize it with "
+                        "processPhraseTableMin".format(kind)))
+                elif kind == "PhraseDictionaryCompact" and not utilities.file_exists(path + ".minphr"):
+                    problems.append((name, "{}.minphr not found".format(path)))
+            elif kind == REORDERING_TABLE and not utilities.file_exists(path + ".minlexr"):
+                problems.append((name, "reordering table is not binarized, binarize it with "
+                    "processLexicalTableMin"))
+            elif kind == "KENLM" and not self._is_binary_lm(path):
+                problems.append((name, "{} is not a binary KenLM file, convert it with "
+                    "build_binary".format(path)))
+            elif kind in ("SRILM", "IRSTLM", "RANDLM"):
+                problems.append((name, "{} language models are not memory mapped".format(kind)))
+        return problems
+
+    def check(self):
+        """ Raises ValueError unless every table can be shared between processes """
+        problems = self.unmappable_features()
+        if problems:
+            raise ValueError("ModelMemoryError: {} cannot be shared between replicas: {}".format(
+                self.moses_ini, "; ".join("{}: {}".format(n, r) for n, r in problems)))
+
+    def _is_binary_lm(self, path):
+        if not utilities.file_exists(path):
+            return False
+        with open(path, 'rb') as f:
+            return f.read(len(KENLM_BINARY_MAGIC)) == KENLM_BINARY_MAGIC
+
+    def prewarm(self, block_size=16 * 1024 * 1024):
+        """
+        Reads every model file once so its pages are in the page cache
+        before the first replica maps them. Returns the bytes read
+        """
+        total = 0
+        for f in self.model_files():
+            with open(f, 'rb') as stream:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(stream.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                while True:
+                    block = stream.read(block_size)
+                    if not block:
+                        break
+                    total += len(block)
+        return total
+
+def memory_report(pid):
+    """
+    Splits the resident memory of process pid into the pages it shares
+    with other processes, such as mapped model files, and those private
+    to it. pss charges each shared page to its sharers in equal parts
+    """
+    info = psutil.Process(pid).memory_full_info()
+    return {"pid": pid, "rss": info.rss, "private": info.uss,
+            "shared": info.rss - info.uss, "pss": getattr(info, "pss", info.uss)}
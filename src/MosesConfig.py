@@ -0,0 +1,108 @@
+"""
+Reads, edits and writes moses.ini files
+"""
+import os
+
+import utilities
+
+PHRASE_TABLE_PREFIX = "PhraseDictionary"
+SAMPLING_PHRASE_TABLE = "Mmsapt"
+REORDERING_TABLE = "LexicalReordering"
+LANGUAGE_MODELS = ["KENLM", "SRILM", "IRSTLM", "RANDLM", "LanguageModel"]
+
+class MosesConfig(object):
+    def __init__(self, ini_file):
+        assert utilities.file_exists(ini_file), "MosesConfigError: {} not found".format(ini_file)
+        self.ini_file = ini_file
+        self.base_dir = os.path.dirname(os.path.abspath(ini_file))
+        self.sections = {}
+        self._read()
+
+    def _read(self):
+        """
+        Splits the file into its [sections]. Lines in the feature section
+        are parsed into dicts holding the feature type and its arguments
+        """
+        section = None
+        for line in open(self.ini_file, 'r'):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1]
+                self.sections.setdefault(section, [])
+            elif section == "feature":
+                self.sections[section].append(self._parse_feature(line))
+            elif section is not None:
+                self.sections[section].append(line)
+
+    def _parse_feature(self, line):
+        tokens = line.split()
+        args = {}
+        for token in tokens[1:]:
+            key, _, value = token.partition("=")
+            args[key] = value
+        return {"type": tokens[0], "args": args}
+
+    def _format_feature(self, feature):
+        args = ["{}={}".format(k, v) for k, v in feature["args"].items()]
+        return ' '.join([feature["type"]] + args)
+
+    def get(self, section):
+        """ Returns the lines in section, or None if it is absent """
+        return self.sections.get(section)
+
+    def set(self, section, values):
+        """ Replaces the contents of section with the list values """
+        self.sections[section] = [str(v) for v in values]
+
+    def remove(self, section):
+        self.sections.pop(section, None)
+
+    def features(self, prefix=""):
+        """ Returns the feature dicts whose type starts with prefix """
+        return [f for f in self.sections.get("feature", []) if f["type"].startswith(prefix)]
+
+    def add_feature(self, line):
+        """ Appends a feature line such as 'Distortion' and returns its dict """
+        feature = self._parse_feature(line)
+        self.sections.setdefault("feature", []).append(feature)
+        return feature
+
+    def remove_feature(self, feature):
+        self.sections["feature"].remove(feature)
+
+    def phrase_tables(self):
+        return self.features(PHRASE_TABLE_PREFIX) + self.features(SAMPLING_PHRASE_TABLE)
+
+    def reordering_tables(self):
+        return self.features(REORDERING_TABLE)
+
+    def language_models(self):
+        return [f for f in self.features() if f["type"] in LANGUAGE_MODELS]
+
+    def resolve_path(self, path):
+        """
+        Returns path as an absolute path. Relative paths are tried against
+        the current directory, then against the directory holding the
+        ini file and the working directory above it
+        """
+        if utilities.isabsolute(path):
+            return path
+        for base in [os.getcwd(), self.base_dir, os.path.dirname(self.base_dir)]:
+            candidate = os.path.join(base, path)
+            if os.path.exists(candidate) or utilities.files_with_prefix_exist(candidate):
+                return candidate
+        return os.path.abspath(path)
+
+    def write(self, ini_file=None):
+        """ Saves the config to ini_file, defaulting to where it was read from """
+        ini_file = ini_file or self.ini_file
+        with open(ini_file, 'w') as f:
+            for section, lines in self.sections.items():
+                f.write("[{}]\n".format(section))
+                for line in lines:
+                    if section == "feature":
+                        line = self._format_feature(line)
+                    f.write("{}\n".format(line))
+                f.write("\n")
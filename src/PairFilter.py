@@ -0,0 +1,216 @@
+"""
+Rules for dropping sentence pairs unfit for training while cleansing.
+Pairs are filtered a batch at a time: the features rules look at, such
+as token counts, the longest token and the share of letters in a line,
+are computed for a whole batch at once with numpy, and each rule then
+tests every pair still standing in the batch in one go
+"""
+import math
+import time
+from collections import OrderedDict, defaultdict
+
+import numpy
+
+# ALPHABETIC[c] tells whether the code point c < 0x10000 is a letter. The
+# few code points above are looked up one by one
+ALPHABETIC = numpy.array([chr(c).isalpha() for c in range(0x10000)], dtype=bool)
+NEWLINE, SPACE = 10, 32
+
+class SideFeatures(object):
+    """ Features of the lines on one side of a batch, one array entry per line """
+    def __init__(self, lines):
+        codes = numpy.frombuffer(("\n".join(lines) + "\n").encode("utf-32-le"), dtype=numpy.uint32)
+        newlines = codes == NEWLINE
+        line_of = numpy.cumsum(newlines) - newlines
+        lines_count = len(lines)
+
+        chars = numpy.bincount(line_of, minlength=lines_count)
+        spaces = numpy.bincount(line_of, weights=codes == SPACE, minlength=lines_count)
+        is_letter = ALPHABETIC[numpy.minimum(codes, 0xFFFF)]
+        astral = numpy.flatnonzero(codes > 0xFFFF)
+        if len(astral):
+            unique, inverse = numpy.unique(codes[astral], return_inverse=True)
+            is_letter[astral] = numpy.array([chr(c).isalpha() for c in unique.tolist()])[inverse]
+        letters = numpy.bincount(line_of, weights=is_letter, minlength=lines_count)
+        visible = chars - 1 - spaces
+        self.alpha_ratio = numpy.where(visible > 0, letters / numpy.maximum(visible, 1), 0.0)
+
+        separators = numpy.flatnonzero(newlines | (codes == SPACE))
+        token_chars = separators - numpy.concatenate([[-1], separators[:-1]]) - 1
+        self.tokens = numpy.bincount(line_of[separators], weights=token_chars > 0,
+                                     minlength=lines_count).astype(numpy.int64)
+        self.longest_token = numpy.zeros(lines_count, dtype=numpy.int64)
+        numpy.maximum.at(self.longest_token, line_of[separators], token_chars)
+
+class PairBatch(object):
+    """ Source and target lines of a batch of pairs, with their features """
+    def __init__(self, src_lines, tar_lines):
+        self.src_lines = src_lines
+        self.tar_lines = tar_lines
+        self.src = SideFeatures(src_lines)
+        self.tar = SideFeatures(tar_lines)
+
+    def __len__(self):
+        return len(self.src_lines)
+
+class Rule(object):
+    """
+    A filter rule. keep receives a batch and the indices of the pairs in
+    it still standing, and returns a boolean array over those indices
+    """
+    name = "rule"
+
+    def keep(self, batch, indices):
+        raise NotImplementedError
+
+class LengthRule(Rule):
+    """ Both sides have more than min_len and fewer than max_len tokens """
+    name = "length"
+
+    def __init__(self, min_len, max_len):
+        self.min_len = min_len
+        self.max_len = max_len
+
+    def keep(self, batch, indices):
+        src, tar = batch.src.tokens[indices], batch.tar.tokens[indices]
+        return (src > self.min_len) & (src < self.max_len) & \
+            (tar > self.min_len) & (tar < self.max_len)
+
+class LengthRatioRule(Rule):
+    """ Neither side is more than max_ratio times as many tokens as the other """
+    name = "length_ratio"
+
+    def __init__(self, max_ratio=3.0):
+        self.max_ratio = max_ratio
+
+    def keep(self, batch, indices):
+        src, tar = batch.src.tokens[indices], batch.tar.tokens[indices]
+        return numpy.maximum(src, tar) <= self.max_ratio * numpy.maximum(numpy.minimum(src, tar), 1)
+
+class TokenLengthRule(Rule):
+    """ No token on either side is longer than max_chars characters """
+    name = "token_length"
+
+    def __init__(self, max_chars=50):
+        self.max_chars = max_chars
+
+    def keep(self, batch, indices):
+        return (batch.src.longest_token[indices] <= self.max_chars) & \
+            (batch.tar.longest_token[indices] <= self.max_chars)
+
+class CharClassRule(Rule):
+    """ At least min_alpha of the non space characters on each side are letters """
+    name = "char_class"
+
+    def __init__(self, min_alpha=0.5):
+        self.min_alpha = min_alpha
+
+    def keep(self, batch, indices):
+        return (batch.src.alpha_ratio[indices] >= self.min_alpha) & \
+            (batch.tar.alpha_ratio[indices] >= self.min_alpha)
+
+class CopyRule(Rule):
+    """
+    Drops pairs whose sides share more than max_overlap of their tokens,
+    which are mostly untranslated copies of the source
+    """
+    name = "copy_overlap"
+
+    def __init__(self, max_overlap=0.6):
+        self.max_overlap = max_overlap
+
+    def keep(self, batch, indices):
+        keep = numpy.ones(len(indices), dtype=bool)
+        for n, i in enumerate(indices):
+            src, tar = set(batch.src_lines[i].split()), set(batch.tar_lines[i].split())
+            if src and tar:
+                keep[n] = len(src & tar) / min(len(src), len(tar)) <= self.max_overlap
+        return keep
+
+class LexicalScoreRule(Rule):
+    """
+    Scores each pair with IBM model 1 using a lexical translation table,
+    such as Moses' model/lex.f2e from an earlier training run, whose lines
+    are 'target source p(target|source)'. Pairs whose mean log probability
+    per target token is below min_score are taken to be misaligned
+    """
+    name = "lexical_score"
+
+    def __init__(self, lex_file, min_score=-10.0, floor=1e-7):
+        self.min_score = min_score
+        self.floor = floor
+        self.table = defaultdict(dict)
+        for line in open(lex_file, 'r'):
+            fields = line.split()
+            if len(fields) == 3:
+                self.table[fields[1]][fields[0]] = float(fields[2])
+
+    def score(self, src, tar):
+        src = src.split() + ["NULL"]
+        total = 0.0
+        for word in tar.split():
+            p = sum(self.table[s].get(word, 0.0) for s in src if s in self.table) / len(src)
+            total += math.log(max(p, self.floor))
+        return total / max(len(tar.split()), 1)
+
+    def keep(self, batch, indices):
+        return numpy.array([self.score(batch.src_lines[i], batch.tar_lines[i]) >= self.min_score
+                            for i in indices], dtype=bool)
+
+class PairFilter(object):
+    """
+    Applies rules in order to batches of pairs. A pair rejected by one
+    rule is not shown to the rules after it, so costly rules belong at
+    the end. Rejections and time spent are counted for each rule, along
+    with the time spent computing the features of the batches
+    """
+    def __init__(self, rules, batch_size=10000):
+        self.rules = rules
+        self.batch_size = batch_size
+        self.pairs = 0
+        self.feature_seconds = 0.0
+        self.rejected = OrderedDict((rule.name, 0) for rule in rules)
+        self.seconds = OrderedDict((rule.name, 0.0) for rule in rules)
+
+    def keep(self, src_lines, tar_lines):
+        """ Indices of the pairs of lines every rule keeps """
+        start = time.perf_counter()
+        batch = PairBatch(src_lines, tar_lines)
+        self.feature_seconds += time.perf_counter() - start
+        indices = numpy.arange(len(batch))
+        self.pairs += len(batch)
+        for rule in self.rules:
+            if not len(indices):
+                break
+            start = time.perf_counter()
+            kept = indices[rule.keep(batch, indices)]
+            self.seconds[rule.name] += time.perf_counter() - start
+            self.rejected[rule.name] += len(indices) - len(kept)
+            indices = kept
+        return indices
+
+    def report(self):
+        return {"pairs": self.pairs, "kept": self.pairs - sum(self.rejected.values()),
+                "feature_seconds": round(self.feature_seconds, 4),
+                "rules": [{"rule": name, "rejected": self.rejected[name],
+                           "seconds": round(self.seconds[name], 4)} for name in self.rejected]}
+
+def rules_from_config(config, min_len, max_len):
+    """
+    The rules set in the [Iteration Settings] section of config.ini. A
+    ratio, length or score of 0, or an empty lexical_table, turns a rule off
+    """
+    section = "Iteration Settings"
+    rules = [LengthRule(min_len, max_len)]
+    if config.getfloat(section, "max_length_ratio", fallback=0):
+        rules.append(LengthRatioRule(config.getfloat(section, "max_length_ratio")))
+    if config.getint(section, "max_token_chars", fallback=0):
+        rules.append(TokenLengthRule(config.getint(section, "max_token_chars")))
+    if config.getfloat(section, "min_alpha_ratio", fallback=0):
+        rules.append(CharClassRule(config.getfloat(section, "min_alpha_ratio")))
+    if config.getfloat(section, "max_copy_overlap", fallback=0):
+        rules.append(CopyRule(config.getfloat(section, "max_copy_overlap")))
+    if config.get(section, "lexical_table", fallback=""):
+        rules.append(LexicalScoreRule(config.get(section, "lexical_table"),
+            config.getfloat(section, "min_lexical_score", fallback=-10.0)))
+    return rules
@@ -16,19 +16,40 @@ import os
 import sys
 import subprocess
 import random
-from collections import deque
 import numpy
 from itertools import zip_longest
 import hashlib
 import linecache
-import operator
+import json
 
 from pympler import asizeof
 
 import utilities
+from CorpusCatalog import CorpusCatalog, TOK, CLEANSED, SUBSET, TRAIN, TUNE, TEST, MATCHED
+from EncodedCorpus import EncodedCorpora, match_indices, first_pair_occurrences
+from PairFilter import PairFilter, LengthRule, rules_from_config
+from ExternalSort import ExternalSorter, last_of_each_key, merge_join
+from TuneSelection import select_tune
+
+# The set each line of a split goes to
+SPLIT_TRAIN, SPLIT_TUNE, SPLIT_TEST = 0, 1, 2
 
 class Parser(object):
-    def __init__(self, path_to_moses, mem_limit, max_len, min_len, verbose=False):
+    """
+    With encoded set, every stage after tokenization works on integer
+    encoded copies of the files, see EncodedCorpus, and only writes the
+    text files Moses reads. dedup, which needs encoded, drops repeated
+    sentence pairs while cleansing. rules are the PairFilter rules cleanse
+    applies, by default only the min_len and max_len bounds. With
+    external_match, match sorts and merges on disk within mem_limit, so
+    it can run over whole corpora rather than only the test split. With
+    max_tune_sentences set, the split keeps at most that many sentence
+    pairs of each corpus for tuning, see TuneSelection, and trains on the
+    rest of its tune draw
+    """
+    def __init__(self, path_to_moses, mem_limit, max_len, min_len, verbose=False,
+        encoded=False, dedup=False, rules=None, external_match=False, max_tune_sentences=0,
+        tune_strata=10):
         self.path_to_moses = path_to_moses
         self.mem_limit = mem_limit
         self.max_len = max_len
@@ -40,6 +61,14 @@ class Parser(object):
         self.testdir = self.destdir + "test/"
         self.verbose = verbose
         utilities.make_dir(self.destdir)
+        self.catalog = CorpusCatalog(self.destdir)
+        self.encoded = EncodedCorpora(self.destdir) if encoded else None
+        self.dedup = dedup
+        self.rules = rules or [LengthRule(min_len, max_len)]
+        self.external_match = external_match
+        self.max_tune_sentences = max_tune_sentences
+        self.tune_strata = tune_strata
+        assert encoded or not dedup, "Removing duplicate pairs needs the encoded corpus format"
 
     def _print(self, item):
         if self.verbose:
@@ -62,8 +91,8 @@ class Parser(object):
         by splitting the symbols in the sentences to be space-delimited
         """
         self._validate_file(src_file)
-        dest_file = self.destdir + utilities.strip_filename_from_path(src_file) + ".tok"
-        if utilities.file_exists(dest_file):
+        dest_file = self.catalog.derived_path(src_file, TOK)
+        if self.catalog.has(dest_file):
             return
 
         self._print("""Running tokenizer. """
@@ -73,57 +102,107 @@ class Parser(object):
             "< {}".format(src_file) + \
             " > {}".format(dest_file)
         subprocess.call(command, shell=True)
+        self.catalog.record(dest_file, TOK, src_file)
+        if self.encoded is not None:
+            self._encoded(dest_file)
         self._print("Done\n")
 
+    def _encoded(self, text_file):
+        """ The encoded copy of text_file, encoding it first if it is missing or stale """
+        checksum = self.catalog.checksum(text_file)
+        return self.encoded.load(text_file, checksum) or self.encoded.encode(text_file, checksum)
+
+    def _write_encoded(self, corpora, indices, dest_files, stage, parents):
+        """
+        Writes the sentences at indices of each encoded corpus to its
+        dest file, as text through the catalog and as an encoded copy
+        """
+        for corpus, dest_file, parent in zip(corpora, dest_files, parents):
+            with self.catalog.writer(dest_file, stage, parent) as out:
+                for line in corpus.lines(indices):
+                    out.write(line)
+            self.encoded.take(corpus, indices, dest_file, self.catalog.checksum(dest_file))
+
     def cleanse(self, src_lang_file, tar_lang_file):
         """
-        Cleans the file provided by lowercasing all words and ensuring each line in
-        the text file is within min_len and max_len. Operates on two streams
-        simultaneously in order to keep line to line correspondence
+        Cleans the file provided by lowercasing all words and dropping the
+        pairs rejected by the filter rules, by default those with a side
+        outside min_len and max_len. Operates on two streams
+        simultaneously in order to keep line to line correspondence, a
+        batch of pairs at a time. Writes a report of what each rule
+        rejected beside the cleansed source file
         """
         self._validate_file(src_lang_file), self._validate_file(tar_lang_file)
-        src_dest_file = self.destdir + utilities.strip_filename_from_path(src_lang_file) + ".cleansed"
-        tar_dest_file = self.destdir + utilities.strip_filename_from_path(tar_lang_file) + ".cleansed"
+        src_dest_file = self.catalog.derived_path(src_lang_file, CLEANSED)
+        tar_dest_file = self.catalog.derived_path(tar_lang_file, CLEANSED)
 
-        if utilities.files_exist([src_dest_file, tar_dest_file]):
+        if self.catalog.has_all([src_dest_file, tar_dest_file]):
             return
-        else:
-            utilities.wipe_files([src_dest_file, tar_dest_file])
         self._print("""Cleaning data.  Ensuring uniformity of data...""")
-
-        src_buf, tar_buf = [], []
-        for src_line, tar_line in zip(open(src_lang_file), open(tar_lang_file)):
-            src_line = src_line.lower().split()
-            tar_line = tar_line.lower().split()
-
-            if len(src_line) > self.min_len and len(src_line) < self.max_len and \
-                len(tar_line) > self.min_len and len(tar_line) < self.max_len:
-                src_buf.append(' '.join(src_line))
-                tar_buf.append(' '.join(tar_line))
-
-            if asizeof.asizeof(src_buf) + asizeof.asizeof(tar_buf) > self.mem_limit:
-                self._dump_bufs_to( [src_dest_file, tar_dest_file],
-                                    [src_buf, tar_buf])
-
-        self._dump_bufs_to([src_dest_file, tar_dest_file], [src_buf, tar_buf])
+        pair_filter = PairFilter(self.rules)
+        if self.encoded is not None:
+            self._cleanse_encoded(pair_filter, src_lang_file, tar_lang_file, src_dest_file, tar_dest_file)
+        else:
+            with self.catalog.writer(src_dest_file, CLEANSED, src_lang_file) as src_out, \
+                self.catalog.writer(tar_dest_file, CLEANSED, tar_lang_file) as tar_out:
+                for src_lines, tar_lines in self._pair_batches(src_lang_file, tar_lang_file,
+                    pair_filter.batch_size):
+                    for i in pair_filter.keep(src_lines, tar_lines):
+                        src_out.write(src_lines[i])
+                        tar_out.write(tar_lines[i])
         self._print("Done\n")
+        self._report_filter(pair_filter, src_dest_file + ".filter.json")
 
-    def _dump_buf_to(self, filename, ls):
-        """ Opens a file and appends a lists contents to it """
-        outstream = open(filename, 'a')
+    def _pair_batches(self, src_lang_file, tar_lang_file, size):
+        """ Yields the lowercased lines of two files, size pairs at a time """
+        src_lines, tar_lines = [], []
+        for src_line, tar_line in zip(open(src_lang_file), open(tar_lang_file)):
+            src_lines.append(' '.join(src_line.lower().split()))
+            tar_lines.append(' '.join(tar_line.lower().split()))
+            if len(src_lines) == size:
+                yield src_lines, tar_lines
+                src_lines, tar_lines = [], []
+        if src_lines:
+            yield src_lines, tar_lines
+
+    def _cleanse_encoded(self, pair_filter, src_lang_file, tar_lang_file, src_dest_file, tar_dest_file):
+        """ cleanse, reading the batches of pairs from their encoded copies """
+        src, tar = self._encoded(src_lang_file), self._encoded(tar_lang_file)
+        size = min(len(src), len(tar))
+        keep = [numpy.zeros(0, dtype=numpy.int64)]
+        for first in range(0, size, pair_filter.batch_size):
+            indices = numpy.arange(first, min(first + pair_filter.batch_size, size))
+            keep.append(indices[pair_filter.keep(list(src.lines(indices)), list(tar.lines(indices)))])
+        keep = numpy.concatenate(keep)
+        if self.dedup:
+            keep = first_pair_occurrences(src, tar, keep)
+        self._write_encoded([src, tar], keep, [src_dest_file, tar_dest_file], CLEANSED,
+            [src_lang_file, tar_lang_file])
+
+    def _report_filter(self, pair_filter, report_file):
+        """ Saves and prints how many pairs each rule rejected and the time it took """
+        report = pair_filter.report()
+        json.dump(report, open(report_file, 'w'), indent=1)
+        self._print("Kept {} of {} pairs, {:.2f}s computing features\n".format(
+            report["kept"], report["pairs"], report["feature_seconds"]))
+        for rule in report["rules"]:
+            self._print("    {:<14} rejected {:>9} in {:.2f}s\n".format(
+                rule["rule"], rule["rejected"], rule["seconds"]))
+
+    def _dump_buf_to(self, stream, ls):
+        """ Writes a lists contents to a catalog writer and empties the list """
         for item in ls:
-            outstream.write("{}\n".format(item))
-        outstream.close()
+            stream.write(item)
         ls[:] = []
 
-    def _dump_bufs_to(self, files, datas):
+    def _dump_bufs_to(self, streams, datas):
         """
-        Takes two lists: the first is a list of filenames, the second
+        Takes two lists: the first is a list of catalog writers, the second
         is a list of lists containing the data we want to dump.
-        The filenames and list's order must correspond.
+        The writers and list's order must correspond.
         """
-        for f, d in zip(files, datas):
-            self._dump_buf_to(f, d)
+        for stream, d in zip(streams, datas):
+            self._dump_buf_to(stream, d)
 
     def subset(self, src_lang_file, tar_lang_file, proportion, subdir = ""):
         """ Creates a new proportion of data set to create new datasets.
@@ -133,28 +212,28 @@ class Parser(object):
         directory where the files should be placed within the data dir """
         self._validate_file(src_lang_file), self._validate_file(tar_lang_file)
 
-        src_dest_file = self.destdir + subdir + utilities.strip_filename_from_path(src_lang_file) + ".subset"
-        tar_dest_file = self.destdir + subdir + utilities.strip_filename_from_path(tar_lang_file) + ".subset"
+        src_dest_file = self.catalog.derived_path(src_lang_file, SUBSET, subdir)
+        tar_dest_file = self.catalog.derived_path(tar_lang_file, SUBSET, subdir)
 
-        if utilities.files_exist([src_dest_file, tar_dest_file]):
+        if self.catalog.has_all([src_dest_file, tar_dest_file]):
             return
-        else:
-            utilities.wipe_files([src_dest_file, tar_dest_file])
 
         self._print("""Choosing a random subset of the data...""")
-        text_size = self._min_text_size(src_lang_file, tar_lang_file)
+        text_size = min(self.catalog.lines(src_lang_file), self.catalog.lines(tar_lang_file))
         subset_size = int(proportion * text_size)
         assert subset_size > 0, "Subset length must be non-zero"
 
-        subset_lines = deque(sorted(random.sample(range(0, text_size), subset_size)))
-        self._get_lines(src_lang_file, tar_lang_file, subset_lines, src_dest_file, tar_dest_file)
+        subset_lines = sorted(random.sample(range(0, text_size), subset_size))
+        if self.encoded is not None:
+            self._write_encoded([self._encoded(src_lang_file), self._encoded(tar_lang_file)],
+                subset_lines, [src_dest_file, tar_dest_file], SUBSET, [src_lang_file, tar_lang_file])
+            self._print("Done\n")
+            return
+        with self.catalog.writer(src_dest_file, SUBSET, src_lang_file) as src_out, \
+            self.catalog.writer(tar_dest_file, SUBSET, tar_lang_file) as tar_out:
+            self._get_lines(src_lang_file, tar_lang_file, subset_lines, src_out, tar_out)
         self._print("Done\n")
 
-    def _min_text_size(self, text1, text2):
-        """ Opens 2 files and returns the number of lines in the smallest """
-        return min(sum(1 for line in open(text1)), \
-            sum(1 for line in open(text2)))
-
     def split_train_tune_test(self, src_file, src_piv_file, piv_tar_file, tar_file,
         train_split, test_split):
         """
@@ -167,45 +246,107 @@ class Parser(object):
         utilities.make_dir(self.tunedir)
         utilities.make_dir(self.testdir)
 
-        self._validate_file(src_file), self._validate_file(src_piv_file)
-        self._validate_file(piv_tar_file), self._validate_file(tar_file)
+        self._split([src_file, src_piv_file, piv_tar_file, tar_file], train_split, test_split)
+
+    def split_pair_train_tune_test(self, src_file, tar_file, train_split, test_split):
+        """
+        split_train_tune_test for a single pair of files, so a corpus
+        shared by several language pairs is split once, the same way for
+        all of them
+        """
+        utilities.make_dir(self.traindir)
+        utilities.make_dir(self.tunedir)
+        utilities.make_dir(self.testdir)
+        self._split([src_file, tar_file], train_split, test_split)
+
+    def _split(self, inputs, train_split, test_split):
+        for f in inputs:
+            self._validate_file(f)
         assert train_split + test_split <= 1 , "Invalid size for train, tune, and test splits"
 
-        train_files, tune_files, test_files = self._ttt_filenames(src_file, src_piv_file, piv_tar_file, tar_file)
-        if utilities.ttt_files_exist(train_files, tune_files, test_files):
+        train_files, tune_files, test_files = self._ttt_filenames(*inputs)
+        if self.catalog.has_all(train_files + tune_files + test_files):
             return
-        else:
-            utilities.ttt_wipe_files(train_files, tune_files, test_files)
 
         self._print("""Splitting data into train, tune, and test sets...""")
-        train, tune, test = [[] ,[], [], []],  [[], [], [], []], [[], [], [], []]
-        for src_line, src_piv_line, piv_tar_line, tar_line in \
-            zip_longest(open(src_file), open(src_piv_file), open(piv_tar_file), open(tar_file)):
-
-            x = numpy.random.sample()
-            if x < train_split:
-                self._add_line_to(train[0], src_line)
-                self._add_line_to(train[1], src_piv_line)
-                self._add_line_to(train[2], piv_tar_line)
-                self._add_line_to(train[3], tar_line)
-            elif x >= train_split and x < train_split + test_split:
-                self._add_line_to(tune[0], src_line)
-                self._add_line_to(tune[1], src_piv_line)
-                self._add_line_to(tune[2], piv_tar_line)
-                self._add_line_to(tune[3], tar_line)
-            else:
-                self._add_line_to(test[0], src_line)
-                self._add_line_to(test[1], src_piv_line)
-                self._add_line_to(test[2], piv_tar_line)
-                self._add_line_to(test[3], tar_line)
+        sets = self._draw_sets(inputs, train_split, test_split)
+        if self.max_tune_sentences:
+            sets = self._select_tune(inputs, sets, tune_files)
+        if self.encoded is not None:
+            self._split_encoded(inputs, sets, train_files, tune_files, test_files)
+            self._print("Done\n")
+            return
+        train_files, tune_files, test_files = \
+            [[self.catalog.writer(f, stage, parent) for f, parent in zip(files, inputs)]
+             for files, stage in [(train_files, TRAIN), (tune_files, TUNE), (test_files, TEST)]]
+        train, tune, test = [[[] for f in inputs] for _ in range(3)]
+        dests = {SPLIT_TRAIN: train, SPLIT_TUNE: tune, SPLIT_TEST: test}
+        for row, lines in enumerate(zip_longest(*[open(f) for f in inputs])):
+            for i, line in enumerate(lines):
+                self._add_line_to(dests[sets[i][row]][i], line)
 
             if asizeof.asizeof(train) + asizeof.asizeof(tune) + \
                 asizeof.asizeof(test) > self.mem_limit:
                 self._dump_ttt_bufs_to(train, tune, test, train_files, tune_files, test_files)
 
         self._dump_ttt_bufs_to(train, tune, test, train_files, tune_files, test_files)
+        for stream in train_files + tune_files + test_files:
+            stream.close()
         self._print("Done\n")
 
+    def _draw_sets(self, inputs, train_split, test_split):
+        """
+        Draws the set of every line at once, one array per input. Line i
+        of every input goes to the same set
+        """
+        x = numpy.random.sample(max(self.catalog.lines(f) for f in inputs))
+        sets = numpy.full(len(x), SPLIT_TEST, dtype=numpy.int8)
+        sets[x < train_split + test_split] = SPLIT_TUNE
+        sets[x < train_split] = SPLIT_TRAIN
+        return [sets] * len(inputs)
+
+    def _select_tune(self, inputs, sets, tune_files):
+        """
+        Keeps at most max_tune_sentences of the tune draw of each pair of
+        inputs, stratified by source length with repeated pairs dropped,
+        and moves the rest of the draw to train. The selection report is
+        saved beside each tune file
+        """
+        sets = list(sets)
+        for i in range(0, len(inputs), 2):
+            src_file, tar_file = inputs[i:i + 2]
+            tune = numpy.flatnonzero(sets[i][:self.catalog.lines(src_file)] == SPLIT_TUNE)
+            lengths = numpy.zeros(len(tune), dtype=numpy.int64)
+            tar_lengths = numpy.zeros(len(tune), dtype=numpy.int64)
+            keys = numpy.zeros(len(tune), dtype=numpy.uint64)
+            for n, (src, tar) in enumerate(zip(self.catalog.read_lines(src_file, tune),
+                                               self.catalog.read_lines(tar_file, tune))):
+                lengths[n], tar_lengths[n] = len(src.split()), len(tar.split())
+                keys[n] = int.from_bytes(hashlib.sha1(str.encode(src + "\t" + tar)).digest()[:8], "little")
+            chosen, report = select_tune(lengths, keys, self.max_tune_sentences, self.tune_strata)
+
+            pair_sets = sets[i].copy()
+            pair_sets[numpy.setdiff1d(tune, tune[chosen])] = SPLIT_TRAIN
+            sets[i] = sets[i + 1] = pair_sets
+            # the share of its tokens each side keeps, as either side may be decoded
+            report["files"] = {tune_files[i]: report["decode_work_ratio"],
+                tune_files[i + 1]: round(tar_lengths[chosen].sum() / max(tar_lengths.sum(), 1), 6)}
+            for tune_file in tune_files[i:i + 2]:
+                json.dump(report, open(tune_file + ".selection.json", 'w'), indent=1)
+            self._print("Tuning on {} of {} pairs, {:.1%} of the decoding work... ".format(
+                report["selected"], report["tune_split"], report["decode_work_ratio"]))
+        return sets
+
+    def _split_encoded(self, inputs, sets, train_files, tune_files, test_files):
+        """ split_train_tune_test, writing the encoded copies as well """
+        for f, draws, train_file, tune_file, test_file in \
+            zip(inputs, sets, train_files, tune_files, test_files):
+            corpus = self._encoded(f)
+            draws = draws[:len(corpus)]
+            self._write_encoded([corpus], numpy.flatnonzero(draws == SPLIT_TRAIN), [train_file], TRAIN, [f])
+            self._write_encoded([corpus], numpy.flatnonzero(draws == SPLIT_TUNE), [tune_file], TUNE, [f])
+            self._write_encoded([corpus], numpy.flatnonzero(draws == SPLIT_TEST), [test_file], TEST, [f])
+
     def _add_line_to(self, ls, line):
         """
         Adds the contents of line to list ls after checking if
@@ -216,77 +357,148 @@ class Parser(object):
 
     def _dump_ttt_bufs_to(self, train, tune, test, train_files, tune_files, test_files):
         """
-        Dumps the train, tune, test data into their corresponding files.
-        Empties the data.
+        Dumps the train, tune, test data into their corresponding catalog
+        writers. Empties the data.
         """
         self._dump_bufs_to(train_files, train)
         self._dump_bufs_to(tune_files, tune)
         self._dump_bufs_to(test_files, test)
-        train[:] = [[], [], [], []]
-        test[:] = [[], [], [], []]
-        tune[:] = [[], [], [], []]
+        train[:] = [[] for _ in train]
+        test[:] = [[] for _ in test]
+        tune[:] = [[] for _ in tune]
 
-    def _ttt_filenames(self, src_file, src_piv_file, piv_tar_file, tar_file):
+    def _ttt_filenames(self, *files):
         """
         Constructs the appropriate train tune test file extension names for the data.
         Returns a list of lists, where the list in index 0 is the name of the train
         files, the list in index 1 is the tune files, and index 2 is the test
         """
-        src_train_file = self.traindir + utilities.strip_filename_from_path(src_file) + ".train"
-        src_tune_file = self.tunedir + utilities.strip_filename_from_path(src_file) + ".tune"
-        src_test_file = self.testdir + utilities.strip_filename_from_path(src_file) + ".test"
-
-        src_piv_train_file = self.traindir + utilities.strip_filename_from_path(src_piv_file) + ".train"
-        src_piv_tune_file = self.tunedir + utilities.strip_filename_from_path(src_piv_file) + ".tune"
-        src_piv_test_file = self.testdir + utilities.strip_filename_from_path(src_piv_file) + ".test"
-
-        piv_tar_train_file = self.traindir + utilities.strip_filename_from_path(piv_tar_file) + ".train"
-        piv_tar_tune_file = self.tunedir + utilities.strip_filename_from_path(piv_tar_file) + ".tune"
-        piv_tar_test_file = self.testdir + utilities.strip_filename_from_path(piv_tar_file) + ".test"
-
-        tar_train_file = self.traindir + utilities.strip_filename_from_path(tar_file) + ".train"
-        tar_tune_file = self.tunedir + utilities.strip_filename_from_path(tar_file) + ".tune"
-        tar_test_file = self.testdir + utilities.strip_filename_from_path(tar_file) + ".test"
-
-        train_files = [src_train_file, src_piv_train_file, piv_tar_train_file, tar_train_file]
-        tune_files = [src_tune_file, src_piv_tune_file, piv_tar_tune_file, tar_tune_file]
-        test_files = [src_test_file, src_piv_test_file, piv_tar_test_file, tar_test_file]
+        train_files = [self.catalog.derived_path(f, TRAIN) for f in files]
+        tune_files = [self.catalog.derived_path(f, TUNE) for f in files]
+        test_files = [self.catalog.derived_path(f, TEST) for f in files]
         return train_files, tune_files, test_files
 
-    def match(self, src_file, src_piv_file, piv_tar_file, tar_file):
+    def match(self, src_file, src_piv_file, piv_tar_file, tar_file, subdir=""):
         """
         Opens src_piv_file and piv_tar_file and keeps track of
         only those sentences which occur in both.  Then, it
         deletes all lines from the files except for the lines
         which contain a match.  This step is necessary for the
         translation via pivotting to make sure that testing is
-        accurate
+        accurate. The matched files are written to subdir beside
+        their parents, so that a file matched against different
+        partners for different language pairs keeps each result
         """
         self._validate_file(src_file), self._validate_file(src_piv_file)
         self._validate_file(piv_tar_file), self._validate_file(tar_file)
 
-        m_src_file = src_file + ".matched"
-        m_src_piv_file = src_piv_file + ".matched"
-        m_piv_tar_file = piv_tar_file + ".matched"
-        m_tar_file = tar_file + ".matched"
+        m_src_file = self.catalog.derived_path(src_file, MATCHED, subdir)
+        m_src_piv_file = self.catalog.derived_path(src_piv_file, MATCHED, subdir)
+        m_piv_tar_file = self.catalog.derived_path(piv_tar_file, MATCHED, subdir)
+        m_tar_file = self.catalog.derived_path(tar_file, MATCHED, subdir)
 
-        if utilities.files_exist([m_src_file, m_src_piv_file, m_piv_tar_file, m_tar_file]):
+        if self.catalog.has_all([m_src_file, m_src_piv_file, m_piv_tar_file, m_tar_file]):
             return
-        else:
-            utilities.wipe_files([m_src_file, m_src_piv_file, m_piv_tar_file, m_tar_file])
 
         self._print("Starting matching... ")
+        if self.external_match:
+            self._match_external(src_file, src_piv_file, piv_tar_file, tar_file,
+                [m_src_file, m_src_piv_file, m_piv_tar_file, m_tar_file])
+            self._print("Done\n")
+            return
+        if self.encoded is not None:
+            first, second = match_indices(self._encoded(src_piv_file), self._encoded(piv_tar_file))
+            self._write_encoded([self._encoded(src_file), self._encoded(src_piv_file)], first,
+                [m_src_file, m_src_piv_file], MATCHED, [src_file, src_piv_file])
+            self._write_encoded([self._encoded(piv_tar_file), self._encoded(tar_file)], second,
+                [m_piv_tar_file, m_tar_file], MATCHED, [piv_tar_file, tar_file])
+            self._print("Done\n")
+            return
         hash_to_index = self._make_hash_to_index(src_piv_file)
         index_to_index = self._make_index_to_index(piv_tar_file, hash_to_index)
 
-        self._get_relevant_lines_in_first_pivot(src_file, src_piv_file, index_to_index,
-            m_src_file, m_src_piv_file)
+        with self.catalog.writer(m_src_file, MATCHED, src_file) as m_src, \
+            self.catalog.writer(m_src_piv_file, MATCHED, src_piv_file) as m_src_piv:
+            self._get_relevant_lines_in_first_pivot(src_file, src_piv_file, index_to_index,
+                m_src, m_src_piv)
 
-        self._get_relevant_lines_in_second_pivot(piv_tar_file, tar_file, index_to_index,
-            m_piv_tar_file, m_tar_file)
+        with self.catalog.writer(m_piv_tar_file, MATCHED, piv_tar_file) as m_piv_tar, \
+            self.catalog.writer(m_tar_file, MATCHED, tar_file) as m_tar:
+            self._get_relevant_lines_in_second_pivot(piv_tar_file, tar_file, index_to_index,
+                m_piv_tar, m_tar)
 
         self._print("Done\n")
 
+    def _match_external(self, src_file, src_piv_file, piv_tar_file, tar_file, m_files):
+        """
+        match for corpora too large for memory. The lines of both pivot
+        files are keyed on a hash and sorted in runs on disk, and the two
+        sorted streams are merge joined, keeping the last occurrence of
+        each sentence in each file as match does. The matched pairs of
+        line numbers are sorted again into source order and the four
+        files are written by seeking through the catalog's line index.
+        Each of the three sorts holds at most a third of mem_limit
+        """
+        budget = self.mem_limit // 3
+        first, second = self._sorted_line_keys(src_piv_file, budget), \
+            self._sorted_line_keys(piv_tar_file, budget)
+        pairs = ExternalSorter([("first", numpy.uint64), ("second", numpy.uint64)], budget, self.destdir)
+        try:
+            block = []
+            for a, b in merge_join(last_of_each_key(first.merged(), 2),
+                last_of_each_key(second.merged(), 2), 2):
+                block.append((a[2], b[2]))
+                if len(block) == pairs.run_records:
+                    pairs.add(block)
+                    block = []
+            pairs.add(block)
+
+            pair_file = os.path.join(pairs.dir, "matched")
+            with open(pair_file, 'wb') as stream:
+                block = []
+                for pair in pairs.merged():
+                    block.append(pair)
+                    if len(block) == pairs.run_records:
+                        numpy.array(block, dtype=pairs.dtype).tofile(stream)
+                        block = []
+                numpy.array(block, dtype=pairs.dtype).tofile(stream)
+            matched = numpy.memmap(pair_file, dtype=pairs.dtype, mode='r') if pairs.records \
+                else numpy.zeros(0, dtype=pairs.dtype)
+
+            m_src_file, m_src_piv_file, m_piv_tar_file, m_tar_file = m_files
+            with self.catalog.writer(m_src_file, MATCHED, src_file) as m_src, \
+                self.catalog.writer(m_src_piv_file, MATCHED, src_piv_file) as m_src_piv:
+                self._get_lines(src_file, src_piv_file, matched["first"], m_src, m_src_piv)
+            with self.catalog.writer(m_piv_tar_file, MATCHED, piv_tar_file) as m_piv_tar, \
+                self.catalog.writer(m_tar_file, MATCHED, tar_file) as m_tar:
+                self._get_lines(piv_tar_file, tar_file, matched["second"], m_piv_tar, m_tar)
+        finally:
+            for sorter in (first, second, pairs):
+                sorter.cleanup()
+
+    def _sorted_line_keys(self, filename, mem_limit):
+        """
+        Sorts (hash, line number) records of every line of filename on
+        disk. The hash is a 128 bit blake2b digest split into two fields
+        """
+        sorter = ExternalSorter([("high", numpy.uint64), ("low", numpy.uint64), ("index", numpy.uint64)],
+            mem_limit, self.destdir)
+        digests, indices = bytearray(), []
+        for i, line in enumerate(open(filename, 'rb')):
+            digests += hashlib.blake2b(line.strip(), digest_size=16).digest()
+            indices.append(i)
+            if len(indices) == sorter.run_records:
+                sorter.add(self._line_keys(digests, indices, sorter.dtype))
+                digests, indices = bytearray(), []
+        sorter.add(self._line_keys(digests, indices, sorter.dtype))
+        return sorter
+
+    def _line_keys(self, digests, indices, dtype):
+        keys = numpy.zeros(len(indices), dtype=dtype)
+        hashes = numpy.frombuffer(bytes(digests), dtype=">u8").reshape(-1, 2)
+        keys["high"], keys["low"], keys["index"] = hashes[:, 0], hashes[:, 1], indices
+        return keys
+
     def _make_hash_to_index(self, filename):
         """
         Opens a file and creates a dict which stores each line's hash
@@ -320,8 +532,7 @@ class Parser(object):
         extension indicating that they contain only the lines shared
         within the texts in the common language. Saves the lines to m_file
         """
-        m_src_buf, m_src_piv_buf = [], []
-        first_piv_indices = deque(sorted(index_to_index))
+        first_piv_indices = sorted(index_to_index)
         self._get_lines(src_file, src_piv_file, first_piv_indices, m_src_file, m_src_piv_file)
 
     def _get_relevant_lines_in_second_pivot(self, piv_tar_file, tar_file, index_to_index,
@@ -332,60 +543,19 @@ class Parser(object):
         extension indicating that they contain only the lines shared
         within the texts in the common language. Saves the lines to m_file
         """
-        second_piv_indices = sorted(index_to_index.items(), key=operator.itemgetter(0))
-        second_piv_indices = [x[1] for x in second_piv_indices]
-
-        while True:
-            inc_len = self._longest_non_decreasing_sequence(second_piv_indices, 0)
-            target_indices =  second_piv_indices[:inc_len]
-            self._get_lines(piv_tar_file, tar_file, target_indices, m_piv_tar_file, m_tar_file)
-            second_piv_indices = second_piv_indices[inc_len:]
-            if len(second_piv_indices) == 0:
-                break
-
-    def _longest_non_decreasing_sequence(self, arr, pos):
-        """
-        Given an arr and a starting pos, returns the length of non
-        decreasing subsequence.
-        """
-        length = 1
-        if len(arr) <= 1:
-            return length
-
-        while arr[pos] < arr[pos+1] :
-            length += 1
-            pos += 1
-            if pos == len(arr) - 1:
-                break
-        return length
+        second_piv_indices = [index_to_index[i] for i in sorted(index_to_index)]
+        self._get_lines(piv_tar_file, tar_file, second_piv_indices, m_piv_tar_file, m_tar_file)
 
     def _get_lines(self, file1, file2, lines, file1_dest, file2_dest):
         """
-        Given two files to open and a sorted list of lines to get, open the files,
-        retrieves the desired lines, and dumps them to specified file locations.
+        Given two files, line numbers in any order and two catalog writers,
+        retrieves the desired lines in that order by seeking through the
+        catalog's line index, and streams them to the writers.
         """
-        lines = deque(lines)
-        buf1, buf2 = [], []
-        line_counter, target_line = 0, lines.popleft()
-
-        for f1_line, f2_line in zip(open(file1, 'r'), open(file2, 'r')):
-            if target_line == line_counter:
-                buf1.append(f1_line.strip())
-                buf2.append(f2_line.strip())
-
-                if asizeof.asizeof(buf1) + asizeof.asizeof(buf2) > \
-                    self.mem_limit:
-                    self._dump_bufs_to( [file1_dest, file2_dest],
-                                        [buf1, buf2])
-
-                if len(lines) != 0:
-                    target_line = lines.popleft()
-                else:
-                    break
-            line_counter += 1
-
-        self._dump_bufs_to( [file1_dest, file2_dest],
-                            [buf1, buf2])
+        for f1_line, f2_line in zip(self.catalog.read_lines(file1, lines),
+            self.catalog.read_lines(file2, lines)):
+            file1_dest.write(f1_line.strip())
+            file2_dest.write(f2_line.strip())
 
 def main():
     config = utilities.config_file_reader()
@@ -393,7 +563,14 @@ def main():
     mem_limit = config.getint("Environment Settings", "mem_limit")
     max_len = config.getint("Iteration Settings", "max_sentence_len")
     min_len = config.getint("Iteration Settings", "min_sentence_len")
-    parser = Parser(path_to_moses, mem_limit, max_len, min_len, True)
+    encoded = config.getboolean("Iteration Settings", "encoded_corpus", fallback=False)
+    dedup = config.getboolean("Iteration Settings", "dedup_pairs", fallback=False)
+    external = config.getboolean("Iteration Settings", "external_matching", fallback=False)
+    max_tune = config.getint("Iteration Settings", "max_tune_sentences", fallback=0)
+    tune_strata = config.getint("Iteration Settings", "tune_length_strata", fallback=10)
+    rules = rules_from_config(config, min_len, max_len)
+    parser = Parser(path_to_moses, mem_limit, max_len, min_len, True, encoded, dedup, rules, external,
+        max_tune, tune_strata)
 
     parser.tokenize("data/src/europarl-v7.es-en.es")
     parser.tokenize("data/src/europarl-v7.es-en.en")
@@ -0,0 +1,133 @@
+"""
+Filters a trained model down to the entries needed to translate an input
+file without leaving Python.
+
+Every source n-gram in the input up to max_phrase_len tokens is collected
+into a set. The gzipped phrase and reordering tables are then streamed in
+chunks to a pool of worker processes which keep only the entries whose
+source phrase is in the set. Chunks are written back in order so the
+filtered tables stay sorted, and are handed to the compact binarizers.
+"""
+import os
+import gzip
+import subprocess
+import multiprocessing
+from collections import deque
+
+import utilities
+from MosesConfig import MosesConfig
+
+_ngrams = None
+
+def _init_worker(ngrams):
+    """ Gives each worker process its own reference to the n-gram set """
+    global _ngrams
+    _ngrams = ngrams
+
+def _filter_chunk(lines):
+    """ Keeps the table lines whose source phrase was seen in the input """
+    kept, last_src, last_match = [], None, False
+    for line in lines:
+        src = line[:line.find(" ||| ")]
+        if src != last_src:
+            last_src, last_match = src, src in _ngrams
+        if last_match:
+            kept.append(line)
+    return kept
+
+class PhraseFilter(object):
+    def __init__(self, path_to_moses, ncpus=1, max_phrase_len=7, chunk_size=50000, verbose=False):
+        self.path_to_moses = path_to_moses
+        self.ncpus = ncpus
+        self.max_phrase_len = max_phrase_len
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+
+    def _print(self, item):
+        if self.verbose:
+            utilities.flush_print(item)
+
+    def filter_model(self, src_file, moses_ini, filt_dir, logfile):
+        """
+        Writes a filtered, binarized copy of the model described by
+        moses_ini into filt_dir, along with a moses.ini pointing at it.
+        Tables which are not gzipped text are left as they are
+        """
+        utilities.make_dir(filt_dir)
+        filt_dir = os.path.abspath(filt_dir) + "/"
+        ngrams = utilities.source_ngrams(src_file, self.max_phrase_len)
+        config = MosesConfig(moses_ini)
+
+        pool = multiprocessing.Pool(self.ncpus, initializer=_init_worker, initargs=(ngrams,))
+        try:
+            for i, feature in enumerate(config.phrase_tables()):
+                table = config.resolve_path(feature["args"].get("path", ""))
+                if feature["type"] != "PhraseDictionaryMemory" or not utilities.file_exists(table):
+                    continue
+                filtered = filt_dir + "phrase-table.{}.gz".format(i)
+                self._filter_table(pool, table, filtered)
+                out = filt_dir + "phrase-table.{}".format(i)
+                self._binarize_phrase_table(filtered, out, feature["args"].get("num-features", 4), logfile)
+                feature["type"] = "PhraseDictionaryCompact"
+                feature["args"]["path"] = out
+
+            for i, feature in enumerate(config.reordering_tables()):
+                table = config.resolve_path(feature["args"].get("path", ""))
+                if not table.endswith(".gz") or not utilities.file_exists(table):
+                    continue
+                filtered = filt_dir + "reordering-table.{}.gz".format(i)
+                self._filter_table(pool, table, filtered)
+                out = filt_dir + "reordering-table.{}".format(i)
+                self._binarize_reordering_table(filtered, out, logfile)
+                feature["args"]["path"] = out
+        finally:
+            pool.close()
+            pool.join()
+
+        config.write(filt_dir + "moses.ini")
+
+    def _filter_table(self, pool, table, dest):
+        """
+        Streams table through the worker pool, writing the kept lines in
+        order. At most two chunks per worker are in flight at once so memory
+        stays bounded regardless of the table size
+        """
+        self._print("Filtering {}... ".format(table))
+        pending, kept = deque(), 0
+        with gzip.open(table, 'rt') as src, gzip.open(dest, 'wt', compresslevel=1) as out:
+            for chunk in self._chunks(src):
+                pending.append(pool.apply_async(_filter_chunk, (chunk,)))
+                if len(pending) > 2 * self.ncpus:
+                    kept += self._write_chunk(out, pending.popleft().get())
+            while pending:
+                kept += self._write_chunk(out, pending.popleft().get())
+        self._print("kept {} entries\n".format(kept))
+
+    def _write_chunk(self, out, lines):
+        out.writelines(lines)
+        return len(lines)
+
+    def _chunks(self, stream):
+        """ Yields lists of chunk_size lines from stream """
+        chunk = []
+        for line in stream:
+            chunk.append(line)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _binarize_phrase_table(self, table, out, nscores, logfile):
+        command = self.path_to_moses + "bin/processPhraseTableMin" + \
+            " -in {} -out {}".format(table, out) + \
+            " -nscores {} -threads {}".format(nscores, self.ncpus) + \
+            " >> {} 2>&1".format(logfile)
+        subprocess.call(command, shell=True)
+
+    def _binarize_reordering_table(self, table, out, logfile):
+        command = self.path_to_moses + "bin/processLexicalTableMin" + \
+            " -in {} -out {}".format(table, out) + \
+            " -threads {}".format(self.ncpus) + \
+            " >> {} 2>&1".format(logfile)
+        subprocess.call(command, shell=True)
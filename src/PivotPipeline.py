@@ -0,0 +1,81 @@
+"""
+Pipelined translation of many sentences through a chain of legs
+"""
+import heapq
+import queue
+import threading
+
+_DONE = object()
+
+class PivotPipeline(object):
+    """
+    Runs each leg of a pivot in its own worker threads, connected by
+    bounded queues. While the second leg translates sentence i the first
+    leg is already working on sentence i+1, so throughput approaches that
+    of the slowest leg rather than the sum of the legs. Results are yielded
+    in input order. stages is a list of callables translating one sentence
+    """
+    def __init__(self, stages, queue_size=8, workers_per_stage=1):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.workers_per_stage = workers_per_stage
+
+    def run(self, sentences):
+        """
+        Yields the translation of each sentence in sentences, which may be
+        any iterable including a file. Re-raises the first failure
+        """
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(sentences, queues[0]), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = [self.workers_per_stage, threading.Lock()]
+            for _ in range(self.workers_per_stage):
+                threads.append(threading.Thread(target=self._work,
+                    args=(stage, queues[i], queues[i+1], remaining), daemon=True))
+        for t in threads:
+            t.start()
+
+        pending, expected = [], 0
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            heapq.heappush(pending, item)
+            while pending and pending[0][0] == expected:
+                index, result = heapq.heappop(pending)
+                if isinstance(result, Exception):
+                    raise result
+                yield result
+                expected += 1
+
+    def _feed(self, sentences, out):
+        """ Numbers the input sentences and hands them to the first leg """
+        for index, sentence in enumerate(sentences):
+            out.put((index, sentence.strip()))
+        for _ in range(self.workers_per_stage):
+            out.put(_DONE)
+
+    def _work(self, stage, inp, out, remaining):
+        """
+        Translates sentences from inp into out. Failures are passed along
+        so they surface in order. The last worker of a stage to finish
+        tells the next stage there is nothing more to come
+        """
+        while True:
+            item = inp.get()
+            if item is _DONE:
+                break
+            index, text = item
+            if not isinstance(text, Exception):
+                try:
+                    text = stage(text)
+                except Exception as e:
+                    text = e
+            out.put((index, text))
+
+        with remaining[1]:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            for _ in range(self.workers_per_stage):
+                out.put(_DONE)
@@ -0,0 +1,164 @@
+"""
+Plans the work for several language pairs translated through one pivot
+language. Pairs share most of their work: es-fr and es-de both need the
+es-en corpus and the es->en leg, while es-fr and it-fr both need the
+en->fr leg and its French language model. The plan holds each corpus,
+leg and language model once, with the pairs that use it, so that a
+pipeline following it builds each of them only once
+"""
+from collections import OrderedDict
+
+from FileDataPair import FileDataPair
+from CorpusCatalog import CorpusCatalog, MATCHED
+
+import utilities
+
+SECTION = "Multi Pair Settings"
+
+class Corpus(object):
+    """
+    The parallel corpus between lang and the pivot language, read from
+    prefix.lang and prefix.pivot, such as src/europarl-v7.es-en.es and
+    src/europarl-v7.es-en.en
+    """
+    def __init__(self, lang, pivot, prefix, home="data/"):
+        self.lang = lang
+        self.files = FileDataPair(prefix + "." + lang, prefix + "." + pivot, home)
+        self.pairs = []
+
+class Leg(object):
+    """
+    One direction of translation trained on a corpus, src_lang to or
+    from the pivot language, kept in working_dir
+    """
+    def __init__(self, src_lang, tar_lang, corpus):
+        self.src_lang = src_lang
+        self.tar_lang = tar_lang
+        self.corpus = corpus
+        self.reverse = src_lang != corpus.lang
+        self.working_dir = "{}-{}.working".format(src_lang, tar_lang)
+        self.pairs = []
+
+    def _oriented(self, files):
+        return (files[1], files[0]) if self.reverse else files
+
+    def get_train_filenames(self):
+        return self._oriented(self.corpus.files.get_train_filenames())
+
+    def get_tune_filenames(self):
+        return self._oriented(self.corpus.files.get_tune_filenames())
+
+    def get_test_filenames(self):
+        return self._oriented(self.corpus.files.get_test_filenames())
+
+    def get_cleansed_filenames(self):
+        return self._oriented(self.corpus.files.get_cleansed_filenames())
+
+    def get_language_model_filename(self):
+        """ The training file the leg's target language model is built from """
+        return self.get_train_filenames()[1]
+
+class Chain(object):
+    """ A source-target pair and the two legs that translate it through the pivot """
+    def __init__(self, src_lang, tar_lang, first, second, catalog):
+        self.name = "{}-{}".format(src_lang, tar_lang)
+        self.first = first
+        self.second = second
+        self.catalog = catalog
+        self.matched_dir = self.name + "/"
+
+    def get_test_filenames(self):
+        """ The source, pivot, pivot and target test files the pair is matched on """
+        return self.first.get_test_filenames() + self.second.get_test_filenames()
+
+    def get_cleansed_filenames(self):
+        return self.first.get_cleansed_filenames() + self.second.get_cleansed_filenames()
+
+    def get_eval_filenames(self):
+        """ The matched source and target test files the pair is scored on """
+        files = self.get_test_filenames()
+        return self.catalog.derived_path(files[0], MATCHED, self.matched_dir), \
+            self.catalog.derived_path(files[3], MATCHED, self.matched_dir)
+
+class PivotPlan(object):
+    """
+    pairs is a list of (source, target) languages and corpora maps each
+    language other than the pivot to the prefix of its corpus with the
+    pivot language
+    """
+    def __init__(self, pairs, pivot, corpora, home="data/"):
+        self.pivot = pivot
+        self.prefixes = corpora
+        self.home = home
+        self.catalog = CorpusCatalog(home)
+        self.corpora = OrderedDict()
+        self.legs = OrderedDict()
+        self.chains = []
+        for src_lang, tar_lang in pairs:
+            assert pivot not in (src_lang, tar_lang) and src_lang != tar_lang, \
+                "Invalid pivot pair {}-{}".format(src_lang, tar_lang)
+            first = self._leg(src_lang, pivot, src_lang)
+            second = self._leg(pivot, tar_lang, tar_lang)
+            chain = Chain(src_lang, tar_lang, first, second, self.catalog)
+            for used in (first, second, first.corpus, second.corpus):
+                if chain.name not in used.pairs:
+                    used.pairs.append(chain.name)
+            self.chains.append(chain)
+
+    def _corpus(self, lang):
+        if lang not in self.corpora:
+            assert lang in self.prefixes, "No corpus given for {} in config.ini".format(lang)
+            self.corpora[lang] = Corpus(lang, self.pivot, self.prefixes[lang], self.home)
+        return self.corpora[lang]
+
+    def _leg(self, src_lang, tar_lang, lang):
+        key = (src_lang, tar_lang)
+        if key not in self.legs:
+            self.legs[key] = Leg(src_lang, tar_lang, self._corpus(lang))
+        return self.legs[key]
+
+    def get_raw_filenames(self):
+        files = []
+        for corpus in self.corpora.values():
+            files += corpus.files.get_raw_filenames()
+        return files
+
+    def get_language_models(self):
+        """ Maps the training file of each language model to the legs using it """
+        models = OrderedDict()
+        for leg in self.legs.values():
+            models.setdefault(leg.get_language_model_filename(), []).append(leg)
+        return models
+
+    def report(self):
+        """ What the plan builds, and for which pairs """
+        lines = ["Pivot pairs through {}: {}".format(self.pivot,
+            ", ".join(chain.name for chain in self.chains))]
+        lines.append("Corpora ({}):".format(len(self.corpora)))
+        for corpus in self.corpora.values():
+            lines.append("\t{} used by {}".format(corpus.files.get_raw_filenames()[0],
+                ", ".join(corpus.pairs)))
+        lines.append("Legs ({}):".format(len(self.legs)))
+        for leg in self.legs.values():
+            lines.append("\t{} used by {}".format(leg.working_dir, ", ".join(leg.pairs)))
+        models = self.get_language_models()
+        lines.append("Language models ({}):".format(len(models)))
+        for datafile, legs in models.items():
+            lines.append("\t{} used by {}".format(utilities.strip_filename_from_path(datafile),
+                ", ".join(leg.working_dir for leg in legs)))
+        return "\n".join(lines) + "\n"
+
+def plan_from_config(config, home="data/"):
+    """
+    The plan set in the [Multi Pair Settings] section of config.ini, or
+    None if it names no pairs. pairs lists source-target pairs such as
+    es-fr es-de it-fr, and corpus_<lang> the corpus prefix of each
+    language with pivot_lang
+    """
+    pairs = config.get(SECTION, "pairs", fallback="").replace(",", " ").split()
+    if not pairs:
+        return None
+    pivot = config.get(SECTION, "pivot_lang", fallback="en")
+    corpora = {key[len("corpus_"):]: value for key, value in config.items(SECTION)
+               if key.startswith("corpus_")}
+    return PivotPlan([tuple(pair.split("-")) for pair in pairs], pivot, corpora, home)
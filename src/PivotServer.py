@@ -2,14 +2,14 @@
 Class for launching a server to translate using pivot language
 Inherits the Server class base functionality
 """
-import socket
-import xmlrpc.client
-import subprocess
-import psutil
+import threading
 
 import utilities
 
+from DecoderDaemon import profiles_from_config
 from Server import Server
+from PivotPipeline import PivotPipeline
+from TranslationService import ServiceClient
 
 class PivotServer(Server):
 
@@ -22,43 +22,48 @@ class PivotServer(Server):
         assert utilities.dir_exists(working_dir1), "TestInteractiveError: {} not found".format(working_dir1)
         assert utilities.dir_exists(working_dir2), "TestInteractiveError: {} not found".format(working_dir2)
 
-        temp_file1 = working_dir1 + "/interactive.out"
-        temp_file2 = working_dir2 + "/interactive.out"
+        legs = [working_dir1, working_dir2]
+        client, daemon = self._connect(legs)
+        self._manage_connections(lambda text: client.document(legs, text, profile=self.profile))
+        self._disconnect(client, daemon)
 
-        port1, port2 = self._get_free_port(), self._get_free_port()
-        prox1, prox2 = self._setup_proxy(port1), self._setup_proxy(port2)
-
-        process1 = self._load_server(working_dir1, port1, temp_file1)
-        process2  =self._load_server(working_dir2, port2, temp_file2)
-
-        self._manage_connections(prox1, prox2)
-
-        self._shut_server(process1)
-        self._shut_server(process2)
-
-    def _manage_connections(self, prox1, prox2):
+    def translate_document(self, working_dir1, working_dir2, src_file, queue_size=8):
         """
-        Accepts user input, submits it to moses for the pivoting
-        translation and displays the result to the user
+        Translates src_file one sentence per line through both legs, with
+        leg 2 working on sentence i while leg 1 works on sentence i+1.
+        The file is streamed, never loaded whole, and the translations are
+        written in order to src_file with the '.pivot.translated' extension
         """
-        print("Enter text to translate (type quit to exit)")
-        while True:
-            query = input(">> ").lower().strip()
-            if query == "quit" or query == "q":
-                return
-            try:
-                piv_result = self._make_translation_request(prox1, query)
-                tar_result = self._make_translation_request(prox2, piv_result)
-            except (ConnectionRefusedError, xmlrpc.client.Fault) as e:
-                tar_result = ''
+        assert utilities.file_exists(src_file), "TranslateDocumentError: {} not found".format(src_file)
+        legs = [working_dir1, working_dir2]
+        client, daemon = self._connect(legs)
+        local = threading.local()
 
-            print("Text: {}\tTranslation: {}\n".format(query, tar_result))
+        def leg(working_dir):
+            def translate(text):
+                if not hasattr(local, "client"):
+                    local.client = ServiceClient(client.port)
+                return local.client.translate(working_dir, text, profile=self.profile)
+            return translate
+
+        result = src_file + ".pivot.translated"
+        self._print("Translating {} via pivot.\n\tSaving to {}... ".format(src_file, result))
+        pipeline = PivotPipeline([leg(d) for d in legs], queue_size)
+        with open(src_file, 'r') as src, open(result, 'w') as out:
+            for translation in pipeline.run(src):
+                out.write("{}\n".format(translation))
+        self._print("Done\n")
+
+        self._disconnect(client, daemon)
+        return result
 
 def main():
     config = utilities.config_file_reader()
     path_to_moses = utilities.safe_string(config.get("Environment Settings", "path_to_moses_decoder"))
 
-    server = PivotServer(path_to_moses)
+    profiles, profile = profiles_from_config(config)
+
+    server = PivotServer(path_to_moses, profiles=profiles, profile=profile)
     server.translate_interactive("es-en.working", "en-fr.working")
 
 if __name__ == '__main__':
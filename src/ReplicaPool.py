@@ -0,0 +1,268 @@
+"""
+Pool of decoder replicas serving one translation leg
+"""
+import math
+import time
+import threading
+from collections import deque
+
+import psutil
+
+import utilities
+from Decoder import Decoder
+from ModelMemory import ModelMemory
+from RequestBatcher import RequestBatcher, INTERACTIVE
+
+class PoolRetired(Exception):
+    """ Raised by submit once a pool has been replaced by a reload """
+
+class Overloaded(Exception):
+    """ Raised by admit when a pool is queueing too much to take more work """
+    def __init__(self, moses_ini, retry_after):
+        Exception.__init__(self, "too many requests queued for {}, retry in {}s".format(
+            moses_ini, retry_after))
+        self.retry_after = retry_after
+
+class DeadlineExceeded(TimeoutError):
+    """ Raised when a request's deadline passes before it is translated """
+
+class Replica(object):
+    """ One moses server with its batcher and count of outstanding requests """
+    def __init__(self, decoder, batcher):
+        self.decoder = decoder
+        self.batcher = batcher
+        self.outstanding = 0
+        self.draining = False
+        self.failed_checks = 0
+
+class ReplicaPool(object):
+    """
+    Runs between min_replicas and max_replicas moses servers for a leg and
+    sends each request to the replica with the fewest outstanding requests.
+    autoscale adds a replica when recent latency or outstanding requests
+    per replica cross their thresholds, and drains one once the pool has
+    been idle for scale_down_after seconds. With shared_models the
+    replicas map the model's binarized tables instead of loading them,
+    so they share one copy of the model in the page cache. flags are
+    extra moses flags, such as the search settings of a decoding profile
+    """
+    def __init__(self, path_to_moses, moses_ini, logfile, ncpus=1, min_replicas=1,
+        max_replicas=0, max_batch=32, max_batch_delay=0.005, scale_up_latency=2.0,
+        scale_up_queue_depth=4, scale_down_after=60, decoder_threads=8,
+        shared_models=False, max_decode_time=0, flags="", verbose=False):
+        self.path_to_moses = path_to_moses
+        self.moses_ini = moses_ini
+        self.flags = flags
+        self.logfile = logfile
+        self.ncpus = ncpus
+        self.shared_models = shared_models
+        self.min_replicas = max(1, min_replicas)
+        self.max_replicas = max_replicas or self.replica_limit()
+        self.max_batch = max_batch
+        self.max_batch_delay = max_batch_delay
+        self.scale_up_latency = scale_up_latency
+        self.scale_up_queue_depth = scale_up_queue_depth
+        self.scale_down_after = scale_down_after
+        self.decoder_threads = decoder_threads
+        self.max_decode_time = max_decode_time
+        self.verbose = verbose
+
+        self.version = utilities.model_fingerprint(moses_ini)
+        self.retired = False
+        self.replicas = []
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=200)
+        self.last_busy = time.time()
+
+    def _print(self, item):
+        if self.verbose:
+            utilities.flush_print(item)
+
+    def replica_limit(self):
+        """
+        The most replicas this host can hold: one per cpu, and no more than
+        fit in 80% of the memory currently available given the model size.
+        Shared models are paid for once, so only cpus limit them
+        """
+        footprint = 0 if self.shared_models else ModelMemory(self.moses_ini).footprint()
+        by_memory = int(psutil.virtual_memory().available * 0.8 / footprint) if footprint else self.ncpus
+        return max(1, min(self.ncpus, by_memory))
+
+    def start(self):
+        """ Starts min_replicas replicas, returning once they are all ready """
+        for _ in range(min(self.min_replicas, self.max_replicas)):
+            self._add_replica()
+
+    def _add_replica(self):
+        decoder = Decoder(self.path_to_moses, self.moses_ini, self.logfile,
+            "-threads {}".format(self.decoder_threads) +
+            (" -time-out {}".format(self.max_decode_time) if self.max_decode_time else "") +
+            (" " + self.flags if self.flags else ""),
+            tables_in_memory=not self.shared_models, verbose=self.verbose)
+        decoder.start()
+        replica = Replica(decoder, RequestBatcher(decoder, self.max_batch,
+            self.max_batch_delay, self.decoder_threads, verbose=self.verbose))
+        with self.lock:
+            self.replicas.append(replica)
+        return replica
+
+    def submit(self, text, priority=INTERACTIVE):
+        """ Queues text on the least loaded replica, returning a Future """
+        with self.lock:
+            if self.retired:
+                raise PoolRetired(self.moses_ini)
+            live = [r for r in self.replicas if not r.draining]
+            replica = min(live, key=lambda r: r.outstanding)
+            replica.outstanding += 1
+            self.last_busy = time.time()
+        start = time.time()
+        future = replica.batcher.submit(text, priority)
+        future.add_done_callback(lambda f: self._finished(replica, start))
+        return future
+
+    def translate(self, text, timeout=None):
+        return self.submit(text).result(timeout)
+
+    def admit(self, max_queue_per_replica):
+        """
+        Raises Overloaded if the pool already holds max_queue_per_replica
+        outstanding requests per serving replica, with an estimate of how
+        many seconds it needs to work through them
+        """
+        with self.lock:
+            live = sum(1 for r in self.replicas if not r.draining) or 1
+            depth = sum(r.outstanding for r in self.replicas)
+        if max_queue_per_replica and depth >= max_queue_per_replica * live:
+            drain = depth * max(self.recent_latency(), 0.1) / (live * self.decoder_threads)
+            raise Overloaded(self.moses_ini, max(1, int(math.ceil(drain))))
+
+    def _finished(self, replica, start):
+        with self.lock:
+            replica.outstanding -= 1
+            self.latencies.append((time.time(), time.time() - start))
+
+    def queue_depth(self):
+        """ Requests sent to the pool which have not been answered yet """
+        with self.lock:
+            return sum(r.outstanding for r in self.replicas)
+
+    def waiting(self):
+        """ Requests queued in the batchers which have not been batched yet """
+        with self.lock:
+            return sum(r.batcher.requests.qsize() for r in self.replicas)
+
+    def recent_latency(self, window=30):
+        """ Mean latency of requests finished in the last window seconds """
+        cutoff = time.time() - window
+        with self.lock:
+            recent = [l for t, l in self.latencies if t >= cutoff]
+        return sum(recent) / len(recent) if recent else 0.0
+
+    def autoscale(self):
+        """ Grows or shrinks the pool by one replica when a threshold is crossed """
+        with self.lock:
+            live = [r for r in self.replicas if not r.draining]
+        depth = self.queue_depth() / max(1, len(live))
+        if len(live) < self.max_replicas and (depth > self.scale_up_queue_depth or \
+            self.recent_latency() > self.scale_up_latency):
+            self._print("Adding replica for {} ({} outstanding per replica)\n".format(
+                self.moses_ini, round(depth, 2)))
+            self._add_replica()
+            with self.lock:
+                self.latencies.clear()
+        elif len(live) > self.min_replicas and \
+            time.time() - self.last_busy > self.scale_down_after:
+            self._print("Draining replica for {}\n".format(self.moses_ini))
+            self._drain(live[-1])
+            self.last_busy = time.time()
+
+    def resize(self, replicas):
+        """ Starts or drains replicas until replicas are serving """
+        replicas = max(1, min(replicas, self.max_replicas))
+        with self.lock:
+            live = [r for r in self.replicas if not r.draining]
+        for _ in range(replicas - len(live)):
+            self._add_replica()
+        for replica in live[replicas:]:
+            self._drain(replica)
+
+    def _drain(self, replica):
+        """ Stops routing to replica and shuts it down once it is idle """
+        with self.lock:
+            replica.draining = True
+
+        def stop_when_idle():
+            while replica.outstanding > 0:
+                time.sleep(0.05)
+            self._stop_replica(replica)
+            with self.lock:
+                self.replicas.remove(replica)
+        threading.Thread(target=stop_when_idle, daemon=True).start()
+
+    def retire(self):
+        """
+        Refuses new requests, then stops every replica once the requests
+        already queued have been answered
+        """
+        with self.lock:
+            self.retired = True
+
+        def stop_when_idle():
+            while self.queue_depth() > 0:
+                time.sleep(0.05)
+            self.stop()
+        threading.Thread(target=stop_when_idle, daemon=True).start()
+
+    def check_health(self, max_failed_checks=3):
+        """
+        Restarts replicas which have crashed, or which failed
+        max_failed_checks health checks in a row
+        """
+        for replica in list(self.replicas):
+            decoder = replica.decoder
+            healthy = decoder.is_alive() and decoder.healthy()
+            replica.failed_checks = 0 if healthy else replica.failed_checks + 1
+            if not decoder.is_alive() or replica.failed_checks >= max_failed_checks:
+                replica.failed_checks = 0
+                decoder.ready.clear()
+                try:
+                    decoder.restart()
+                except RuntimeError as e:
+                    self._print("{}\n".format(e))
+
+    def _stop_replica(self, replica):
+        replica.batcher.stop()
+        replica.decoder.stop()
+
+    def stop(self):
+        for replica in list(self.replicas):
+            self._stop_replica(replica)
+
+    def pids(self):
+        return [r.decoder.process.pid for r in self.replicas if r.decoder.process]
+
+    def status(self):
+        with self.lock:
+            replicas = list(self.replicas)
+        return {"replicas": [dict(r.decoder.status(), outstanding=r.outstanding,
+                    draining=r.draining) for r in replicas],
+                "max_replicas": self.max_replicas,
+                "flags": self.flags,
+                "version": self.version,
+                "queue_depth": self.queue_depth(),
+                "recent_latency": round(self.recent_latency(), 4)}
+
+    def batch_stats(self):
+        """ Batch size distribution summed over the replicas """
+        with self.lock:
+            stats = [r.batcher.stats() for r in self.replicas]
+        sizes = {}
+        for s in stats:
+            for size, count in s["batch_sizes"].items():
+                sizes[size] = sizes.get(size, 0) + count
+        batches = sum(s["batches"] for s in stats)
+        requests = sum(s["requests"] for s in stats)
+        return {"batches": batches, "requests": requests,
+                "mean_batch_size": round(requests / batches, 2) if batches else 0,
+                "batch_sizes": dict(sorted(sizes.items(), key=lambda i: int(i[0]))),
+                "replicas": len(stats)}
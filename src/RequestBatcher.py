@@ -0,0 +1,174 @@
+"""
+Collects concurrent translation requests for a decoder into batches
+"""
+import time
+import queue
+import itertools
+import threading
+import xmlrpc.client
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import utilities
+
+INTERACTIVE = 0
+BULK = 1
+_STOP = float("inf")
+
+class RequestBatcher(object):
+    """
+    Sits in front of a Decoder. Requests arriving within max_delay seconds
+    of the first request in a batch, up to max_batch of them, are sent to
+    moses together in XML-RPC system.multicalls. Each caller gets back its
+    own result. moses works through a multicall one call at a time, so a
+    batch is split over the idle workers, whose number should match the
+    threads of the moses server. Requests wait in a priority queue until a
+    worker is free, so INTERACTIVE requests overtake queued BULK ones, and
+    BULK requests are sent one per call so that an interactive request
+    never waits behind more than one bulk sentence per worker
+    """
+    def __init__(self, decoder, max_batch=32, max_delay=0.005, workers=2, verbose=False):
+        self.decoder = decoder
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.workers = workers
+        self.verbose = verbose
+
+        self.requests = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.executor = ThreadPoolExecutor(workers)
+        self.idle = threading.Semaphore(workers)
+        self.batch_sizes = Counter()
+        self.lock = threading.Lock()
+        self.multicall = True
+        self.running = True
+        self.thread = threading.Thread(target=self._collect, daemon=True)
+        self.thread.start()
+
+    def _print(self, item):
+        if self.verbose:
+            utilities.flush_print(item)
+
+    def translate(self, text, timeout=None, priority=INTERACTIVE):
+        """ Queues text for the next batch and waits for its translation """
+        return self.submit(text, priority).result(timeout)
+
+    def submit(self, text, priority=INTERACTIVE):
+        """ Queues text for the next batch, returning a Future for the result """
+        future = Future()
+        self.requests.put((priority, next(self.sequence), text, future))
+        return future
+
+    def _collect(self):
+        """
+        Waits for an idle worker, gathers the next batch and splits it
+        over every worker idle at that point
+        """
+        while self.running:
+            self.idle.acquire()
+            first = self.requests.get()
+            if first[0] == _STOP:
+                return
+            batch = [first] if first[0] != INTERACTIVE else self._gather(first)
+            workers = 1
+            while workers < len(batch) and self.idle.acquire(blocking=False):
+                workers += 1
+            size = -(-len(batch) // workers)
+            for i in range(workers):
+                part = [(t, f) for _, _, t, f in batch[i * size:(i + 1) * size]
+                        if f.set_running_or_notify_cancel()]
+                if part:
+                    self.executor.submit(self._send, part)
+                else:
+                    self.idle.release()
+
+    def _gather(self, first):
+        """
+        Collects interactive requests arriving within max_delay of first,
+        up to max_batch of them
+        """
+        batch = [first]
+        deadline = time.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item[0] != INTERACTIVE:
+                self.requests.put(item)
+                break
+            batch.append(item)
+        return batch
+
+    def _send(self, batch):
+        """ Translates a batch and resolves each caller's future """
+        with self.lock:
+            self.batch_sizes[len(batch)] += 1
+        try:
+            results = self._translate_batch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            self.idle.release()
+
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _translate_batch(self, texts):
+        """
+        Sends texts in one system.multicall. Falls back to one call per
+        text if the server does not support multicall. Failed entries
+        are returned as exceptions
+        """
+        if len(texts) == 1 or not self.multicall:
+            return [self._translate_one(text) for text in texts]
+
+        if not self.decoder.ready.wait(600):
+            raise ConnectionRefusedError("Decoder for {} is not ready".format(self.decoder.moses_ini))
+        multicall = xmlrpc.client.MultiCall(self.decoder.proxy())
+        for text in texts:
+            multicall.translate({"text": text})
+        try:
+            results = multicall()
+        except xmlrpc.client.Fault:
+            self._print("system.multicall unsupported, sending requests one at a time\n")
+            self.multicall = False
+            return [self._translate_one(text) for text in texts]
+
+        translations = []
+        for i in range(len(texts)):
+            try:
+                translations.append(results[i]["text"])
+            except xmlrpc.client.Fault as e:
+                translations.append(e)
+        return translations
+
+    def _translate_one(self, text):
+        try:
+            return self.decoder.translate(text)
+        except (OSError, xmlrpc.client.Error) as e:
+            return e
+
+    def stats(self):
+        """ Reports the distribution of batch sizes sent so far """
+        with self.lock:
+            sizes = dict(self.batch_sizes)
+        batches = sum(sizes.values())
+        requests = sum(size * count for size, count in sizes.items())
+        return {"batches": batches, "requests": requests,
+                "mean_batch_size": round(requests / batches, 2) if batches else 0,
+                "batch_sizes": {str(size): count for size, count in sorted(sizes.items())}}
+
+    def stop(self):
+        """ Stops collecting; requests already batched are still answered """
+        self.requests.put((_STOP, next(self.sequence), None, None))
+        self.thread.join()
+        self.executor.shutdown(wait=True)
@@ -1,17 +1,20 @@
 """
 Base class for launching translation server
 """
-import socket
-import xmlrpc.client
-import subprocess
-import psutil
-
 import utilities
+from DecoderDaemon import DecoderDaemon, DEFAULT_PROFILE, profiles_from_config
+from TranslationService import ServiceClient, ServiceError
 
 class Server(object):
-    def __init__(self, path_to_moses, verbose=False):
+    """
+    profiles maps the decoding profiles a private daemon serves to their
+    moses flags, and profile names the one this session translates with
+    """
+    def __init__(self, path_to_moses, verbose=False, profiles=None, profile=None):
         self.path_to_moses = path_to_moses
         self.verbose = verbose
+        self.profiles = profiles
+        self.profile = profile
 
     def _print(self, item):
         if self.verbose:
@@ -20,75 +23,75 @@ class Server(object):
     def translate_interactive(self, working_dir):
         """
         Launches the mosesdecoder to allow for interactive decoding between
-        source and target languages.
+        source and target languages. The prompt is a client of the
+        translation service, attaching to the running daemon when it serves
+        working_dir and starting a private one otherwise. Input may hold
+        several sentences; it is split and tokenized by the service
         """
         assert utilities.dir_exists(working_dir), "TestInteractiveError: {} not found".format(working_dir)
 
-        temp_file = working_dir + "/interactive.out"
-        port = self._get_free_port()
-        proxy = self._setup_proxy(port)
-
-        process = self._load_server(working_dir, port, temp_file)
-        self._manage_connections(process, proxy)
-        self._shut_server(process)
+        client, daemon = self._connect([working_dir])
+        self._manage_connections(lambda text: client.document([working_dir], text,
+            profile=self.profile))
+        self._disconnect(client, daemon)
 
-    def _manage_connections(self, process, proxy):
+    def _manage_connections(self, translate):
         """ Accepts user input, submits it to moses, returns the result """
         print("Enter text to translate (type quit to exit)")
         while True:
-            query = input(">> ").lower().strip()
-            if query == "quit" or query == "q":
+            query = input(">> ").strip()
+            if query.lower() in ("quit", "q"):
                 return
 
             try:
-                result = self._make_translation_request(proxy, query)
-            except (ConnectionRefusedError, xmlrpc.client.Fault) as e:
+                result = translate(query)
+            except (ConnectionRefusedError, ServiceError) as e:
                 result = ''
 
             print("Text: {}\tTranslation: {}\n".format(query, result))
 
-    def _load_server(self, working_dir, port, logfile):
+    def _connect(self, working_dirs):
         """
-        Loads the moses server on the provided port number using the
-        informatio in the specified working directory. Returns the
-        launched server process
+        Returns a service client for working_dirs along with the daemon
+        started for this session, which is None when attaching to a
+        daemon that is already running
         """
-        self._print("Loading interactive translator at {}...".format(working_dir))
-        command = self.path_to_moses + "bin/moses" + \
-            " -minlexr-memory --server --server-port {}".format(port) + \
-            " --server-maxconn-backlog 5" + \
-            " -v 0 -f {}/mert-work/moses.ini &".format(working_dir)
-
-        with open(logfile, 'w') as err:
-            process = subprocess.Popen(command.split(), shell=False, stderr=err)
-        self._print("Ready\n")
-        return process
-
-    def _make_translation_request(self, proxy, text):
-        """ Sends the text we want to translate to the moses server """
-        response = proxy.translate({"text": text})
-        return response["text"]
+        client = ServiceClient.attach(working_dirs)
+        if client is not None:
+            self._print("Attached to translation service on port {}\n".format(client.port))
+            return client, None
 
-    def _get_free_port(self):
-        """ Returns an available port number for moses server to use """
-        sock = socket.socket()
-        sock.bind(('', 0))
-        return sock.getsockname()[1]
+        daemon = self._load_server(working_dirs)
+        return ServiceClient(daemon.port), daemon
 
-    def _setup_proxy(self, port):
-        """ Sets up a server proxy to communicate with moses server """
-        return xmlrpc.client.ServerProxy("http://localhost:{}/RPC2".format(port))
+    def _load_server(self, working_dirs, logname="interactive.out"):
+        """
+        Loads moses servers for working_dirs in a daemon private to this
+        process and serves them on a free port. Returns the daemon once its
+        decoders answer requests
+        """
+        self._print("Loading interactive translator at {}...".format(', '.join(working_dirs)))
+        daemon = DecoderDaemon(self.path_to_moses, working_dirs, profiles=self.profiles,
+            default_profile=self.profile or DEFAULT_PROFILE,
+            state_file=None, logname=logname)
+        daemon.start()
+        daemon.serve_in_background()
+        self._print("Ready\n")
+        return daemon
 
-    def _shut_server(self, process):
-        """ Uses the putil library to shut the background translation
-        service down """
-        psutil.Process(process.pid).kill()
+    def _disconnect(self, client, daemon):
+        """ Closes the client and shuts down a daemon started for this session """
+        client.close()
+        if daemon is not None:
+            daemon.shutdown(wait=True)
 
 def main():
     config = utilities.config_file_reader()
     path_to_moses = utilities.safe_string(config.get("Environment Settings", "path_to_moses_decoder"))
 
-    server = Server(path_to_moses)
+    profiles, profile = profiles_from_config(config)
+
+    server = Server(path_to_moses, profiles=profiles, profile=profile)
     server.translate_interactive("es-en.working")
 
 if __name__ == '__main__':
@@ -8,11 +8,17 @@ import subprocess
 import psutil
 
 import utilities
+from FilterCache import FilterCache
+from PhraseFilter import PhraseFilter
 
 class Test(object):
-    def __init__(self, path_to_moses, verbose = False):
+    def __init__(self, path_to_moses, verbose = False, max_filtered_models = 4,
+        ncpus = 1, builtin_filter = True):
         self.path_to_moses = path_to_moses
         self.verbose = verbose
+        self.max_filtered_models = max_filtered_models
+        self.ncpus = ncpus
+        self.builtin_filter = builtin_filter
 
     def _print(self, item):
         if self.verbose:
@@ -38,9 +44,7 @@ class Test(object):
             src_test = os.getcwd() + "/" + src_test
 
         # Filter test set
-        filt_dir = working_dir + "/binarized-filtered-model"
-        if not utilities.dir_exists(filt_dir):
-            self._filter_test_set(src_test, working_dir, filt_dir, "binarizer.out")
+        filt_dir = self._get_filtered_model(src_test, working_dir, "binarizer.out")
 
         # Create translated file
         result = src_test + ".translated"
@@ -55,13 +59,30 @@ class Test(object):
         # Report bleu score
         self._report_bleu_score(working_dir, result_file)
 
+    def _get_filtered_model(self, src_test, working_dir, debug):
+        """
+        Returns a filtered model able to translate src_test, reusing a
+        cached one when its coverage is a superset of src_test's n-grams
+        """
+        cache = FilterCache(working_dir, self.max_filtered_models, verbose=self.verbose)
+        build = lambda filt_dir: self._filter_test_set(src_test, working_dir, filt_dir, debug)
+        return cache.fetch(src_test, working_dir + "/mert-work/moses.ini", build)
+
     def _filter_test_set(self, src_test, working_dir, filt_dir, debug):
         """
         Filter the trained model so that we retain only the entries
         necessary to translate the test set.  Makes the final
-        translation much faster
+        translation much faster. Uses the in-process PhraseFilter unless
+        builtin_filter is False, in which case the moses perl script is used
         """
         self._print("Filtering test set at {}... ".format(working_dir))
+        if self.builtin_filter:
+            phrase_filter = PhraseFilter(self.path_to_moses, self.ncpus, verbose=self.verbose)
+            phrase_filter.filter_model(src_test, "{}/mert-work/moses.ini".format(working_dir),
+                filt_dir, "{}/{}".format(working_dir, debug))
+            self._print("Done\n")
+            return
+
         command = self.path_to_moses + "scripts/" + \
             "training/filter-model-given-input.pl" + \
             " {} {}/mert-work/moses.ini".format(filt_dir, working_dir) + \
@@ -71,9 +92,10 @@ class Test(object):
         subprocess.call(command, shell=True)
         self._print("Done\n")
 
-    def _translate_pivot(self, src_test, working_dir, result, filt_dir, debug):
+    def _translate_pivot(self, src_test, working_dir, result, filt_dir, debug, flags=""):
         """
-        Given two files containing src and target data, returns the bleu score
+        Given two files containing src and target data, returns the bleu score.
+        flags are passed on to moses, overriding the settings of its moses.ini
         """
         self._print("Translating between langs in {}.\n\tSaving to {}... ".format(working_dir, result))
 
@@ -83,7 +105,8 @@ class Test(object):
             " {}".format(src_test) + \
             " > {}".format(result) + \
             " 2> {}/{}".format(working_dir, debug) + \
-            " -minlexr-memory"
+            " -minlexr-memory" + \
+            (" " + flags if flags else "")
         subprocess.call(command, shell=True)
         self._print("Done\n")
 
@@ -106,7 +129,8 @@ class Test(object):
         print("Results for {} translation".format(working_dir))
         print("\t", open(result_file, 'r').readline().strip(), "\n")
 
-    def test_pivoting_quality(self, src_test, src_working_dir, tar_test, tar_working_dir):
+    def test_pivoting_quality(self, src_test, src_working_dir, tar_test, tar_working_dir,
+        name="pivot"):
         """
         Tests the quality of translation via a pivoting language.
         Returns the bleu score to the user. As parameters, this expects
@@ -114,7 +138,8 @@ class Test(object):
         the src language to piv directory containing the trained decoder,
         the target language test file,
         and the piv to tar language directory containing the trained
-        decoder
+        decoder. name labels the result, kept in tar_working_dir, so
+        that legs shared by several pivot pairs keep a score for each
         """
         self._validate_file(src_test), self._validate_file(tar_test)
         assert utilities.dir_exists(src_working_dir), "TestPivotingQualityError: {} not found".format(src_working_dir)
@@ -123,31 +148,25 @@ class Test(object):
         if not utilities.isabsolute(src_test):
             src_test = os.getcwd() + "/" + src_test
 
-        filt_dir = src_working_dir + "/pivot-binarized-filtered-model/"
-        if not utilities.dir_exists(filt_dir):
-            debug = "pivot.binarizer.out"
-            self._filter_test_set(src_test, src_working_dir, filt_dir, debug)
+        filt_dir = self._get_filtered_model(src_test, src_working_dir, "pivot.binarizer.out")
 
         trans_result = src_test + ".pivot.translated"
         if not utilities.file_exists(trans_result):
             debug = "pivot.translation.out"
             self._translate_pivot(src_test, src_working_dir, trans_result, filt_dir, debug)
 
-        tar_filt_dir = tar_working_dir + "/pivot-binarized-filtered-model/"
-        if not utilities.dir_exists(tar_filt_dir):
-            debug = "pivot.binarizer.out"
-            self._filter_test_set(trans_result, tar_working_dir, tar_filt_dir, debug)
+        tar_filt_dir = self._get_filtered_model(trans_result, tar_working_dir, "pivot.binarizer.out")
 
         target_result = trans_result + ".final"
         if not utilities.file_exists(target_result):
             debug = "pivot.translation.out"
             self._translate_pivot(trans_result, tar_working_dir, target_result, tar_filt_dir, debug)
 
-        result_file = tar_working_dir + "/pivot.translation.bleu"
+        result_file = tar_working_dir + "/{}.translation.bleu".format(name)
         if not utilities.file_exists(result_file):
             self._get_bleu_score(target_result, tar_test, tar_working_dir, result_file)
 
-        self._report_bleu_score("pivot", result_file)
+        self._report_bleu_score(name, result_file)
 
     def translate_file(self, src_test, working_dir):
         """
@@ -164,9 +183,7 @@ class Test(object):
             src_test = os.getcwd() + "/" + src_test
 
         # Filter test set
-        filt_dir = working_dir + "/binarized-filtered-model"
-        if not utilities.dir_exists(filt_dir):
-            self._filter_test_set(src_test, working_dir, filt_dir, "binarizer.out")
+        filt_dir = self._get_filtered_model(src_test, working_dir, "binarizer.out")
 
         # Create translated file
         result = src_test + ".translated"
@@ -0,0 +1,151 @@
+"""
+Sentence splitting, tokenization and detokenization done in process.
+
+The rules follow Moses' split-sentences.perl, tokenizer.perl and
+detokenizer.perl closely enough that text prepared here matches what the
+models were trained on: tokenizer.perl output, lowercased as
+Parser.cleanse does. Only the common nonbreaking prefixes are built in.
+"""
+import re
+import os
+
+NONBREAKING_PREFIXES = {
+    "en": {"mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "e.g",
+           "i.e", "no", "art", "fig", "vol", "inc", "ltd", "co", "jan", "feb",
+           "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec"},
+    "es": {"sr", "sra", "srta", "dr", "dra", "d", "dña", "ud", "uds", "vd", "vds",
+           "art", "núm", "pág", "etc", "ej", "ee", "uu", "av", "avda"},
+    "fr": {"m", "mm", "mme", "mlle", "dr", "me", "st", "ste", "art", "etc", "p",
+           "cf", "av", "bd", "n°", "no"},
+    "de": {"hr", "fr", "dr", "prof", "nr", "art", "bzw", "ca", "usw", "z.b", "d.h",
+           "vgl", "s", "abs"},
+    "it": {"sig", "sigg", "dott", "prof", "art", "ecc", "pag", "n", "es"},
+}
+
+# tokenizer.perl splits English contractions before the apostrophe
+# (don't -> don 't) and French and Italian elisions after it (l'on -> l' on)
+APOSTROPHE_AFTER = {"fr", "it"}
+
+ESCAPES = [("&", "&amp;"), ("|", "&#124;"), ("<", "&lt;"), (">", "&gt;"),
+           ("'", "&apos;"), ('"', "&quot;"), ("[", "&#91;"), ("]", "&#93;")]
+
+def leg_languages(working_dir):
+    """
+    Returns the (source, target) languages of a leg named like
+    es-en.working, or (None, None) if the name does not say
+    """
+    match = re.match(r"([a-z]{2,3})-([a-z]{2,3})\b", os.path.basename(os.path.abspath(working_dir)))
+    return match.groups() if match else (None, None)
+
+class TextProcessor(object):
+    def __init__(self, lang="en"):
+        self.lang = lang if lang in NONBREAKING_PREFIXES else "en"
+        self.prefixes = NONBREAKING_PREFIXES[self.lang]
+
+    def paragraphs(self, text):
+        """ Splits text on blank lines, dropping empty paragraphs """
+        return [p for p in re.split(r"\n\s*\n", text) if p.strip()]
+
+    def split_sentences(self, paragraph):
+        """
+        Splits a paragraph into sentences at ., ? and ! followed by space
+        and an uppercase letter, digit or opening quote, unless the word
+        ending in the period is a nonbreaking prefix or a single initial
+        """
+        words = paragraph.split()
+        sentences, current = [], []
+        for i, word in enumerate(words):
+            current.append(word)
+            following = words[i + 1] if i + 1 < len(words) else None
+            if following is None or not self._ends_sentence(word, following):
+                continue
+            sentences.append(" ".join(current))
+            current = []
+        if current:
+            sentences.append(" ".join(current))
+        return sentences
+
+    def _ends_sentence(self, word, following):
+        if not re.search(r"[.?!][\"')\]]*$", word):
+            return False
+        if not re.match(r"[\"'(\[¿¡]*[^\W\d_a-z]|[\"'(\[¿¡]*\d", following):
+            return False
+        if word.endswith("."):
+            stem = word.rstrip(".").lstrip("\"'([")
+            if stem.lower() in self.prefixes or re.fullmatch(r"[^\W\d_]", stem):
+                return False
+        return True
+
+    def tokenize(self, sentence):
+        """ Tokenizes one sentence as tokenizer.perl does, then lowercases it """
+        text = " " + re.sub(r"\s+", " ", sentence.strip()) + " "
+        text = re.sub(r"[\x00-\x1f]", "", text)
+
+        # separate out everything but letters, digits and . ' , -
+        text = re.sub(r"([^\w\s.'`,\-])", r" \1 ", text)
+        # commas are split unless between digits
+        text = re.sub(r"([^\d]),", r"\1 , ", text)
+        text = re.sub(r",([^\d])", r" , \1", text)
+        text = re.sub(r"(\d),$", r"\1 ,", text)
+
+        if self.lang in APOSTROPHE_AFTER:
+            text = re.sub(r"([^\W\d_])'([^\W\d_])", r"\1' \2", text)
+        else:
+            text = re.sub(r"([^\W\d_])'([^\W\d_])", r"\1 '\2", text)
+        text = re.sub(r"([^\w\s])'", r"\1 ' ", text)
+        text = re.sub(r"'([^\w\s])", r" ' \1", text)
+        text = re.sub(r" '(\s)", r" ' \1", text)
+
+        tokens = text.split()
+        text = " ".join(self._split_period(token, i == len(tokens) - 1)
+                        for i, token in enumerate(tokens))
+        text = re.sub(r"\.\.+", lambda m: " " + m.group(0) + " ", text)
+
+        for char, escape in ESCAPES:
+            text = text.replace(char, escape)
+        return " ".join(text.split()).lower()
+
+    def _split_period(self, token, last):
+        """ Splits a sentence final period from a token unless it belongs there """
+        match = re.fullmatch(r"(\S+)\.", token)
+        if not match:
+            return token
+        stem = match.group(1)
+        if "." in stem and re.search(r"[^\W\d_]", stem):
+            return token
+        if stem.lower() in self.prefixes and not last:
+            return token
+        if re.fullmatch(r"[^\W\d_]", stem) and not last:
+            return token
+        return stem + " ."
+
+    def detokenize(self, text):
+        """
+        Joins tokens back into running text, attaching punctuation and
+        apostrophes and capitalizing the first letter as detokenizer.perl
+        does with its -u option
+        """
+        for char, escape in reversed(ESCAPES):
+            text = text.replace(escape, char)
+        tokens = text.split()
+        out, quote_open = "", False
+        for i, token in enumerate(tokens):
+            glue = " " if out else ""
+            if re.fullmatch(r"[,.?!:;%)\]}»]+", token):
+                glue = ""
+            elif self.lang not in APOSTROPHE_AFTER and re.fullmatch(r"'[^\W\d_]+", token):
+                glue = ""
+            elif token == '"':
+                glue = "" if quote_open else glue
+                quote_open = not quote_open
+                out += glue + token
+                if quote_open and i + 1 < len(tokens):
+                    out += "\x00"
+                continue
+            elif self.lang in APOSTROPHE_AFTER and re.search(r"[^\W\d_]'$", out):
+                glue = ""
+            out += glue + token
+            if re.fullmatch(r"[(\[{¿¡«$]", token):
+                out += "\x00"
+        out = re.sub(r"\x00 ?", "", out)
+        return out[:1].upper() + out[1:]
@@ -8,10 +8,11 @@ import subprocess
 import utilities
 
 class Train(object):
-    def __init__(self, path_to_moses, NCPUS, NGRAM, verbose=False):
+    def __init__(self, path_to_moses, NCPUS, NGRAM, verbose=False, sample_size=1000):
         self.path_to_moses = path_to_moses
         self.NCPUS = NCPUS
         self.NGRAM = NGRAM
+        self.sample_size = sample_size
         self.lmdir = "lm/"
         utilities.make_dir(self.lmdir)
         self.verbose = verbose
@@ -59,11 +60,14 @@ class Train(object):
             lm_file + " " + blm_file + " >> {} 2>&1".format(self.lmdir + "blm.out")
         subprocess.call(command, shell=True)
 
-    def train(self, src_file, tar_file, working_dir):
+    def train(self, src_file, tar_file, working_dir, sampling=False):
         """
         Carries out the training.  Creates a working directory,
         extracts the root file information and file extension information
         necessary for moses to run.  Sends output messages to working_dir/log
+        With sampling, training stops after word alignment and the aligned
+        bitext is indexed so phrases are sampled at decode time instead of
+        being extracted and scored up front
         """
         if utilities.dir_exists(working_dir):
             return
@@ -74,28 +78,148 @@ class Train(object):
         cwd = os.getcwd() + "/"
         blm = cwd + "lm/" + utilities.strip_filename_from_path(tar_file) + ".blm"
 
+        utilities.make_dir(working_dir)
+        self._print("Training model at {}. This may take a while... ".format(working_dir))
+        if not sampling:
+            self._run_trainer(src_file, tar_file, working_dir, "train", blm, "train.out")
+            self._print("Done\n")
+            return
+
+        self._run_trainer(src_file, tar_file, working_dir, "train", blm, "train.out",
+            " --last-step 3")
+        l1, l2 = self._language_names(src_file, tar_file)
+        self._append_to_bitext(src_file, tar_file, working_dir, "train", l1, l2)
+        self._build_sampling_index(working_dir, l1, l2)
+        self._write_sampling_config(working_dir, blm, l1, l2)
+        self._print("Done\n")
+
+    def update_sampling_index(self, src_file, tar_file, working_dir):
+        """
+        Adds a new parallel corpus to a leg trained with sampling. Only the
+        new sentences are word aligned, after which they are appended to the
+        indexed bitext and the index is rebuilt. moses.ini is left untouched
+        """
+        assert utilities.dir_exists(working_dir + "/bitext"), \
+            "UpdateSamplingIndexError: {} was not trained with sampling".format(working_dir)
+        self._validate_file(src_file)
+        self._validate_file(tar_file)
+
+        update = 0
+        while utilities.dir_exists(working_dir + "/updates/{}".format(update)):
+            update += 1
+        root_dir = "updates/{}".format(update)
+        utilities.make_dir(working_dir + "/" + root_dir)
+
+        self._print("Adding {} to sampling index at {}... ".format(src_file, working_dir))
+        self._run_trainer(src_file, tar_file, working_dir, root_dir, None,
+            root_dir + "/train.out", " --last-step 3")
+        l1, l2 = self._language_names(src_file, tar_file)
+        self._append_to_bitext(src_file, tar_file, working_dir, root_dir, l1, l2)
+        self._build_sampling_index(working_dir, l1, l2)
+        self._print("Done\n")
+
+    def _run_trainer(self, src_file, tar_file, working_dir, root_dir, blm, log, extra=""):
+        """ Runs train-model.perl from inside working_dir """
+        cwd = os.getcwd() + "/"
         shared = self._find_common_beginning(src_file, tar_file)
         file1_ext = src_file[shared+1:]
         file2_ext = tar_file[shared+1:]
         fileroot = cwd + src_file[:shared]
-        log = "train.out"
 
-        utilities.make_dir(working_dir)
-        self._print("Training model at {}. This may take a while... ".format(working_dir))
         trainer = self.path_to_moses + "scripts/training/train-model.perl"
         command = "cd {};".format(working_dir) +\
             " nohup nice " + trainer + \
-            " -root-dir train -corpus {}".format(fileroot) + \
+            " -root-dir {} -corpus {}".format(root_dir, fileroot) + \
             " -f {} -e {} -alignment".format(file1_ext, file2_ext) + \
             " grow-diag-final-and -reordering msd-bidirectional-fe" + \
-            " -lm 0:3:{}:8".format(blm) + \
+            (" -lm 0:3:{}:8".format(blm) if blm else "") + \
             " -cores {}".format(self.NCPUS) + \
             " -mgiza --parallel" + \
             " -external-bin-dir " + self.path_to_moses + "tools/mgizapp/" + \
+            extra + \
             " >& {};".format(log) + \
-            " cd .."
+            " cd " + cwd
         subprocess.call(command, shell=True)
-        self._print("Done\n")
+
+    def _language_names(self, src_file, tar_file):
+        """
+        Short language names for the sampling index, taken from the first
+        extension after the shared file prefix (es, en, ...)
+        """
+        shared = self._find_common_beginning(src_file, tar_file)
+        l1 = src_file[shared+1:].split('.')[0]
+        l2 = tar_file[shared+1:].split('.')[0]
+        if l1 == l2:
+            return "src", "tgt"
+        return l1, l2
+
+    def _append_to_bitext(self, src_file, tar_file, working_dir, root_dir, l1, l2):
+        """
+        Appends a parallel corpus and its symmetrized word alignment to the
+        text the sampling index is built from
+        """
+        text_dir = working_dir + "/bitext/text/"
+        utilities.make_dir(text_dir)
+        alignment = "{}/{}/model/aligned.grow-diag-final-and".format(working_dir, root_dir)
+        self._validate_file(alignment)
+
+        for source, dest in [(src_file, l1), (tar_file, l2), (alignment, l1 + "-" + l2)]:
+            with open(text_dir + "corpus." + dest, 'a') as out:
+                for line in open(source, 'r'):
+                    out.write(line)
+
+    def _build_sampling_index(self, working_dir, l1, l2):
+        """
+        Builds the suffix arrays, word alignment and lexical tables that
+        Moses' bitext sampling phrase table (Mmsapt) reads at decode time
+        """
+        bitext = working_dir + "/bitext/"
+        text = bitext + "text/corpus."
+        log = " >> {}bitext.out 2>&1".format(bitext)
+        for lang in [l1, l2]:
+            subprocess.call(self.path_to_moses + "bin/mtt-build -i" + \
+                " -o {}corpus.{} < {}{}".format(bitext, lang, text, lang) + log, shell=True)
+        subprocess.call(self.path_to_moses + "bin/symal2mam" + \
+            " {}corpus.{}-{}.mam < {}{}-{}".format(bitext, l1, l2, text, l1, l2) + log, shell=True)
+        subprocess.call(self.path_to_moses + "bin/mmlex-build" + \
+            " {}corpus. {} {} -o {}corpus.{}-{}.lex".format(bitext, l1, l2, bitext, l1, l2) + log,
+            shell=True)
+
+    def _write_sampling_config(self, working_dir, blm, l1, l2):
+        """
+        Writes train/model/moses.ini for a sampled phrase table, where
+        train-model.perl would normally have written one for the extracted
+        tables. Tune picks it up from the same place. The reordering model
+        is computed from the samples by Mmsapt through lr-func. Weights are
+        uniform starting points for MERT: two lexical scores plus the
+        forward and backward phrase scores for the sampled table and eight
+        scores for the hierarchical reordering model
+        """
+        model_dir = working_dir + "/train/model/"
+        utilities.make_dir(model_dir)
+        index = os.path.abspath(working_dir) + "/bitext/corpus."
+        with open(model_dir + "moses.ini", 'w') as f:
+            f.write("[input-factors]\n0\n\n")
+            f.write("[mapping]\n0 T 0\n\n")
+            f.write("[distortion-limit]\n6\n\n")
+            f.write("[feature]\n")
+            f.write("UnknownWordPenalty\n")
+            f.write("WordPenalty\n")
+            f.write("PhrasePenalty\n")
+            f.write("LexicalReordering name=DM0 type=hier-mslr-bidirectional-fe-allff" + \
+                " input-factor=0 output-factor=0\n")
+            f.write("Mmsapt name=PT0 lr-func=DM0 path={} L1={} L2={}".format(index, l1, l2) + \
+                " pfwd=g pbwd=g sample={} workers={}\n".format(self.sample_size, self.NCPUS))
+            f.write("Distortion\n")
+            f.write("KENLM name=LM0 factor=0 path={} order={}\n\n".format(blm, self.NGRAM))
+            f.write("[weight]\n")
+            f.write("UnknownWordPenalty0= 1\n")
+            f.write("WordPenalty0= -1\n")
+            f.write("PhrasePenalty0= 0.2\n")
+            f.write("DM0= " + ' '.join(["0.3"] * 8) + "\n")
+            f.write("PT0= " + ' '.join(["0.2"] * 4) + "\n")
+            f.write("Distortion0= 0.3\n")
+            f.write("LM0= 0.5\n")
 
     def _find_common_beginning(self, s1, s2):
         """ Given two strings, returns the index of the '.' character after which
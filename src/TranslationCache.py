@@ -0,0 +1,48 @@
+"""
+Least recently used cache of translations for each leg
+"""
+import threading
+from collections import OrderedDict
+
+class TranslationCache(object):
+    """
+    Remembers the last max_entries translations, keyed on leg, model
+    version and source text, so translations by an older model are never
+    served once a leg is reloaded. A max_entries of 0 disables the cache
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, leg, version, text):
+        """ Returns the cached translation of text, or None """
+        with self.lock:
+            translation = self.entries.get((leg, version, text))
+            if translation is not None:
+                self.entries.move_to_end((leg, version, text))
+            return translation
+
+    def put(self, leg, version, text, translation):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[(leg, version, text)] = translation
+            self.entries.move_to_end((leg, version, text))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self, leg=None, keep_version=None):
+        """
+        Forgets every translation, or only those of leg, optionally
+        keeping the ones made by model version keep_version
+        """
+        with self.lock:
+            if leg is None:
+                self.entries.clear()
+                return
+            for key in [k for k in self.entries if k[0] == leg and k[1] != keep_version]:
+                del self.entries[key]
+
+    def __len__(self):
+        return len(self.entries)
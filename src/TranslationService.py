@@ -0,0 +1,502 @@
+"""
+Asyncio HTTP/JSON front end for the decoder daemon.
+
+Endpoints:
+    POST /translate  {"leg": working_dir, "text": ...}      -> {"translation": ...}
+    POST /pivot      {"legs": [working_dir, ...], "text": ...} -> {"translation": ..., "pivot": [...]}
+    POST /pivot/document {"legs": [...], "sentences": [...]}   -> {"translations": [...]}
+    POST /document   {"legs": [...], "text": ...}             -> {"translation": ..., "sentences": n}
+    GET  /legs, GET /status, GET /batches, GET /memory
+    GET  /metrics    Prometheus text exposition format
+    POST /reload     {"leg": working_dir (optional), "wait": false}
+    POST /jobs       {"legs": [...], "file": path, "output": path, "priority": 0} -> {"job": id}
+    GET  /jobs, POST /jobs/status {"job": id}, POST /jobs/cancel {"job": id}
+    POST /shutdown
+
+Translation requests may set "timeout", in seconds, overriding the
+service's request_timeout. Work still queued when the deadline passes or
+the client disconnects is dropped, and a pivot does not start its next leg
+once the deadline has passed (504). A request for a leg which is already
+queueing too much is refused with 503 and a Retry-After header.
+Translation requests and jobs may also set "profile", naming one of the
+decoding profiles the daemon serves (GET /legs lists them), such as fast
+or accurate; without one the daemon's default profile is used.
+
+Each client connection is served by a coroutine, so many clients can wait
+on the decoders at once without holding a thread each. Requests are handed
+to the daemon's batchers, whose worker threads keep persistent keep-alive
+connections to the moses servers. HTTP/1.1 keep-alive is honoured for
+clients as well.
+"""
+import os
+import json
+import time
+import asyncio
+import http.client
+import threading
+
+import psutil
+
+import utilities
+from ReplicaPool import Overloaded, DeadlineExceeded
+from TextProcessor import TextProcessor, leg_languages
+
+DAEMON_STATE = "daemon.json"
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable",
+           504: "Gateway Timeout"}
+
+class ServiceError(Exception):
+    """
+    Raised by ServiceClient when the service answers with an error.
+    retry_after is set when the service asked to be retried later
+    """
+    def __init__(self, status, message, retry_after=None):
+        Exception.__init__(self, "{} {}".format(status, message))
+        self.status = status
+        self.retry_after = retry_after
+
+class TranslationService(object):
+    def __init__(self, daemon, host="localhost", port=0, document_parallelism=64,
+        request_timeout=30, verbose=False):
+        self.daemon = daemon
+        self.host = host
+        self.port = port
+        self.document_parallelism = document_parallelism
+        self.request_timeout = request_timeout
+        self.verbose = verbose
+
+        self.loop = None
+        self.stopped = None
+        self.connections = set()
+        self.ready = threading.Event()
+        self.routes = {("POST", "/translate"): self._translate,
+                       ("POST", "/pivot"): self._pivot,
+                       ("POST", "/pivot/document"): self._pivot_document,
+                       ("POST", "/document"): self._document,
+                       ("GET", "/legs"): self._legs,
+                       ("GET", "/status"): self._status,
+                       ("GET", "/batches"): self._batches,
+                       ("GET", "/memory"): self._memory,
+                       ("GET", "/metrics"): self._metrics,
+                       ("POST", "/reload"): self._reload,
+                       ("POST", "/jobs"): self._submit_job,
+                       ("GET", "/jobs"): self._jobs,
+                       ("POST", "/jobs/status"): self._job_status,
+                       ("POST", "/jobs/cancel"): self._cancel_job,
+                       ("POST", "/shutdown"): self._shutdown}
+
+    def _print(self, item):
+        if self.verbose:
+            utilities.flush_print(item)
+
+    def serve_forever(self, on_ready=None):
+        """ Runs the event loop until stop is called """
+        asyncio.run(self._serve(on_ready))
+
+    def stop(self):
+        """ Stops the service. Safe to call from any thread """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def _serve(self, on_ready):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self._print("Translation service listening on port {}\n".format(self.port))
+        if on_ready is not None:
+            on_ready()
+        self.ready.set()
+        await self.stopped.wait()
+        server.close()
+        for writer in list(self.connections):
+            writer.close()
+        await server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        """ Serves requests on one client connection until it closes """
+        self.connections.add(writer)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                dispatch = asyncio.ensure_future(self._dispatch(method, path, body))
+                watcher = asyncio.ensure_future(self._watch_disconnect(reader, dispatch))
+                try:
+                    status, payload, extra = await dispatch
+                finally:
+                    watcher.cancel()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._write_response(writer, status, payload, keep_alive, extra)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def _watch_disconnect(self, reader, task, interval=0.05):
+        """
+        Cancels task, and with it any translations it still has queued,
+        if the client hangs up before it is answered
+        """
+        while not task.done():
+            if reader.at_eof():
+                task.cancel()
+                return
+            await asyncio.sleep(interval)
+
+    async def _read_request(self, reader):
+        """ Parses one HTTP request. Returns None once the client hangs up """
+        line = await reader.readline()
+        if not line:
+            return None
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?")[0], headers, body
+
+    def _write_response(self, writer, status, payload, keep_alive, extra=None):
+        """
+        Sends payload as JSON, or as plain text when it is a string, along
+        with any extra headers
+        """
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        head = "HTTP/1.1 {} {}\r\n".format(status, REASONS.get(status, "")) + \
+            "Content-Type: {}\r\n".format(content_type) + \
+            "Content-Length: {}\r\n".format(len(body)) + \
+            "".join("{}: {}\r\n".format(k, v) for k, v in (extra or {}).items()) + \
+            "Connection: {}\r\n\r\n".format("keep-alive" if keep_alive else "close")
+        writer.write(head.encode("latin-1") + body)
+
+    async def _dispatch(self, method, path, body):
+        """
+        Routes a request, turning failures into JSON error responses.
+        Returns the status, payload and any extra headers
+        """
+        if not any(p == path for _, p in self.routes):
+            return 404, {"error": "unknown endpoint {}".format(path)}, None
+        if (method, path) not in self.routes:
+            return 405, {"error": "{} not allowed on {}".format(method, path)}, None
+        try:
+            request = json.loads(body.decode("utf-8")) if body else {}
+        except ValueError:
+            return 400, {"error": "request body is not valid JSON"}, None
+        try:
+            return 200, await self.routes[(method, path)](request), None
+        except KeyError as e:
+            return 404, {"error": str(e).strip("'\"")}, None
+        except (TypeError, ValueError) as e:
+            return 400, {"error": str(e)}, None
+        except Overloaded as e:
+            return 503, {"error": str(e)}, {"Retry-After": e.retry_after}
+        except DeadlineExceeded as e:
+            return 504, {"error": str(e)}, None
+        except Exception as e:
+            return 502, {"error": str(e)}, None
+
+    def _deadline(self, request):
+        """ The time.time() by which request must be answered, or None """
+        timeout = request.get("timeout", self.request_timeout)
+        if not isinstance(timeout, (int, float)) or timeout < 0:
+            raise ValueError("timeout must be a number of seconds")
+        return time.time() + timeout if timeout else None
+
+    async def _translate_leg(self, working_dir, text, deadline=None, profile=None):
+        """
+        Translates text with one leg. Refuses to start once deadline has
+        passed, and drops the request if it is still queued at deadline
+        """
+        remaining = self.daemon.remaining(working_dir, deadline)
+        future = asyncio.wrap_future(self.daemon.submit(working_dir, text, profile=profile))
+        try:
+            return await asyncio.wait_for(future, remaining)
+        except asyncio.TimeoutError:
+            self.daemon.expired(working_dir)
+            raise DeadlineExceeded("deadline passed translating with {}".format(working_dir))
+
+    async def _translate(self, request):
+        text = self._require(request, "text")
+        leg = self._require(request, "leg")
+        deadline = self._deadline(request)
+        profile = request.get("profile")
+        self.daemon.admit([leg], profile)
+        return {"translation": await self._translate_leg(leg, text, deadline, profile)}
+
+    async def _pivot(self, request):
+        text = self._require(request, "text")
+        legs = self._require(request, "legs")
+        deadline = self._deadline(request)
+        profile = request.get("profile")
+        self.daemon.admit(legs, profile)
+        steps = []
+        for leg in legs:
+            text = await self._translate_leg(leg, text, deadline, profile)
+            steps.append(text)
+        return {"translation": text, "pivot": steps[:-1]}
+
+    async def _pivot_document(self, request):
+        """
+        Translates a list of sentences, or text with one sentence per line,
+        with the legs pipelined
+        """
+        legs = self._require(request, "legs")
+        sentences = request["sentences"] if "sentences" in request else \
+            self._require(request, "text").splitlines()
+        deadline = self._deadline(request)
+        profile = request.get("profile")
+        self.daemon.admit(legs, profile)
+        translations = await self.loop.run_in_executor(None,
+            self.daemon.pivot_document, legs, sentences, deadline, profile)
+        return {"translations": translations}
+
+    async def _document(self, request):
+        """
+        Translates free text through legs. The text is split into
+        paragraphs and sentences and tokenized in the source language,
+        every sentence is sent to the decoders at once, and the output is
+        detokenized and put back together. Languages are read from leg
+        names such as es-en.working unless source_lang or target_lang
+        are given
+        """
+        legs = self._require(request, "legs")
+        text = self._require(request, "text")
+        if not legs:
+            raise ValueError("no legs given")
+        deadline = self._deadline(request)
+        profile = request.get("profile")
+        self.daemon.admit(legs, profile)
+        source = TextProcessor(request.get("source_lang") or leg_languages(legs[0])[0])
+        target = TextProcessor(request.get("target_lang") or leg_languages(legs[-1])[1])
+        limit = asyncio.Semaphore(self.document_parallelism)
+
+        async def translate(sentence):
+            async with limit:
+                for leg in legs:
+                    sentence = await self._translate_leg(leg, sentence, deadline, profile)
+            return sentence
+
+        paragraphs = [[source.tokenize(s) for s in source.split_sentences(p)]
+                      for p in source.paragraphs(text)]
+        translated = await asyncio.gather(*[translate(s) for p in paragraphs for s in p])
+        out, i = [], 0
+        for p in paragraphs:
+            out.append(" ".join(target.detokenize(t) for t in translated[i:i + len(p)]))
+            i += len(p)
+        return {"translation": "\n\n".join(out), "sentences": len(translated)}
+
+    async def _legs(self, request):
+        return {"legs": self.daemon.legs(), "profiles": self.daemon.profile_names(),
+                "default_profile": self.daemon.default_profile}
+
+    async def _status(self, request):
+        return self.daemon.status()
+
+    async def _batches(self, request):
+        return self.daemon.batch_stats()
+
+    async def _memory(self, request):
+        return await self.loop.run_in_executor(None, self.daemon.memory)
+
+    async def _metrics(self, request):
+        return self.daemon.metrics_text()
+
+    async def _reload(self, request):
+        """
+        Loads the latest model of one leg, or of all legs, into new
+        replicas. Returns at once unless wait is set, in which case it
+        answers with the model version now serving each leg
+        """
+        leg = request.get("leg")
+        if leg is not None:
+            self.daemon._pool_key(leg)
+        if not request.get("wait", False):
+            self.daemon.reload_in_background(leg)
+            return {"reloading": [leg] if leg else self.daemon.legs()}
+        versions = await self.loop.run_in_executor(None, self.daemon.reload, leg)
+        return {"reloaded": versions}
+
+    async def _submit_job(self, request):
+        """
+        Queues a file on the daemon's host, one sentence per line, as a bulk
+        job. Lower priority numbers run first; interactive requests always
+        come before any job
+        """
+        legs = self._require(request, "legs")
+        src_file = self._require(request, "file")
+        if not os.path.isfile(src_file):
+            raise ValueError("{} not found".format(src_file))
+        job = self.daemon.jobs.submit(legs, src_file, request.get("output"),
+            request.get("chunk_size"), request.get("priority", 0), request.get("profile"))
+        return {"job": job}
+
+    async def _jobs(self, request):
+        return {"jobs": self.daemon.jobs.status()}
+
+    async def _job_status(self, request):
+        return self.daemon.jobs.status(self._require(request, "job"))
+
+    async def _cancel_job(self, request):
+        return self.daemon.jobs.cancel(self._require(request, "job"))
+
+    async def _shutdown(self, request):
+        self.loop.call_soon(self.daemon.shutdown)
+        return {"shutdown": True}
+
+    def _require(self, request, field):
+        if field not in request:
+            raise ValueError("missing field '{}'".format(field))
+        return request[field]
+
+class ServiceClient(object):
+    """
+    Blocking client for the translation service. Keeps one persistent
+    connection; use one client per thread
+    """
+    def __init__(self, port, host="localhost", timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    @staticmethod
+    def attach(working_dirs, state_file=DAEMON_STATE):
+        """
+        Returns a client for the running service if it serves every leg in
+        working_dirs, otherwise None
+        """
+        if not utilities.file_exists(state_file):
+            return None
+        state = json.load(open(state_file, 'r'))
+        if not psutil.pid_exists(state["pid"]):
+            return None
+        client = ServiceClient(state["port"])
+        try:
+            legs = client.legs()
+        except (OSError, ServiceError):
+            return None
+        if not all(os.path.abspath(d) in legs for d in working_dirs):
+            return None
+        return client
+
+    def _send(self, method, path, body=None):
+        """
+        Sends a request, reconnecting once if the connection dropped.
+        Returns the status, the body and the response
+        """
+        headers = {"Content-Type": "application/json"}
+        for attempt in range(2):
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                return response.status, response.read().decode("utf-8"), response
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.connection.close()
+                if attempt == 1:
+                    raise
+
+    def _request(self, method, path, payload=None):
+        """ Sends a JSON request and decodes the JSON reply """
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        status, text, response = self._send(method, path, body)
+        result = json.loads(text)
+        if status != 200:
+            retry_after = response.getheader("Retry-After")
+            raise ServiceError(status, result.get("error", ""),
+                int(retry_after) if retry_after else None)
+        return result
+
+    def _with_timeout(self, payload, timeout, profile=None):
+        """
+        Adds a per-request timeout, in seconds, and decoding profile when
+        they are given
+        """
+        if timeout is not None:
+            payload["timeout"] = timeout
+        if profile is not None:
+            payload["profile"] = profile
+        return payload
+
+    def translate(self, working_dir, text, timeout=None, profile=None):
+        payload = {"leg": os.path.abspath(working_dir), "text": text}
+        return self._request("POST", "/translate",
+            self._with_timeout(payload, timeout, profile))["translation"]
+
+    def pivot(self, working_dirs, text, timeout=None, profile=None):
+        payload = {"legs": [os.path.abspath(d) for d in working_dirs], "text": text}
+        return self._request("POST", "/pivot",
+            self._with_timeout(payload, timeout, profile))["translation"]
+
+    def pivot_document(self, working_dirs, sentences, timeout=None, profile=None):
+        payload = {"legs": [os.path.abspath(d) for d in working_dirs], "sentences": list(sentences)}
+        return self._request("POST", "/pivot/document",
+            self._with_timeout(payload, timeout, profile))["translations"]
+
+    def document(self, working_dirs, text, timeout=None, profile=None):
+        payload = {"legs": [os.path.abspath(d) for d in working_dirs], "text": text}
+        return self._request("POST", "/document",
+            self._with_timeout(payload, timeout, profile))["translation"]
+
+    def submit_job(self, working_dirs, src_file, out_file=None, chunk_size=None, priority=0,
+                   profile=None):
+        payload = {"legs": [os.path.abspath(d) for d in working_dirs],
+                   "file": os.path.abspath(src_file), "priority": priority}
+        if profile is not None:
+            payload["profile"] = profile
+        if out_file is not None:
+            payload["output"] = os.path.abspath(out_file)
+        if chunk_size is not None:
+            payload["chunk_size"] = chunk_size
+        return self._request("POST", "/jobs", payload)["job"]
+
+    def job_status(self, job_id=None):
+        if job_id is None:
+            return self._request("GET", "/jobs")["jobs"]
+        return self._request("POST", "/jobs/status", {"job": job_id})
+
+    def cancel_job(self, job_id):
+        return self._request("POST", "/jobs/cancel", {"job": job_id})
+
+    def legs(self):
+        return self._request("GET", "/legs")["legs"]
+
+    def status(self):
+        return self._request("GET", "/status")
+
+    def batch_stats(self):
+        return self._request("GET", "/batches")
+
+    def memory(self):
+        return self._request("GET", "/memory")
+
+    def metrics(self):
+        """ Returns the service's metrics as exposition format text """
+        return self._send("GET", "/metrics")[1]
+
+    def reload(self, working_dir=None, wait=True):
+        payload = {"wait": wait}
+        if working_dir is not None:
+            payload["leg"] = os.path.abspath(working_dir)
+        return self._request("POST", "/reload", payload)
+
+    def shutdown(self):
+        return self._request("POST", "/shutdown", {})
+
+    def close(self):
+        self.connection.close()
@@ -3,6 +3,7 @@ Source code for tuning the translation system
 """
 import os
 import sys
+import json
 import subprocess
 
 import utilities
@@ -53,6 +54,48 @@ class Tune(object):
             " &> mert.out; cd .."
         subprocess.call(command, shell=True)
         self._print("Done\n")
+        self.report_tune_savings(src_tune, working_dir)
+
+    def iteration_times(self, working_dir):
+        """
+        Seconds MERT spent decoding the tune set on each iteration, from
+        when it wrote each run's moses.ini to when the run's output was done
+        """
+        times, run = [], 1
+        mert_dir = working_dir + "/mert-work/"
+        while utilities.file_exists(mert_dir + "run{}.out".format(run)) and \
+            utilities.file_exists(mert_dir + "run{}.moses.ini".format(run)):
+            times.append(os.path.getmtime(mert_dir + "run{}.out".format(run)) -
+                         os.path.getmtime(mert_dir + "run{}.moses.ini".format(run)))
+            run += 1
+        return times
+
+    def report_tune_savings(self, src_tune, working_dir):
+        """
+        Estimates the time a selected tune set saved on each MERT
+        iteration. Only the decoding time on the selected set is measured;
+        decoding time grows with the source tokens decoded, so the whole
+        tune split is estimated to take that time over the share of the
+        split's tokens the selection kept. Saved beside the other MERT
+        output, and returned, when the tune set was selected
+        """
+        selection = src_tune + ".selection.json"
+        times = self.iteration_times(working_dir)
+        if not utilities.file_exists(selection) or not times:
+            return None
+        selected = json.load(open(selection, 'r'))
+        ratios = {os.path.abspath(f): ratio for f, ratio in selected["files"].items()}
+        ratio = ratios.get(os.path.abspath(src_tune), selected["decode_work_ratio"])
+        if not ratio:
+            return None
+        mean = sum(times) / len(times)
+        report = {"iterations": len(times), "mean_decode_s": round(mean, 2),
+            "estimated_full_split_decode_s": round(mean / ratio, 2),
+            "estimated_saved_per_iteration_s": round(mean / ratio - mean, 2)}
+        json.dump(report, open(working_dir + "/mert-work/tune_savings.json", 'w'), indent=1)
+        self._print("MERT decoded for {:.0f}s per iteration, an estimated {:.0f}s each less "
+            "than the whole tune split would take\n".format(mean, report["estimated_saved_per_iteration_s"]))
+        return report
 
 
 def main():
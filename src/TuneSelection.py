@@ -0,0 +1,54 @@
+"""
+Choosing a small tune set. MERT decodes the whole tune set on every
+iteration, so a tune split of hundreds of thousands of sentences makes
+each iteration take hours, while a few thousand sentences spread over
+sentence lengths the way the split is tune the weights about as well.
+The sentences left out go back to training
+"""
+import numpy
+
+def select_tune(lengths, keys, size, strata=10):
+    """
+    Of the tune split sentences with the given source lengths and pair
+    keys, picks at most size. Repeated pairs are dropped, keeping the
+    first, and the rest are cut into strata length bands of about equal
+    population, each sampled in proportion to its share. Returns the
+    sorted indices picked and a report of the selection
+    """
+    lengths = numpy.asarray(lengths, dtype=numpy.int64)
+    unique = numpy.sort(numpy.unique(keys, return_index=True)[1])
+    edges = numpy.unique(numpy.quantile(lengths[unique],
+        numpy.linspace(0, 1, strata + 1)[1:-1])) if len(unique) else numpy.zeros(0)
+    band = numpy.searchsorted(edges, lengths[unique], side='left')
+    counts = numpy.bincount(band, minlength=len(edges) + 1)
+    quotas = _quotas(counts, min(size, len(unique)))
+
+    chosen = [numpy.zeros(0, dtype=numpy.int64)]
+    for b, quota in enumerate(quotas):
+        members = unique[band == b]
+        chosen.append(numpy.random.choice(members, quota, replace=False))
+    chosen = numpy.sort(numpy.concatenate(chosen))
+
+    bounds = [int(lengths[unique][band == b].max()) if count else 0 for b, count in enumerate(counts)]
+    report = {"tune_split": len(lengths), "duplicates": len(lengths) - len(unique),
+        "selected": len(chosen), "returned_to_train": len(lengths) - len(chosen),
+        "source_tokens": int(lengths.sum()), "selected_source_tokens": int(lengths[chosen].sum()),
+        "strata": [{"max_len": bound, "sentences": int(count), "selected": int(quota)}
+                   for bound, count, quota in zip(bounds, counts, quotas)]}
+    report["decode_work_ratio"] = round(report["selected_source_tokens"] /
+        max(report["source_tokens"], 1), 6)
+    return chosen, report
+
+def _quotas(counts, size):
+    """
+    Splits size among bands of counts sentences in proportion to them,
+    by largest remainder
+    """
+    total = counts.sum()
+    if not total:
+        return numpy.zeros(len(counts), dtype=numpy.int64)
+    exact = counts * size / total
+    quotas = numpy.floor(exact).astype(numpy.int64)
+    short = size - quotas.sum()
+    quotas[numpy.argsort(quotas - exact, kind="stable")[:short]] += 1
+    return numpy.minimum(quotas, counts)
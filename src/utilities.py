@@ -1,5 +1,8 @@
 import os
+import re
 import sys
+import glob
+import hashlib
 
 import ntpath
 import pickle
@@ -24,6 +27,11 @@ def dir_exists(directory):
     """ Retuns true if directory exists """
     return os.path.isdir(directory)
 
+def files_with_prefix_exist(prefix):
+    """ Returns true if any file begins with prefix, such as the .minphr
+    file behind a compact phrase table path """
+    return len(glob.glob(glob.escape(prefix) + "*")) > 0
+
 def files_exist(filelist):
     """ Given a list of files, returns true if all exist """
     for f in filelist:
@@ -57,6 +65,32 @@ def ttt_wipe_files(train_files, tune_files, test_files):
     for ls in [train_files, tune_files, test_files]:
         wipe_files(ls)
 
+def source_ngrams(filename, max_len):
+    """ Returns the set of every n-gram in filename up to max_len tokens """
+    ngrams = set()
+    for line in open(filename, 'r'):
+        tokens = line.split()
+        for i in range(len(tokens)):
+            for j in range(i + 1, min(i + max_len, len(tokens)) + 1):
+                ngrams.add(' '.join(tokens[i:j]))
+    return ngrams
+
+def model_fingerprint(moses_ini):
+    """
+    Hashes the contents of moses.ini together with the size and
+    modification time of every file it references, including the files
+    behind binarized table prefixes. Changes whenever a leg is retrained
+    or retuned
+    """
+    digest = hashlib.sha1()
+    text = open(moses_ini, 'r').read()
+    digest.update(str.encode(text))
+    for path in re.findall(r"path=(\S+)", text):
+        for f in sorted(glob.glob(glob.escape(path) + "*")):
+            stat = os.stat(f)
+            digest.update(str.encode("{}:{}:{}".format(f, stat.st_size, stat.st_mtime)))
+    return digest.hexdigest()
+
 def isabsolute(path):
     """ Returns true if path is absolute """
     return os.path.isabs(path)